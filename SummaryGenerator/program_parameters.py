@@ -1,12 +1,14 @@
 
 """
     main(station, database, "2025:001:00:00:00", "2025:071:00:00:00", "report.pdf", "%", "0")
-    mariadb.connect(host='56d09x2.phys.utas.edu.au', user='auscope', passwd='password')
+    database settings (host, user, password, database name) are read from database.config in the top directory
 """
 
 import json
 from pprint import pprint
 
+import databaseAccess
+
 class Config:
 
         class Args:
@@ -26,10 +28,11 @@ class Config:
              for db connector
             """
             def __init__(self):
-                self.host = "56d09x2.phys.utas.edu.au"
-                self.name="auscopeDB"
-                self.user = "auscope"
-                self.pw = "password"
+                db_config = databaseAccess.loadConfig()
+                self.host = db_config['host']
+                self.name = db_config['name']
+                self.user = db_config['user']
+                self.pw = db_config['passwd']
 
         class Defaults:
             """
@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 
-import MySQLdb as mariadb
 from astropy.table import vstack, Table, Column
 from astropy.time import Time
 from astropy.io import ascii
@@ -23,6 +22,9 @@ from SummaryGenerator.createReport import *
 from SummaryGenerator.stationPosition import get_station_positions
 from SummaryGenerator.scheduleStatistics import get_glovdh_piecharts, get_glovdh_barchart
 from SummaryGenerator.utilities import datetime_to_fractional_year, save_plt, stationParse
+import databaseAccess
+import databaseSchema
+import databaseSnapshot
 
 ########
 # TODO #
@@ -169,6 +171,10 @@ def parseFunc():
     parser.add_argument('reverse_search',
                         default=0,
                         help="""Change SQL search string clause from 'LIKE' to 'NOT LIKE.'""")
+    parser.add_argument('--unified-schema', dest='unified', action='store_true', default=False,
+                        help="""Read from the unified station_sessions table instead of the per-station table.""")
+    parser.add_argument('--snapshot-dir', dest='snapshot_dir', default=None,
+                        help="""Read the station data from this Parquet snapshot (see databaseSnapshot.py) instead of the database.""")
     # if reverse_search = 0 then  VGOS only
     # else if reverse_search =1 then LEGACY (R....)
     # Isn't this backwards given that the sql_search = v%
@@ -177,12 +183,16 @@ def parseFunc():
     return args
 
 
+def missing(value):
+    # NULLs arrive as NaN in the numeric columns (see extractStationColumns)
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
 def wRmsAnalysis(table_input):
     table = table_input.copy()
     # filter dummy data
     bad_data = []
     for i in range(0, len(table['W_RMS_del'])):
-        if table['W_RMS_del'][i] == -999:
+        if table['W_RMS_del'][i] == -999 or missing(table['W_RMS_del'][i]):
             bad_data.append(i)
     table.remove_rows(bad_data)
     time_data = Column(table['Date'], dtype=Time)
@@ -223,7 +233,7 @@ def performanceAnalysis(table_input):
     # filter sessions with 0% data
     bad_data = []
     for i in range(0, len(table['Performance'])):
-        if table['Performance'][i] == 0:
+        if table['Performance'][i] == 0 or missing(table['Performance'][i]):
             bad_data.append(i)
     table.remove_rows(bad_data)
     time_data = Column(table['Date'], dtype=Time)
@@ -269,7 +279,7 @@ def posAnalysis(table_input, coord):
     # filter sessions with 0% data
     bad_data = []
     for i in range(0, len(table[col_name])):
-        if table[col_name][i] == 0:
+        if table[col_name][i] == 0 or missing(table[col_name][i]):
             bad_data.append(i)
     table.remove_rows(bad_data)
     time_data = Column(table['Date'], dtype=Time)
@@ -302,7 +312,7 @@ def usedVsRecoveredAnalysis(table_input):
     bad_data = []
 
     for i in range(0, len(table['Performance_UsedVsRecov'])):
-        if table['Performance_UsedVsRecov'][i] == 0 or table['Performance_UsedVsRecov'][i] == None:
+        if table['Performance_UsedVsRecov'][i] == 0 or missing(table['Performance_UsedVsRecov'][i]):
             bad_data.append(i)
 
     table.remove_rows(bad_data)
@@ -335,7 +345,7 @@ def detectRate(table_input, band):
     bad_data = []
 
     for i in range(0, len(table[col_name])):
-        if table[col_name][i] == 0 or table[col_name][i] == None:
+        if table[col_name][i] == 0 or missing(table[col_name][i]):
             bad_data.append(i)
 
     table.remove_rows(bad_data)
@@ -420,39 +430,40 @@ def problemExtract_v1(table_input):
     return problem_list
 
 
-def extractStationData(station_code, database_name, mjd_start, mjd_stop, search='%', like_or_notlike=0):
+# Report columns that are not numeric, everything else is fetched into float64 arrays.
+REPORT_OBJECT_COLUMNS = {"ExpID": object, "Date": object, "Notes": object}
+REPORT_COLUMNS = ["ExpID", "Date", "Date_MJD", "Performance", "Performance_UsedVsRecov", "session_fit", "W_RMS_del", "Detect_Rate_X", "Detect_Rate_S", "Total_Obs", "Notes", "Pos_X", "Pos_Y", "Pos_Z", "Pos_E", "Pos_N", "Pos_U"]
 
+def extractStationColumns(station_code, database_name, mjd_start, mjd_stop, search='%', like_or_notlike=0, unified=False, chunk_size=2000):
+    # Report rows of a station, streamed from the server into typed numpy arrays and returned as an astropy Table wrapping
+    # them, so no list of row tuples is built.
     if float(like_or_notlike) == 1:
         like = "NOT LIKE"
     else:
         like = "LIKE"
-    
-    # NOTE
-    # added a remote host here so can run locally (for testing)
-
-    # test
-    #conn = mariadb.connect(config.db.host, config.db.user, config.db.pw)
-
-    # deploy, running on same machine hosting the database
-    conn = mariadb.connect(user='auscope', passwd='password')
-
-    cursor = conn.cursor()
-    query = "USE " + database_name +";"
-
-    print(query)
-
-    cursor.execute(query)
-    query = "SELECT ExpID, Date, Date_MJD, Performance, Performance_UsedVsRecov, session_fit, W_RMS_del, Detect_Rate_X, Detect_Rate_S, Total_Obs, Notes, Pos_X, Pos_Y, Pos_Z, Pos_E, Pos_N, Pos_U FROM " + station_code+ " WHERE ExpID " + like + " \"" + search + "\" AND Date_MJD > " + str(mjd_start) + " AND Date_MJD < " + str(mjd_stop) + " ORDER BY DATE ASC;"
-
-    print(query)
-
-    cursor.execute(query)
-    result = cursor.fetchall()
-    col_names = ["ExpID", "Date", "Date_MJD", "Performance", "Performance_UsedVsRecov", "session_fit", "W_RMS_del", "Detect_Rate_X", "Detect_Rate_S", "Total_Obs", "Notes", "Pos_X", "Pos_Y", "Pos_Z", "Pos_E", "Pos_N", "Pos_U"]
-    return result, col_names 
-
-
-def main(stat_code, db_name, start, stop, output_name, search='%', reverse_search=0):
+    query, params = databaseSchema.reportQuery(station_code, REPORT_COLUMNS, search, like, mjd_start, mjd_stop, unified)
+    print(query, params)
+    with databaseAccess.connection(database_name) as conn:
+        columns = databaseAccess.fetchColumns(conn, query, params, REPORT_COLUMNS, REPORT_OBJECT_COLUMNS, chunk_size)
+    return Table([columns[name] for name in REPORT_COLUMNS], names=REPORT_COLUMNS, copy=False)
+
+def snapshotSessionType(search, like_or_notlike):
+    # (usable, Session_Type) - the snapshot can serve the VGOS/legacy split and the match-everything search.
+    if search == databaseSchema.SESSION_TYPE_SEARCH:
+        return True, 'L' if float(like_or_notlike) == 1 else 'V'
+    if search == '%' and float(like_or_notlike) != 1:
+        return True, None
+    return False, None
+
+def extractStationSnapshot(station_code, snapshot_dir, mjd_start, mjd_stop, search='%', like_or_notlike=0):
+    # Same rows as extractStationColumns, read from the Parquet snapshot as columns. Returns None if the snapshot can't serve it.
+    usable, session_type = snapshotSessionType(search, like_or_notlike)
+    if not usable or not databaseSnapshot.available() or not os.path.isdir(os.path.join(snapshot_dir, 'station=' + str(station_code))):
+        return None
+    columns = databaseSnapshot.tableColumns(databaseSnapshot.readSnapshot(station_code, REPORT_COLUMNS, mjd_start, mjd_stop, session_type, snapshot_dir))
+    return Table([columns[name] for name in REPORT_COLUMNS], names=REPORT_COLUMNS, copy=False)
+
+def main(stat_code, db_name, start, stop, output_name, search='%', reverse_search=0, unified=False, snapshot_dir=None):
 
     print("##########################################")
     print(f"Generating Summary for Station {stat_code}.")
@@ -472,28 +483,24 @@ def main(stat_code, db_name, start, stop, output_name, search='%', reverse_searc
     print(f"Report type: {'VGOS' if vgos else 'Legacy'}.")
     print("##########################################")
 
-    # create the info table which will be used to generate the rest of it...
-    result, col_names = extractStationData(stat_code, db_name, start_time.mjd, stop_time.mjd, search, reverse_search)
-    # turn this into an astropy table datastructure
-    try:
-        table = Table(rows=result, names=col_names)
-    except Exception as e:
-        raise Exception("Error creating Table (astropy).\n{e}") from e
-        # i think this fails for the Ht VGOS case...
+    # create the info table which will be used to generate the rest of it, from the snapshot if there is one
+    table = None
+    if snapshot_dir != None:
+        table = extractStationSnapshot(stat_code, snapshot_dir, start_time.mjd, stop_time.mjd, search, reverse_search)
+        if table is None:
+            print("Snapshot can't serve this report, reading from the database.")
+        elif len(table) == 0:
+            raise ValueError("No sessions in the snapshot for this period.")
+    if table is None:
+        table = extractStationColumns(stat_code, db_name, start_time.mjd, stop_time.mjd, search, reverse_search, unified)
+        if len(table) == 0:
+            raise ValueError("No sessions in the database for this period.")
 
     # once we have this we can produce the report elements that sumirise this...
 
     if config.ctrl.debug:
-        print("result:")
-        pprint(result)
-        print("col_names:")
-        pprint(col_names)
-
-    print(f"Number of columns in result: {len(result[0])}")
-    print(f"Number of column names: {len(col_names)}")
-
-    if len(result[0]) != len(col_names):
-        raise ValueError("Mismatched names to data columns.")
+        print("table:")
+        table.pprint_all()
 
     # create the dataclass that contains the summary data
     stat_sum = StationSummariser(stat_code, vgos, start_time, stop_time, table)
@@ -511,7 +518,7 @@ if __name__ == '__main__':
 
     # deploy, will be called by updateReports
     args = parseFunc()
-    main(args.station, args.sql_db_name, args.date_start, args.date_stop, args.output_name, args.sql_search, args.reverse_search)
+    main(args.station, args.sql_db_name, args.date_start, args.date_stop, args.output_name, args.sql_search, args.reverse_search, args.unified, args.snapshot_dir)
 
     """
     # test
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import re
+from datetime import datetime
+from astropy.time import Time
+
+# Single pass tokenizer for the IVS analysis reports. The report is walked line by line once, splitting it into the
+# dashed sections as it goes, and turned into a dict:
+#   meta       - exp_code, analyser, date, date_mjd and vgosdb (the raw tag, as found after the first '(' or '$')
+#   session_fit - the 'Session fit:' value of section 1, None if missing
+#   stations   - name -> {'performance', 'recovered', 'used', 'row', 'problems'}: the performance table row of a station
+#                (section 2) and the problem lines of section 0 mentioning it. Every word of a problem line is indexed
+#                (punctuation such as 'HOBART12:' stripped), as the station names can appear anywhere in a line.
+# Lookups by station are then dictionary gets, so the cost depends on the report length and not on how many stations are
+# configured. The extractors in parseFiles.py and parseAnalysisSpool.py read from this dict.
+
+SECTION_SEPARATOR = '-----------------------------------------'
+PROBLEM_INDENT = ' '*11 # continuation lines of a problem in section 0
+PROBLEM_WORD = r'[A-Z0-9_-]+' # station names in problem lines, without any punctuation around them
+
+def percent2decimal(percent_string):
+    return float(percent_string.strip('%'))/100
+
+def stationEntry(stations, name):
+    return stations.setdefault(name, {'performance': None, 'recovered': None, 'used': None, 'row': None, 'problems': []})
+
+def performanceRow(entry, row):
+    # row - the performance table line from the station name on, e.g. 'HOBART12    95.2%   120   110   105'
+    entry['row'] = row
+    percentage = [s for s in row.split() if '%' in s]
+    if len(percentage) > 0 and percentage[0] != 'nan%':
+        entry['performance'] = percent2decimal(percentage[0])
+    fields = [x for y in row.split('  ') if (x := y.strip())]
+    try:
+        entry['recovered'] = float(fields[2])
+        entry['used'] = float(fields[3])
+    except (IndexError, ValueError):
+        pass
+
+def after(line, marker, length):
+    # First `length` characters after an occurrence of marker that has at least that many characters following it.
+    start = line.find(marker)
+    while start >= 0:
+        if len(line) - start - 1 >= length:
+            return line[start + 1:start + 1 + length]
+        start = line.find(marker, start + 1)
+    return None
+
+def tokenizeReport(contents, exp_code):
+    found = {}
+    session_fit = None
+    stations = {}
+    section = 0
+    last_problems = []
+    for line in contents.split('\n'):
+        separators = line.count(SECTION_SEPARATOR)
+        if separators > 0:
+            section += separators
+            continue
+        if section == 0:
+            # metadata, the first match of each wins
+            for key, marker, length in [('paren_tag', '(', 15), ('paren_date', '(', 8), ('dollar_tag', '$', 9), ('dollar_date', '$', 7)]:
+                if key not in found:
+                    value = after(line, marker, length)
+                    if value != None:
+                        found[key] = value
+            if 'report_for' not in found and 'Analysis Report for ' in line:
+                head, tail = line.rsplit('Analysis Report for ', 1)
+                found['report_for'] = tail.split()[0] if len(tail.split()) > 0 else None
+                if head.strip() != '':
+                    found['analyser'] = head.strip()
+            # problems, indexed by every word of the line
+            if line.startswith(PROBLEM_INDENT) and len(last_problems) > 0:
+                for problems in last_problems:
+                    problems[-1] += line
+                last_problems = []
+                continue
+            last_problems = []
+            for word in set(re.findall(PROBLEM_WORD, line)):
+                problems = stationEntry(stations, word)['problems']
+                problems.append(line[line.find(word):])
+                last_problems.append(problems)
+        elif section == 1:
+            if 'Session fit:' in line:
+                session_fit = line.split()[2]
+        elif section == 2 and '%' in line:
+            # performance table rows, the first row a station name appears in wins
+            for word in line.split():
+                entry = stationEntry(stations, word)
+                if entry['row'] == None:
+                    performanceRow(entry, line[line.find(word):])
+    return {'meta': reportMeta(found, exp_code), 'session_fit': session_fit, 'stations': stations}
+
+def reportMeta(found, exp_code):
+    if found.get('paren_tag') != None and exp_code in found['paren_tag']:
+        vgosdb = found['paren_tag']
+        date = datetime.strptime(found['paren_date'], '%Y%m%d').strftime('%Y-%m-%d')
+    elif found.get('dollar_tag') != None:
+        vgosdb = found['dollar_tag']
+        date = datetime.strptime(found['dollar_date'], '%y%b%d').strftime('%Y-%m-%d')
+    else:
+        raise ValueError('No vgosDB tag found in the analysis report for ' + str(exp_code))
+    if found.get('report_for') == None:
+        raise ValueError('No experiment code found in the analysis report for ' + str(exp_code))
+    return {'exp_code': found['report_for'], 'analyser': found.get('analyser', '-'), 'date': date, 'date_mjd': Time(date).mjd, 'vgosdb': vgosdb}
+
+def readReport(filename, exp_code):
+    with open(filename) as file:
+        return tokenizeReport(file.read(), exp_code)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+import os
+import tempfile
+
+# Atomic file writes shared by the downloader, the negative cache, the master schedule session tables and the database
+# snapshot. The file is written next to its destination and renamed into place once complete, so an interrupted write
+# (or a parallel worker) never leaves a truncated file where a reader will find it.
+
+# mkstemp creates files readable by the owner only, the written files get the mode a plain open() would give them. The
+# umask can only be read by setting it, so this is done once at import rather than from the writing threads.
+UMASK = os.umask(0)
+os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK
+
+def writeAtomic(local_filename, writer):
+    # writer(file) is given the temporary file opened in binary mode, the temporary file is removed if it raises.
+    local_dir = os.path.dirname(local_filename) or '.'
+    fd, tmp_filename = tempfile.mkstemp(dir=local_dir, prefix='.' + os.path.basename(local_filename), suffix='.part')
+    try:
+        with os.fdopen(fd, "wb") as lf:
+            writer(lf)
+        os.chmod(tmp_filename, FILE_MODE)
+        os.replace(tmp_filename, local_filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
+    return local_filename
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+import numpy as np
+
+# Per baseline and band qcode histograms and SNR ratios from the correlator reports, kept in the baseline_qcodes table
+# next to the station tables. The rows are taken from the same parsed QCODES table the station sums come from (see
+# corrReport.baselineRows), for every baseline with at least one configured station, so a station's detection rate can be
+# broken down by the partner station - e.g. a heatmap of partner station by session showing whether a bad session was
+# the station itself or one baseline. Each ingest of a corr report replaces all of the experiment's rows.
+
+# Source other modules
+import databaseAccess
+import databaseSchema
+import corrReport
+
+dirname = os.path.dirname(__file__)
+
+BASELINE_COLUMNS = ['ExpID', 'station1', 'station2', 'band', 'Date_MJD', 'good', 'bad', 'total', 'qcodes', 'snr_ratio', 'snr_n']
+BASELINE_TABLE = """CREATE TABLE IF NOT EXISTS baseline_qcodes (ExpID VARCHAR(10) NOT NULL, station1 VARCHAR(8) NOT NULL, station2 VARCHAR(8) NOT NULL,
+                        band CHAR(1) NOT NULL, Date_MJD DOUBLE, good INT NOT NULL, bad INT NOT NULL, total INT NOT NULL, qcodes VARCHAR(128) NOT NULL,
+                        snr_ratio DOUBLE, snr_n INT, PRIMARY KEY (ExpID, station1, station2, band));"""
+BASELINE_INDEXES = [('baselines_station1_date', 'station1, Date_MJD'), ('baselines_station2_date', 'station2, Date_MJD')]
+
+# Values a baseline matrix can be made of, as SQL expressions over the table columns.
+MATRIX_VALUES = {'detect_rate': 'good*1.0/NULLIF(total, 0)',
+                 'good_vs_bad': 'good*1.0/NULLIF(good + bad, 0)',
+                 'total': 'total',
+                 'snr_ratio': 'snr_ratio'}
+
+def createBaselineTable(cursor):
+    cursor.execute(BASELINE_TABLE)
+    for name, columns in BASELINE_INDEXES:
+        databaseSchema.addIndex(cursor, 'baseline_qcodes', name, columns)
+
+def baselineEntries(exp_id, date_mjd, rows):
+    # corrReport.baselineRows rows -> rows ordered as BASELINE_COLUMNS
+    return [[str(exp_id), row[0], row[1], row[2], date_mjd] + row[3:] for row in rows]
+
+def writeBaselines(cursor, baselines):
+    # baselines - {ExpID: (Date_MJD, corrReport.baselineRows rows)}. The experiments' existing rows are replaced, so baselines
+    # no longer in a corrected report are removed. Returns the number of rows written.
+    entries = []
+    for exp_id, (date_mjd, rows) in baselines.items():
+        entries.extend(baselineEntries(exp_id, date_mjd, rows))
+    if len(baselines) > 0:
+        cursor.executemany("DELETE FROM baseline_qcodes WHERE ExpID = %s;", [[str(exp_id)] for exp_id in baselines])
+    if len(entries) > 0:
+        cursor.executemany("INSERT INTO baseline_qcodes (" + ", ".join(BASELINE_COLUMNS) + ") VALUES (" + ", ".join(['%s']*len(BASELINE_COLUMNS)) + ");", entries)
+    return len(entries)
+
+def qcodeHistogram(qcodes):
+    # stored 'n,n,...' histogram -> {qcode: count} in corrReport.QCODE_COLUMNS order
+    return dict(zip(corrReport.QCODE_COLUMNS, [int(x) for x in qcodes.split(',')]))
+
+def baselineMatrix(cursor, station, value='detect_rate', band='X', mjd_start=None, mjd_stop=None):
+    # Baseline by session matrix of one station: {'partners': partner station codes (rows), 'experiments': ExpIDs and
+    # 'mjd': their Date_MJD (columns, in date order), 'matrix': float array (partners x sessions), NaN where the baseline
+    # wasn't observed or the value is missing}. Both orders of the baseline are read, through the station1 and station2
+    # indexes.
+    station = str(station)
+    conditions = ["band = %s"]
+    params = [band]
+    if mjd_start != None:
+        conditions.append("Date_MJD >= %s")
+        params.append(mjd_start)
+    if mjd_stop != None:
+        conditions.append("Date_MJD <= %s")
+        params.append(mjd_stop)
+    where = " AND ".join(conditions)
+    expression = MATRIX_VALUES[value]
+    cursor.execute("SELECT ExpID, Date_MJD, station2, " + expression + " FROM baseline_qcodes WHERE station1 = %s AND " + where +
+                   " UNION ALL SELECT ExpID, Date_MJD, station1, " + expression + " FROM baseline_qcodes WHERE station2 = %s AND " + where + ";",
+                   [station] + params + [station] + params)
+    rows = cursor.fetchall()
+    sessions = sorted(set((row[1] if row[1] != None else np.inf, row[0]) for row in rows))
+    partners = sorted(set(row[2] for row in rows))
+    columns = {session[1]: j for j, session in enumerate(sessions)}
+    partner_rows = {partner: i for i, partner in enumerate(partners)}
+    matrix = np.full((len(partners), len(sessions)), np.nan)
+    for exp_id, date_mjd, partner, cell in rows:
+        if cell != None:
+            matrix[partner_rows[partner], columns[exp_id]] = float(cell)
+    return {'partners': partners, 'experiments': [session[1] for session in sessions],
+            'mjd': np.array([session[0] for session in sessions], dtype=float), 'matrix': matrix}
+
+def parseFunc():
+    # Argument parsing
+    parser = argparse.ArgumentParser(description="""Print the baseline by session matrix of a station from the baseline_qcodes table, e.g. to see
+                                        which partner stations a drop in detection rate came from.""")
+    parser.add_argument('sql_db_name',
+                        help="""The name of the SQL database to read.""")
+    parser.add_argument('station',
+                        help="""2 character code of the station.""")
+    parser.add_argument('--value', dest='value', default='detect_rate', choices=list(MATRIX_VALUES),
+                        help="""Value of each cell (default detect_rate, good/total).""")
+    parser.add_argument('--band', dest='band', default='X',
+                        help="""Band (default X).""")
+    parser.add_argument('--mjd-start', dest='mjd_start', type=float, default=None,
+                        help="""First session MJD.""")
+    parser.add_argument('--mjd-stop', dest='mjd_stop', type=float, default=None,
+                        help="""Last session MJD.""")
+    args = parser.parse_args()
+    return args
+
+def main(db_name, station, value='detect_rate', band='X', mjd_start=None, mjd_stop=None):
+    with databaseAccess.connection(db_name) as conn:
+        cursor = conn.cursor()
+        result = baselineMatrix(cursor, station, value, band, mjd_start, mjd_stop)
+        cursor.close()
+    print(str(station) + ' ' + value + ' (' + band + ' band) by partner station and session')
+    print('session    ' + ' '.join(str(partner).rjust(6) for partner in result['partners']))
+    for j, exp_id in enumerate(result['experiments']):
+        print(str(exp_id).ljust(10) + ' ' + ' '.join(('%.3g' % cell if not np.isnan(cell) else '-').rjust(6) for cell in result['matrix'][:, j]))
+
+if __name__ == '__main__':
+    args = parseFunc()
+    main(args.sql_db_name, args.station, args.value, args.band, args.mjd_start, args.mjd_stop)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# Correlator report reader shared by parseFiles.py and parseCorrSkd.py. The report is split once on its '+SECTION'
+# headers into a header (everything before the first section) and a map of section name -> section text, where the
+# text starts with the name as it did when the parsers split the report themselves, e.g. 'STATIONS\n...'. Some reports
+# have a space before every line (e.g. aov032), these are split on '\n +' instead.
+# The QCODES table is read into an integer matrix once and summed per station and band with numpy.
+
+import re
+import numpy as np
+
+FORMAT_3_TAG = '%CORRELATOR_REPORT_FORMAT 3'
+
+def splitSections(contents):
+    sections = contents.split('\n+')
+    if len(sections) < 3:
+        sections = contents.split('\n +')
+    return sections
+
+def readCorrReport(contents):
+    # {'version': 2 or 3, 'header': text before the first section, 'sections': {name: text}}, the first of any
+    # repeated section name is kept.
+    sections = splitSections(contents)
+    named = {}
+    for section in sections[1:]:
+        words = section.split(None, 1)
+        if len(words) > 0 and words[0] not in named:
+            named[words[0]] = section
+    return {'version': 3 if FORMAT_3_TAG in sections[0] else 2, 'header': sections[0], 'sections': named}
+
+def section(report, tag, default=None):
+    # Text of the first section whose name contains tag, e.g. 'DROP' for DROP_CHANNELS, the names vary a little
+    # between correlators and format versions.
+    if tag in report['sections']:
+        return report['sections'][tag]
+    for name, text in report['sections'].items():
+        if tag in name:
+            return text
+    return default
+
+# Sections the station data is read from, by the tag used to find them.
+REQUIRED_SECTIONS = ['STATION', 'DROP', 'MANUAL', 'QCODES']
+
+def missingSections(report):
+    return [tag for tag in REQUIRED_SECTIONS if section(report, tag) == None]
+
+def qcodeTable(text_section):
+    # QCODES table as {'columns': header names after 'bl:band', 'labels': 'bl:band' of each row, 'counts': integer matrix
+    # (rows x columns)}. Like the astropy reader it replaced, only lines whose first word contains ':' are read and the first
+    # of them is the header.
+    columns = None
+    labels = []
+    rows = []
+    for line in text_section.split('\n'):
+        if ':' not in line.split(' ')[0]:
+            continue
+        words = line.split()
+        if columns == None:
+            columns = words[1:]
+        elif len(words) == len(columns) + 1:
+            rows.append(words[1:])
+            labels.append(words[0])
+    columns = columns or []
+    return {'columns': columns, 'labels': np.array(labels, dtype=str), 'counts': np.array(rows, dtype=np.int64).reshape(len(rows), len(columns))}
+
+def baselineBands(labels):
+    # 'AB:X' labels -> (baseline characters as a rows x 2 char matrix, band part)
+    if len(labels) == 0: # numpy can't partition an empty array
+        return np.empty((0, 1), dtype='U1'), np.array([], dtype=str)
+    parts = np.char.partition(labels, ':')
+    baselines = parts[:, 0]
+    bands = np.char.partition(parts[:, 2], ':')[:, 0]
+    width = max(1, np.char.str_len(baselines).max())
+    chars = baselines.astype('U' + str(width)).view('U1').reshape(len(labels), width)
+    return chars, bands
+
+def stationQcodeSums(text_section, corr_ref, band, table=None):
+    # Sum of every qcode column over the baselines of each station in one band, for all stations at once: a station x row
+    # mask (the station's mk4 id is one of the baseline characters and the band matches) times the count matrix.
+    # Returns {'station': mk4 ids, column: sums} in corr_ref order, as read by extractQcodeInfo.
+    table = table or qcodeTable(text_section)
+    ids = np.array([antenna[1] for antenna in corr_ref], dtype=str)
+    chars, bands = baselineBands(table['labels'])
+    band_mask = np.char.find(bands, band) >= 0
+    masks = (chars[np.newaxis, :, :] == ids[:, np.newaxis, np.newaxis]).any(axis=2) & band_mask[np.newaxis, :]
+    present = masks.any(axis=1) # stations without a baseline in this band are left out
+    sums = masks[present].astype(np.int64) @ table['counts']
+    summed = {'station': ids[present]}
+    for i, col in enumerate(table['columns']):
+        summed[col] = sums[:, i]
+    return summed
+
+def scheduledObservations(text_section, band, table=None):
+    # total scheduled observations of the session in one band, summed over all baselines of the qcode table
+    table = table or qcodeTable(text_section)
+    if 'total' not in table['columns']:
+        return None
+    bands = baselineBands(table['labels'])[1]
+    return int(table['counts'][np.char.find(bands, band) >= 0, table['columns'].index('total')].sum())
+
+# Per-baseline qcode histograms, stored in the order of QCODE_COLUMNS (columns missing from a report count as 0).
+QCODE_COLUMNS = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'N', '-']
+GOOD_QCODES = ['5', '6', '7', '8', '9']
+BAD_QCODES = ['0', '1', '2', '3', '4', 'G', 'H'] # as counted by extractQcodeInfo
+SNR_ROW = r'^\s*([A-Za-z]{2})\s+([0-9]+\.?[0-9]*)\s+([0-9]+)\s+([0-9]+\.?[0-9]*)\s+([0-9]+)\s*$'
+SNR_BANDS = {3: ['S', 'X'], 2: ['X', 'S']} # band order of the two ratio/count column pairs by format version
+
+def snrTable(text_section, version):
+    # SNR ratio table as {baseline: {band: (ratio, number of scans)}}, empty if the report has none (e.g. VGOS X only tables).
+    text_section = text_section.split('CONTROL')[0] # old corr files have an extra bit in the SNR table section
+    snr = {}
+    for bl, ratio_1, n_1, ratio_2, n_2 in re.findall(SNR_ROW, text_section, re.MULTILINE):
+        first, second = SNR_BANDS[version]
+        snr.setdefault(bl, {first: (float(ratio_1), int(n_1)), second: (float(ratio_2), int(n_2))})
+    return snr
+
+def baselineRows(qcode_table, snr, corr_ref, stations):
+    # One row per baseline and band involving at least one of the given station codes, from the same count matrix the
+    # station sums are taken from: [station1, station2, band, good, bad, total, qcode histogram, snr ratio, snr scans].
+    # The stations are the 2 character codes of the baseline's mk4 ids, the histogram is comma separated.
+    if len(qcode_table['labels']) == 0:
+        return []
+    codes = {antenna[1]: str(antenna[0]) for antenna in corr_ref}
+    wanted = set(str(ant) for ant in stations)
+    columns = qcode_table['columns']
+    counts = qcode_table['counts']
+    good = counts[:, [i for i, col in enumerate(columns) if col in GOOD_QCODES]].sum(axis=1)
+    bad = counts[:, [i for i, col in enumerate(columns) if col in BAD_QCODES]].sum(axis=1)
+    total = counts[:, columns.index('total')] if 'total' in columns else counts.sum(axis=1)
+    histogram = np.zeros((len(counts), len(QCODE_COLUMNS)), dtype=np.int64)
+    for j, col in enumerate(QCODE_COLUMNS):
+        if col in columns:
+            histogram[:, j] = counts[:, columns.index(col)]
+    bands = baselineBands(qcode_table['labels'])[1]
+    rows = []
+    for i, label in enumerate(qcode_table['labels']):
+        baseline = label.split(':')[0]
+        if len(baseline) != 2 or baseline[0] not in codes or baseline[1] not in codes:
+            continue
+        station1, station2 = codes[baseline[0]], codes[baseline[1]]
+        if station1 not in wanted and station2 not in wanted:
+            continue
+        ratio, scans = snr.get(baseline, snr.get(baseline[::-1], {})).get(bands[i], (None, None))
+        rows.append([station1, station2, str(bands[i]), int(good[i]), int(bad[i]), int(total[i]), ','.join(str(value) for value in histogram[i]), ratio, scans])
+    return rows
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+from datetime import datetime
+
+# Source other modules
+import databaseCore
+import databaseReportDownloader
+import databaseSnapshot
+import ftpSessionPool
+import negativeCache
+
+dirname = os.path.dirname(__file__)
+
+def parseFunc():
+    # Argument parsing
+    parser = argparse.ArgumentParser(description="""Backfill the database from the master schedules of a range of years in a single run. The FTP sessions, station list and
+                                        download caches are shared between schedules, and sessions that appear in more than one master schedule are only processed once.""")
+    parser.add_argument('first_year', type=int,
+                        help="""First year of master schedules to process (e.g. 2000).""")
+    parser.add_argument('sql_db_name',
+                        help="""The name of the SQL database you would like to use, if it does not exist it will be created.""")
+    parser.add_argument('--last-year', dest='last_year', type=int, default=datetime.now().year,
+                        help="""Last year of master schedules to process, defaults to the current year.""")
+    parser.add_argument('--workers', dest='workers', type=int, default=1,
+                        help="""Number of experiments to download in parallel (default 1, i.e. serial).""")
+    parser.add_argument('--host-limit', dest='host_limit', type=int, default=2,
+                        help="""Maximum number of simultaneous FTP sessions opened to the CDDIS server.""")
+    parser.add_argument('--retire-after', dest='retire_after', type=int, default=None,
+                        help="""Stop re-checking CDDIS for files that are still missing this many days after the session (default 365).""")
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=20,
+                        help="""Number of experiments whose station rows are written to the database per transaction.""")
+    parser.add_argument('--unified-schema', dest='unified', action='store_true', default=False,
+                        help="""Use the single station_sessions/sessions tables instead of one table per station (see migrateSchema.py).""")
+    parser.add_argument('--snapshot-dir', dest='snapshot_dir', default=databaseSnapshot.DEFAULT_SNAPSHOT_DIR,
+                        help="""Directory of the Parquet snapshot refreshed after each schedule (see databaseSnapshot.py), skipped if pyarrow is not installed.""")
+    args = parser.parse_args()
+    return args
+
+def main(first_year, last_year, db_name, workers=1, host_limit=2, retire_after=None, batch_size=20, unified=False, snapshot_dir=databaseSnapshot.DEFAULT_SNAPSHOT_DIR):
+    stationNames, stationNamesLong = databaseCore.stationParse(dirname + '/stations.config')
+    databaseCore.setupDatabase(db_name, stationNames, unified)
+    pool = ftpSessionPool.getPool(max_sessions=host_limit)
+    negativeCache.getCache(retire_after)
+    processed = set()
+    for year in range(first_year, last_year + 1):
+        schedule = databaseReportDownloader.findMasterSchedule(year, pool)
+        if schedule == None:
+            print("No master schedule found for " + str(year) + ", skipping.")
+            continue
+        print("Processing master schedule " + schedule + ".")
+        databaseCore.ingestSchedule(schedule, db_name, stationNames, workers=workers, host_limit=host_limit, retire_after=retire_after, processed=processed, batch_size=batch_size, unified=unified, snapshot_dir=snapshot_dir)
+    print("Backfill complete, " + str(len(processed)) + " sessions processed.")
+
+if __name__ == '__main__':
+    args = parseFunc()
+    main(args.first_year, args.last_year, args.sql_db_name, workers=args.workers, host_limit=args.host_limit, retire_after=args.retire_after, batch_size=args.batch_size, unified=args.unified, snapshot_dir=args.snapshot_dir)
@@ -1,12 +1,19 @@
 #!/usr/bin/env python
 
 import os
-import MySQLdb as mariadb
 import argparse
+from datetime import datetime
 from astropy.io import ascii
 
 # Source other modules
+import analysisReport
+import baselineQcodes
+import databaseAccess
 import databaseReportDownloader
+import databaseSchema
+import databaseSnapshot
+import masterSchedule
+import monthlyAggregates
 import parseFiles
 
 dirname = os.path.dirname(__file__)
@@ -19,6 +26,18 @@ def parseFunc():
                         help="""Master schedule you want to parse, the script will download the latest version.""")
     parser.add_argument('sql_db_name', 
                         help="""The name of the SQL database you would like to use, if it does not exist it will be created with the script under the hard-coded throwaway user.""")
+    parser.add_argument('--workers', dest='workers', type=int, default=1,
+                        help="""Number of experiments to download in parallel (default 1, i.e. serial).""")
+    parser.add_argument('--host-limit', dest='host_limit', type=int, default=2,
+                        help="""Maximum number of simultaneous FTP sessions opened to the CDDIS server.""")
+    parser.add_argument('--retire-after', dest='retire_after', type=int, default=None,
+                        help="""Stop re-checking CDDIS for files that are still missing this many days after the session (default 365).""")
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=20,
+                        help="""Number of experiments whose station rows are written to the database per transaction.""")
+    parser.add_argument('--unified-schema', dest='unified', action='store_true', default=False,
+                        help="""Use the single station_sessions/sessions tables instead of one table per station (see migrateSchema.py).""")
+    parser.add_argument('--snapshot-dir', dest='snapshot_dir', default=databaseSnapshot.DEFAULT_SNAPSHOT_DIR,
+                        help="""Directory of the Parquet snapshot refreshed after the ingest (see databaseSnapshot.py), skipped if pyarrow is not installed.""")
     args = parser.parse_args()
     return args
 
@@ -36,8 +55,7 @@ def stationParse(stations_config='stations.config'):
     return stationNames, stationNamesLong
 
    
-def main(master_schedule, db_name):
-    stationNames, stationNamesLong = stationParse(dirname + '/stations.config')
+def setupDatabase(db_name, stationNames, unified=False):
     # Setup the directories for downloaded files
     if not os.path.exists(dirname + '/analysis_reports'):
         os.makedirs(dirname + '/analysis_reports')
@@ -45,59 +63,173 @@ def main(master_schedule, db_name):
         os.makedirs(dirname + '/corr_files')
     if not os.path.exists(dirname + '/skd_files'):
         os.makedirs(dirname + '/skd_files')        
-    # Create mariaDB if it doesn't exist
-    master_schedule = str(master_schedule)
+    # Create the database if it doesn't exist
     db_name = str(db_name) 
-    conn = mariadb.connect(user='auscope', passwd='password')
+    databaseAccess.createDatabase(db_name)
+    with databaseAccess.connection(db_name) as conn:
+        cursor = conn.cursor()
+        databaseSchema.createStationTables(cursor, stationNames, unified)
+        seeded = databaseSchema.seedLedger(cursor, stationNames, parseFiles.PARSER_VERSION, unified)
+        if seeded > 0:
+            print("Recorded " + str(seeded) + " existing experiments in the ingest ledger.")
+        seeded = databaseSchema.seedSessions(cursor, stationNames, unified)
+        if seeded > 0:
+            print("Recorded " + str(seeded) + " existing experiments in the sessions table.")
+        monthlyAggregates.createAggregatesTable(cursor)
+        baselineQcodes.createBaselineTable(cursor)
+        seeded = monthlyAggregates.seedAggregates(cursor, stationNames, unified)
+        if seeded > 0:
+            print("Computed " + str(seeded) + " monthly aggregate rows from the existing station data.")
+        conn.commit()
+        cursor.close()
+
+def stationRow(station):
+    # Fields parseFiles could not fill are left as empty lists, these are written as NULL so the upsert merge keeps existing values.
+    return [None if isinstance(value, list) and len(value) == 0 else value for value in stationValues(station)]
+
+def stationValues(station):
+    return [station.exp_id, station.performance, station.perf_uvr, station.date, station.date_mjd, station.posx, station.posy, station.posz, 
+            station.posu, station.pose, station.posn, station.wrms_del, station.sess_fit, station.analyser, station.vgosdb, station.man_pcal,
+            station.dropped_chans, station.total_obs, station.detect_rate_x, station.detect_rate_s, station.note_bool, station.notes]
+
+def sessionValues(station):
+    # Session-only values carried by every station of the experiment, see databaseSchema.SESSION_COLUMNS.
+    values = {'Network_Size': station.network_size, 'Scheduled_Obs': station.scheduled_obs}
+    return {col: None if isinstance(value, list) and len(value) == 0 else value for col, value in values.items()}
+
+# Files read by parseFiles.main for an experiment, by ledger source name.
+SOURCE_FILES = {'analysis': 'analysis_reports/{}_report.txt',
+                'spoolfile': 'analysis_reports/{}_spoolfile.txt',
+                'corr': 'corr_files/{}.corr',
+                'skd': 'skd_files/{}.skd'}
+
+def ledgerEntries(exp, status, rows_written):
+    # One ledger row per source file of the experiment, with the download time (file mtime), size and hash of what was parsed.
+    entries = []
+    for source, pattern in SOURCE_FILES.items():
+        filename = os.path.join(dirname, pattern.format(exp))
+        if os.path.isfile(filename):
+            downloaded = datetime.fromtimestamp(os.path.getmtime(filename)).strftime('%Y-%m-%d %H:%M:%S')
+            entries.append([exp, source, downloaded, os.path.getsize(filename), masterSchedule.fileHash(filename), status, parseFiles.PARSER_VERSION, rows_written])
+        elif source == 'analysis':
+            entries.append([exp, source, None, None, None, 'missing', parseFiles.PARSER_VERSION, 0])
+    return entries
+
+def writePending(conn, pending, counts, unified=False):
+    # Upsert the queued rows (station -> list of rows), refresh the monthly aggregates of the months they fall in, replace
+    # the experiments' baseline qcodes and write their ledger entries in a single transaction.
     cursor = conn.cursor()
-    query = "CREATE DATABASE IF NOT EXISTS " + db_name +";"
-    cursor.execute(query)
-    conn.commit()
-    query = "USE " + db_name
-    cursor.execute(query)
-    conn.commit()
-    for ant in stationNames:
-        query_content = """ (ExpID VARCHAR(10) NOT NULL PRIMARY KEY, Performance decimal(4,3) NOT NULL, Performance_UsedVsRecov decimal(4,3), Date DATETIME , Date_MJD decimal(9,2), Pos_X decimal(14,2), Pos_Y decimal(14,2), 
-            Pos_Z decimal(14,2), Pos_U decimal(14,2), Pos_E decimal(14,2), Pos_N decimal(14,2), W_RMS_del decimal(5,2), session_fit decimal(5,2), Total_Obs decimal(9,2),Detect_Rate_X decimal(5,3), Detect_Rate_S decimal(5,3), Manual_Pcal BIT(1), 
-            Dropped_Chans VARCHAR(1500), Note_Bool BIT(1), Notes VARCHAR(500), Analyser VARCHAR(10) NOT NULL, vgosDB_tag VARCHAR(18));"""
-        query = "CREATE TABLE IF NOT EXISTS "+ ant + query_content
-        cursor.execute(query)
+    try:
+        affected = databaseSchema.upsertStationRows(cursor, pending['rows'], unified, pending['sessions'])
+        monthlyAggregates.refreshAggregates(cursor, monthlyAggregates.touchedMonths(pending['rows']), unified)
+        baselineQcodes.writeBaselines(cursor, pending['baselines'])
+        databaseSchema.recordIngest(cursor, pending['ledger'])
         conn.commit()
-    conn.close()
-    # Download any SKD/Analysis/Spool/Corr files that are in the master schedule but not yet in the database.
-    databaseReportDownloader.main(master_schedule, db_name) # comment this line out for troubleshooting downstream problems, otherwise this tries to redownload all the experiments with no files available.
-    # Check for valid experiments, determine whether they are in the database already - add the data from the parsed files if they aren't.
-    valid_experiments = databaseReportDownloader.validExpFinder(os.path.join(dirname, master_schedule), stationNames)
-    existing_experiments = databaseReportDownloader.checkExistingData(str(db_name), stationNames)
-    experiments_to_add = [x for x in valid_experiments if x.lower() not in existing_experiments]
-    for exp in experiments_to_add:
-        exp = exp.lower()
-        if os.path.isfile(dirname+'/analysis_reports/'+ exp +'_report.txt'):
+    except databaseAccess.DatabaseError:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    counts['affected'] += affected
+    counts['rows'] += sum(len(data) for data in pending['rows'].values())
+    counts['touched'].update(databaseSnapshot.touchedPartitions(pending['rows']))
+
+def experimentPending(pending, exp):
+    # The part of the queue belonging to one experiment
+    return {'rows': {station: [row for row in rows if row[0] == exp] for station, rows in pending['rows'].items() if any(row[0] == exp for row in rows)},
+            'sessions': {key: value for key, value in pending['sessions'].items() if key == exp},
+            'baselines': {key: value for key, value in pending['baselines'].items() if key == exp},
+            'ledger': [entry for entry in pending['ledger'] if entry[0] == exp]}
+
+def flushStationRows(conn, pending, counts, unified=False):
+    # Write the queue as one transaction. If that fails, each experiment is retried on its own so one bad session doesn't
+    # hold back the batch; one that still fails is recorded as failed in the ledger (and retried after a parser upgrade).
+    if len(pending['ledger']) == 0:
+        return
+    try:
+        writePending(conn, pending, counts, unified)
+    except databaseAccess.DatabaseError:
+        for exp in sorted(set(entry[0] for entry in pending['ledger'])):
+            single = experimentPending(pending, exp)
             try:
-                with open(dirname + '/analysis_reports/'+ exp +'_report.txt') as file:
-                    meta_data = parseFiles.metaData(file.read(), exp)
-                vgosDB = meta_data[4]
-                databaseReportDownloader.corrReportDL(exp, vgosDB)
-                station_data = parseFiles.main(exp)
-                # add station data to SQL database
-                for i in range(0, len(station_data)):
-                    station = station_data[i]
-                    sql_station = """INSERT IGNORE INTO {} (ExpID, Performance, Performance_UsedVsRecov, Date, Date_MJD, Pos_X, Pos_Y, Pos_Z, Pos_U, Pos_E, Pos_N, 
-                        W_RMS_del, session_fit, Analyser, vgosDB_tag, Manual_Pcal, Dropped_Chans, Total_Obs, Detect_Rate_X, Detect_Rate_S, Note_Bool, Notes) 
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);""".format(station_data[i].name)
-                    data = [station.exp_id, station.performance, station.perf_uvr, station.date, station.date_mjd, station.posx, station.posy, station.posz, 
-                            station.posu, station.pose, station.posn, station.wrms_del, station.sess_fit, station.analyser, station.vgosdb, station.man_pcal,
-                            station.dropped_chans, station.total_obs, station.detect_rate_x, station.detect_rate_s, station.note_bool, station.notes]
-                    print(data)
-                    conn = mariadb.connect(user='auscope', passwd='password', db=str(db_name))
-                    cursor = conn.cursor()
-                    cursor.execute(sql_station, data)
-                    conn.commit()
-                    conn.close()
-            except:
-                print('Error processing analysis report for session ' + exp + '...')
-                pass
+                writePending(conn, single, counts, unified)
+            except databaseAccess.DatabaseError as e:
+                print('Error writing station rows for ' + exp + ': ' + str(e))
+                failed = [entry[:5] + ['failed', entry[6], 0] for entry in single['ledger']]
+                try:
+                    writePending(conn, {'rows': {}, 'sessions': {}, 'baselines': {}, 'ledger': failed}, counts, unified)
+                except databaseAccess.DatabaseError as e:
+                    print('Error recording ' + exp + ' in the ingest ledger: ' + str(e))
+    for queue in pending.values():
+        queue.clear()
+
+def ingestSchedule(master_schedule, db_name, stationNames, workers=1, host_limit=2, retire_after=None, processed=None, batch_size=20, unified=False, snapshot_dir=databaseSnapshot.DEFAULT_SNAPSHOT_DIR):
+    # processed - optional set of (lower case) session codes already handled earlier in this run, e.g. by a backfill over
+    # several master schedules; these are skipped and the sessions handled here are added to it.
+    # batch_size - number of experiments whose station rows are written per transaction.
+    # unified - write to the unified station_sessions/sessions tables rather than the per-station tables.
+    # snapshot_dir - Parquet snapshot whose station/year partitions are refreshed for the rows written (None to skip).
+    master_schedule = str(master_schedule)
+    db_name = str(db_name)
+    # Download any SKD/Analysis/Spool/Corr files that are in the master schedule but not yet in the database.
+    databaseReportDownloader.main(master_schedule, db_name, workers=workers, host_limit=host_limit, retire_after=retire_after, stations=stationNames, processed=processed, unified=unified) # files previously not found are only re-checked on a backoff (see negativeCache.py)
+    # Work list from the ingest ledger: valid sessions never parsed, still missing their analysis report, or parsed by an older parser.
+    schedule_diff = masterSchedule.diffMasterSchedule(os.path.join(dirname, master_schedule), stationNames)
+    with databaseAccess.connection(db_name) as conn:
+        cursor = conn.cursor()
+        parsed_versions = databaseSchema.ledgerState(cursor)
+        cursor.close()
+        experiments_to_add = [code for code in schedule_diff['valid'] if parsed_versions.get(code.lower(), -1) < parseFiles.PARSER_VERSION]
+        if processed != None:
+            experiments_to_add = [x for x in experiments_to_add if x.lower() not in processed]
+            processed.update(x.lower() for x in experiments_to_add)
+        # One connection for the whole schedule, station rows are written with executemany and committed every batch_size experiments.
+        pending = {'rows': {}, 'sessions': {}, 'baselines': {}, 'ledger': []}
+        batch_exps = 0
+        counts = {'experiments': 0, 'rows': 0, 'affected': 0, 'reparsed': 0, 'touched': set()}
+        for exp in experiments_to_add:
+            exp = exp.lower()
+            if os.path.isfile(dirname+'/analysis_reports/'+ exp +'_report.txt'):
+                try:
+                    meta_data = parseFiles.metaData(analysisReport.readReport(dirname + '/analysis_reports/'+ exp +'_report.txt', exp))
+                    vgosDB = meta_data[4]
+                    databaseReportDownloader.corrReportDL(exp, vgosDB)
+                    station_data = parseFiles.main(exp) or []
+                    # queue station data for the SQL database
+                    for station in station_data:
+                        pending['rows'].setdefault(station.name, []).append(stationRow(station))
+                    if len(station_data) > 0:
+                        pending['sessions'][exp] = sessionValues(station_data[0])
+                        if len(station_data[0].baselines) > 0:
+                            pending['baselines'][exp] = (station_data[0].date_mjd, station_data[0].baselines)
+                    pending['ledger'].extend(ledgerEntries(exp, 'parsed' if len(station_data) > 0 else 'no_stations', len(station_data)))
+                    if exp in parsed_versions:
+                        counts['reparsed'] += 1
+                except:
+                    print('Error processing analysis report for session ' + exp + '...')
+                    pending['ledger'].extend(ledgerEntries(exp, 'failed', 0))
+                batch_exps += 1
+            else:
+                pending['ledger'].extend(ledgerEntries(exp, 'missing', 0))
+            if batch_exps >= batch_size:
+                flushStationRows(conn, pending, counts, unified)
+                counts['experiments'] += batch_exps
+                batch_exps = 0
+        flushStationRows(conn, pending, counts, unified)
+        counts['experiments'] += batch_exps
+        print("Wrote " + str(counts['rows']) + " station rows (" + str(counts['affected']) + " affected by insert/merge) from " + str(counts['experiments']) + " experiments, " + str(counts['reparsed']) + " re-parsed after a parser upgrade.")
+        # Anything still not through the parser stays on the work list for the next run.
+        cursor = conn.cursor()
+        parsed_versions = databaseSchema.ledgerState(cursor)
+        cursor.close()
+    masterSchedule.saveScheduleDiff(schedule_diff, [x for x in experiments_to_add if parsed_versions.get(x.lower(), -1) < parseFiles.PARSER_VERSION])
+    databaseSnapshot.refreshSnapshot(db_name, stationNames, unified, snapshot_dir, counts['touched'])
+
+def main(master_schedule, db_name, workers=1, host_limit=2, retire_after=None, batch_size=20, unified=False, snapshot_dir=databaseSnapshot.DEFAULT_SNAPSHOT_DIR):
+    stationNames, stationNamesLong = stationParse(dirname + '/stations.config')
+    setupDatabase(db_name, stationNames, unified)
+    ingestSchedule(master_schedule, db_name, stationNames, workers=workers, host_limit=host_limit, retire_after=retire_after, batch_size=batch_size, unified=unified, snapshot_dir=snapshot_dir)
 
 if __name__ == '__main__':
     args = parseFunc()
-    main(args.master_schedule, args.sql_db_name)
\ No newline at end of file
+    main(args.master_schedule, args.sql_db_name, workers=args.workers, host_limit=args.host_limit, retire_after=args.retire_after, batch_size=args.batch_size, unified=args.unified, snapshot_dir=args.snapshot_dir)
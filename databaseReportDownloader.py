@@ -1,13 +1,23 @@
 #!/usr/bin/env python
 
-from ftplib import FTP_TLS
 import re
 import os
-import MySQLdb as mariadb
+import json
+import ftplib
+import fnmatch
+import threading
 import tarfile
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from astropy.io import ascii
 
+import databaseAccess
+import databaseSchema
+import ftpSessionPool
+import negativeCache
+import masterSchedule
+import atomicFile
+
 dirname = os.path.dirname(__file__)
 
 def parseFunc():
@@ -17,53 +27,74 @@ def parseFunc():
                         help="""Master schedule you want to parse, the script will download the latest version.""")
     parser.add_argument("sql_db_name", 
                         help="""The name of the SQL database you would like to use to generate the existing experiment list.""")
+    parser.add_argument("--workers", dest='workers', type=int, default=1,
+                        help="""Number of experiments to download in parallel, each worker uses its own FTP session (default 1, i.e. serial).""")
+    parser.add_argument("--host-limit", dest='host_limit', type=int, default=2,
+                        help="""Maximum number of simultaneous FTP sessions opened to the CDDIS server.""")
+    parser.add_argument("--retire-after", dest='retire_after', type=int, default=None,
+                        help="""Stop re-checking CDDIS for files that are still missing this many days after the session (default 365).""")
     args = parser.parse_args()
     return args
 
-def checkExistingData(db_name, stations):
+def checkExistingData(db_name, stations, unified=False):
     # db_name should be the name of the auscope database (as a string) we want to query for 
     #  unique existing experiment IDs
-    conn = mariadb.connect(user='auscope', passwd='password', db=db_name)
-    cursor = conn.cursor()
-    #station_key = ['Ke', 'Yg', 'Hb', 'Ho']
-    existing_experiments = []
-    for ant in stations:
-        query = "SELECT ExpID FROM " + ant
-        cursor.execute(query)
-        result_list = [item for sublist in cursor.fetchall() for item in sublist]
-        existing_experiments.append(result_list)
-    
-    existing_experiments = [item for sublist in existing_experiments for item in sublist]
-    unique_existing_experiments = set(existing_experiments)
-    
+    with databaseAccess.connection(db_name) as conn:
+        cursor = conn.cursor()
+        unique_existing_experiments = databaseSchema.existingExperiments(cursor, stations, unified)
+        cursor.close()
     return unique_existing_experiments
 
 def validExpFinder(master_schedule, station_names):
-    schedule = str(master_schedule)
-    with open(schedule) as file:
-        schedule_contents = file.readlines()
-    # Generate the regex for stations within the station_config file
-    station_regex = ''
-    for i in range(0,len(station_names)):
-        station_regex = station_regex + "(?<!-)" + station_names[i] + "|"
-        if i == len(station_names)-1: #drop the uneeded last '|'
-            station_regex = station_regex[:-1]
-    # find the experiments to download
-    valid_experiment = []
-    for line in schedule_contents:
-        line = line.split('|')
-        if ' 2.0 ' in schedule_contents[0]: # master schedule version check
-            if len(line) > 13 and len(line[10].strip()) == 8:
-                participated = re.findall(station_regex,line[7],re.MULTILINE)
-                if len(participated) > 0:
-                    valid_experiment.append(line[3].strip())
-        elif ' 1.0 ' in schedule_contents[0]: # master schedule version check
-            if len(line) > 13 and '1.0' in line[11]:
-                participated = re.findall(station_regex,line[7],re.MULTILINE)
-                if len(participated) > 0:
-                    valid_experiment.append(line[2].strip())
-
-    return valid_experiment
+    # Codes of the sessions in a master schedule that involve at least one of the configured stations.
+    matcher = masterSchedule.stationMatcher(station_names)
+    return [record.code for record in masterSchedule.parseMasterSchedule(str(master_schedule)) if masterSchedule.participates(record.stations, matcher)]
+
+def retrieveFile(ftps, remote_path, local_filename):
+    def transfer(lf):
+        ftps.sendcmd('TYPE I')
+        ftps.retrbinary('RETR ' + remote_path, lf.write)
+    return atomicFile.writeAtomic(local_filename, transfer)
+
+def streamHistoryFile(ftps, remote_path, tag, local_filename):
+    # Read the vgosDB tarball straight off the data connection as a gzip'd tar stream and keep only the correlator
+    # History file, so neither the .tgz nor the rest of the archive ever touches the disk. The transfer is abandoned as
+    # soon as the kMk4 history file has been read. Other V???.hist files are only a fallback (they are small, so held in 
+    # memory) and the stream is abandoned once the History directory has been passed.
+    preferred = tag + '/History/' + tag + '_V000_kMk4.hist'
+    history_dir = tag + '/History/'
+    regex = re.compile('.*V...\.hist')
+    contents = None
+    fallback = None
+    seen_history = False
+    ftps.sendcmd('TYPE I')
+    conn = ftps.transfercmd('RETR ' + remote_path)
+    try:
+        with conn.makefile('rb') as stream:
+            with tarfile.open(fileobj=stream, mode='r|gz') as tar:
+                for member in tar:
+                    if member.name.startswith(history_dir):
+                        seen_history = True
+                    elif seen_history and fallback != None:
+                        break
+                    if not member.isfile():
+                        continue
+                    if member.name == preferred:
+                        contents = tar.extractfile(member).read()
+                        break
+                    if fallback == None and re.match(regex, member.name):
+                        fallback = tar.extractfile(member).read()
+    finally:
+        conn.close()
+        try:
+            ftps.voidresp() # 226 if the whole file was read, 426/451 if the transfer was cut short
+        except ftplib.Error:
+            pass
+    if contents == None:
+        contents = fallback
+    if contents == None:
+        return None
+    return atomicFile.writeAtomic(local_filename, lambda lf: lf.write(contents))
 
 def corrReportDL(exp_id,vgos_tag):
     exp_id = str(exp_id)
@@ -74,44 +105,31 @@ def corrReportDL(exp_id,vgos_tag):
         year = '20' + str(vgos_tag[0:2])
     tag = str(vgos_tag.rstrip())
     exp_id = str(exp_id)
-    vgos_exists = []
+    cache = negativeCache.getCache()
     if os.path.isfile(dirname+"/corr_files/"+ exp_id + '.corr'):
         print("Corr report already exists for experiment " + exp_id + ", skipping re-download.")
         return
+    elif not cache.due(exp_id, 'corr'):
+        print("Corr report was recently not available for experiment " + exp_id + ", skipping until the next re-check.")
+        return
     else:
-        ftps = FTP_TLS(host = 'gdc.cddis.eosdis.nasa.gov')
-        ftps.login(user='anonymous', passwd='tiegem@utas.edu.au')
-        ftps.prot_p()
         try:
-            ftps.retrlines("LIST /pub/vlbi/ivsdata/vgosdb/" + year + "/" + tag + ".tgz", vgos_exists.append)
-            if len(vgos_exists) > 0:
-                local_filename = os.path.join(dirname, tag + ".tgz")
-                ftps.sendcmd('TYPE I')
-                lf = open(local_filename, "wb")
-                ftps.retrbinary("RETR /pub/vlbi/ivsdata/vgosdb/" + year + "/" + tag + ".tgz", lf.write)
-                lf.close()
-                tar = tarfile.open(dirname + '/' + tag + ".tgz")
-                if tag +'/History/'+ tag + '_V000_kMk4.hist' in tar.getnames():
-                    member = tar.getmember(tag +'/History/'+ tag + '_V000_kMk4.hist')
-                    member.name = dirname + '/corr_files/' + exp_id + '.corr'
-                    tar.extract(member)
-                    tar.close()
-                else:
-                    file_list = tar.getnames()
-                    regex = re.compile('.*V...\.hist')
-                    for file in file_list:
-                        if re.match(regex,file):
-                            member = tar.getmember(file)
-                            member.name = dirname + '/corr_files/' + exp_id + '.corr'
-                            tar.extract(member)
-                            tar.close()
-                            break
-                os.remove(dirname + '/' + tag + ".tgz")
+            remote_path = "/pub/vlbi/ivsdata/vgosdb/" + year + "/" + tag + ".tgz"
+            local_filename = dirname + '/corr_files/' + exp_id + '.corr'
+            extracted = ftpSessionPool.getPool().call(lambda ftps: streamHistoryFile(ftps, remote_path, tag, local_filename))
+            if extracted != None:
+                cache.recordFound(exp_id, 'corr')
                 print("Corr report download complete for experiment " + exp_id + ".")
-                return 
+            else:
+                cache.recordMissing(exp_id, 'corr')
+                print("Corr report not available for experiment " + exp_id + ".")
+        except ftplib.error_perm: # no vgosDB tarball on the server yet
+            cache.recordMissing(exp_id, 'corr')
+            print("Corr report not available for experiment " + exp_id + ".")
         except Exception:
             print("Corr report not available for experiment " + exp_id + ".")
-            return
+        cache.save()
+        return
 
 def stationParse(stations_config=dirname + '/stations.config'):
     with open(stations_config) as file:
@@ -126,98 +144,197 @@ def stationParse(stations_config=dirname + '/stations.config'):
 
     return stationNames, stationNamesLong
 
-def main(master_schedule, db_name):
-    stationNames, stationNamesLong = stationParse()
-    schedule = str(master_schedule)
-    ftps = FTP_TLS(host = 'gdc.cddis.eosdis.nasa.gov')
-    ftps.login(user='anonymous', passwd='')
-    ftps.prot_p()
+# Remote MDTM/SIZE of each master schedule as last downloaded.
+MASTER_STATE_FILE = dirname + '/master_schedule_state.json'
+
+def loadMasterState():
+    if os.path.isfile(MASTER_STATE_FILE):
+        with open(MASTER_STATE_FILE) as file:
+            return json.load(file)
+    return {}
+
+def saveMasterState(state):
+    atomicFile.writeAtomic(MASTER_STATE_FILE, lambda lf: lf.write(json.dumps(state, indent=1, sort_keys=True).encode()))
+
+def remoteStamp(ftps, remote_path):
+    # MDTM and SIZE of a remote file, either may be None if the server does not support the command.
+    try:
+        mdtm = ftps.sendcmd('MDTM ' + remote_path).split()[1]
+    except ftplib.error_perm:
+        mdtm = None
+    try:
+        ftps.sendcmd('TYPE I') # SIZE is only meaningful in binary mode
+        size = ftps.size(remote_path)
+    except ftplib.error_perm:
+        size = None
+    return mdtm, size
+
+def downloadMasterSchedule(schedule, pool=None):
+    # Only transfer the master schedule if the remote MDTM/SIZE differ from the last download (or the local copy is gone).
+    # Returns the local filename.
+    if pool is None:
+        pool = ftpSessionPool.getPool()
+    remote_path = '/pub/vlbi/ivscontrol/'+ schedule
     master_sched_filename = os.path.join(dirname, schedule)
-    mf = open(master_sched_filename, "wb")
-    ftps.sendcmd('TYPE I')
-    ftps.retrbinary('RETR /pub/vlbi/ivscontrol/'+ schedule, mf.write)
-    mf.close()
-    # determine year of schedule - different depending on master schedule version...
-    if len(schedule) == 12: # this is for v1
-        year = '20' + schedule[6:8]
-    else: # this is for v2
-        year = schedule[6:10]
-    valid_experiment = validExpFinder(os.path.join(dirname, schedule), stationNames)
-    existing_experiments = checkExistingData(str(db_name), stationNames)
-    if existing_experiments == None:
-        experiments_to_download = valid_experiment
+    state = loadMasterState()
+    previous = state.get(schedule, {})
+    def refresh(ftps):
+        mdtm, size = remoteStamp(ftps, remote_path)
+        if os.path.isfile(master_sched_filename) and mdtm != None and size != None and previous.get('mdtm') == mdtm and previous.get('size') == size:
+            return mdtm, size, False
+        retrieveFile(ftps, remote_path, master_sched_filename)
+        return mdtm, size, True
+    mdtm, size, transferred = pool.call(refresh)
+    if not transferred:
+        print("Master schedule " + schedule + " unchanged since last download, skipping transfer.")
+        return master_sched_filename
+    state[schedule] = {'mdtm': mdtm, 'size': size}
+    saveMasterState(state)
+    return master_sched_filename
+
+def findMasterSchedule(year, pool=None):
+    # Download the master schedule for a year, trying the v2 (masterYYYY.txt) then v1 (masterYY.txt) naming.
+    # Returns the schedule filename, or None if neither exists on the server.
+    for schedule in ['master%04d.txt' % year, 'master%02d.txt' % (year % 100)]:
+        try:
+            downloadMasterSchedule(schedule, pool)
+            return schedule
+        except ftplib.error_perm:
+            continue
+    return None
+
+# Spelling options need to be here because analysis report names are unfortunately not standardised - sometimes they are even different within the same experiment (e.g. 'ivs' and 'IVS')
+REPORT_SPELLINGS = ['ivs', 'IVS', 'usno', 'USNO', 'NASA']
+
+# Directory listings already fetched this run, keyed by remote directory.
+_listing_cache = {}
+_listing_lock = threading.Lock()
+
+def listExperimentDir(ftps, exp, year):
+    # One LIST of aux/<year>/<exp>/ per experiment, every wanted file is then resolved against it locally.
+    remote_dir = '/pub/vlbi/ivsdata/aux/' + str(year) + '/' + exp + '/'
+    with _listing_lock:
+        if remote_dir in _listing_cache:
+            return _listing_cache[remote_dir]
+    listing = []
+    try:
+        ftps.retrlines('LIST ' + remote_dir, listing.append)
+    except ftplib.error_perm: # directory does not exist (yet)
+        listing = []
+    filenames = [line.split()[8] for line in listing if len(line.split()) > 8]
+    with _listing_lock:
+        _listing_cache[remote_dir] = filenames
+    return filenames
+
+def latestMatch(filenames, pattern):
+    matches = sorted(name for name in filenames if fnmatch.fnmatchcase(name, pattern))
+    if len(matches) > 0:
+        return matches[-1]
+    return None
+
+def resolveExperimentFiles(filenames, exp):
+    # Map each file kind to the remote filename to download (or None), picking the latest version where there are several.
+    wanted = {'skd': latestMatch(filenames, exp + '.skd'), 'report': None, 'spoolfile': None,
+              'analyst': latestMatch(filenames, exp + '-analyst.txt')}
+    for kind in ['report', 'spoolfile']:
+        for spelling in REPORT_SPELLINGS:
+            match = latestMatch(filenames, exp + '-' + spelling + '-analysis-' + kind + '*')
+            if match != None:
+                wanted[kind] = match
+                break
+    return wanted
+
+# File kinds tracked in the negative cache for the aux/ directory downloads.
+CACHED_KINDS = ['skd', 'report', 'spoolfile']
+
+def localFilenames(exp):
+    return {'skd': 'skd_files/' + exp + '.skd',
+            'report': 'analysis_reports/' + exp + '_report.txt',
+            'spoolfile': 'analysis_reports/' + exp + '_spoolfile.txt',
+            'analyst': 'analysis_reports/' + exp + '_report.txt'} # old style analysis report
+
+def neededKinds(exp, cache=None):
+    # Cached kinds not yet on disk and, with a cache, due for a re-check. Files already downloaded are never fetched again,
+    # so a found file does not make the experiment due on every run.
+    local_names = localFilenames(exp)
+    return [kind for kind in CACHED_KINDS if not os.path.isfile(os.path.join(dirname, local_names[kind])) and (cache == None or cache.due(exp, kind))]
+
+def downloadExperimentFiles(ftps, exp, year, cache=None, session_date=None, kinds=CACHED_KINDS):
+    # Download the given kinds (an old style analyst file is fetched along with 'report').
+    remote_dir = '/pub/vlbi/ivsdata/aux/' + str(year) + '/' + exp + '/'
+    wanted = resolveExperimentFiles(listExperimentDir(ftps, exp, year), exp)
+    local_names = localFilenames(exp)
+    if 'skd' in kinds and wanted['skd'] == None:
+        print('No SKED file found for ' + exp)
+    for kind in ['skd', 'report', 'spoolfile', 'analyst']:
+        if wanted[kind] == None or (kind if kind != 'analyst' else 'report') not in kinds:
+            continue
+        try:
+            retrieveFile(ftps, remote_dir + wanted[kind], os.path.join(dirname, local_names[kind]))
+            if kind == 'report':
+                print('Analysis report downloaded for experiment ' + exp + ".")
+            elif kind == 'spoolfile':
+                print('Spoolfile downloaded for experiment ' + exp + ".")
+        except ftplib.Error as e:
+            print('Unable to download ' + wanted[kind] + ' for experiment ' + exp + ': ' + str(e))
+            wanted[kind] = 'failed' # neither found nor missing - try again next run
+    if cache != None:
+        # an old style analyst file counts as the analysis report
+        found = {'skd': wanted['skd'], 'report': wanted['report'] or wanted['analyst'], 'spoolfile': wanted['spoolfile']}
+        for kind in kinds:
+            if found[kind] == None:
+                cache.recordMissing(exp, kind, session_date)
+            elif found[kind] != 'failed':
+                cache.recordFound(exp, kind)
+
+def downloadExperiment(pool, exp, year, cache=None, session_date=None):
+    # Unit of work for a download worker - the worker holds one pooled session for the whole experiment.
+    kinds = neededKinds(exp, cache)
+    if len(kinds) == 0:
+        print('Files for experiment ' + exp + ' are already downloaded or were recently not available, skipping until the next re-check.')
+        return
+    print('Beginning file downloads for experiment ' + exp + ".")
+    try:
+        pool.call(lambda ftps: downloadExperimentFiles(ftps, exp, year, cache, session_date, kinds))
+    except ftpSessionPool.CONNECTION_ERRORS as e:
+        print('Lost connection to CDDIS while downloading files for ' + exp + ': ' + str(e))
+
+def main(master_schedule, db_name, workers=1, host_limit=2, retire_after=None, stations=None, processed=None, unified=False):
+    if stations is None:
+        stationNames, stationNamesLong = stationParse()
     else:
-        experiments_to_download = [x for x in valid_experiment if x not in existing_experiments]
+        stationNames = stations
+    schedule = str(master_schedule)
+    # All transfers in this run share the same pooled, already authenticated, sessions. The pool size caps the number of 
+    # simultaneous sessions against CDDIS regardless of how many workers are requested.
+    pool = ftpSessionPool.getPool(max_sessions=host_limit)
+    cache = negativeCache.getCache(retire_after)
+    master_sched_filename = downloadMasterSchedule(schedule, pool)
+    year = masterSchedule.scheduleYear(schedule)
+    # Only sessions that are new/changed in the schedule, or still waiting on files from an earlier run, are looked at.
+    schedule_diff = masterSchedule.diffMasterSchedule(master_sched_filename, stationNames)
+    existing_experiments = checkExistingData(str(db_name), stationNames, unified)
+    experiments_to_download = masterSchedule.workList(schedule_diff, existing_experiments)
+    if processed != None: # already handled via another master schedule this run
+        experiments_to_download = [x for x in experiments_to_download if x.lower() not in processed]
+    pending = []
     for exp in experiments_to_download:
         if os.path.isfile(dirname+'/analysis_reports/'+exp.lower()+'_report.txt'):
             print("Analysis report already exists for " + exp.lower() + ", skipping file downloads.")
-            continue
         else:
-            exp = exp.lower()
-            print('Beginning file downloads for experiment ' + exp + ".")
-            ftps = FTP_TLS(host = 'gdc.cddis.eosdis.nasa.gov')
-            ftps.login(user='anonymous', passwd='')
-            ftps.prot_p()
-            # Download SKED file
-            try:
-                filename_skd = []
-                ftps.retrlines('LIST /pub/vlbi/ivsdata/aux/'+str(year)+ '/' + exp + '/' + exp + '.skd', filename_skd.append)
-                if len(filename_skd) > 0:
-                    local_filename_skd = os.path.join(dirname, 'skd_files/' + exp + '.skd')
-                    ftps.sendcmd('TYPE I')
-                    lf3 = open(local_filename_skd, "wb")
-                    ftps.retrbinary('RETR /pub/vlbi/ivsdata/aux/'+str(year)+ '/' + exp + '/' + exp + ".skd", lf3.write)
-                    lf3.close()
-            except Exception: 
-                print('No SKED file found for ' + exp)
-            
-            # Spelling options need to be here because analysis report names are unfortunately not standardised - sometimes they are even different within the same experiment (e.g. 'ivs' and 'IVS')
-            # Now time to download analysis report
-            options = ['ivs', 'IVS', 'usno', 'USNO', 'NASA']
-            for spelling in options:
-                filename_report = []
-                try:
-                    ftps.retrlines('LIST /pub/vlbi/ivsdata/aux/'+str(year)+ '/' + exp + '/' + exp + '-'+spelling+'-analysis-report*', filename_report.append)
-                    if len(filename_report) > 0:
-                        local_filename_report = os.path.join(dirname, 'analysis_reports/' + exp + '_report.txt')
-                        ftps.sendcmd('TYPE I')
-                        lf1 = open(local_filename_report, "wb")
-                        ftps.retrbinary('RETR /pub/vlbi/ivsdata/aux/' +str(year)+ '/' + exp + '/' + filename_report[len(filename_report)-1].split()[8], lf1.write)
-                        lf1.close()
-                        print('Analysis report downloaded for experiment ' + exp + ".")
-                        break
-                except Exception:
-                    pass
-            # Download spool file
-            for spelling in options:
-                filename_spool = []
-                try:
-                    ftps.retrlines('LIST /pub/vlbi/ivsdata/aux/'+str(year)+ '/' + exp + '/' + exp + '-'+spelling+'-analysis-spoolfile*', filename_spool.append)
-                    if len(filename_spool) > 0:
-                        local_filename_spool = os.path.join(dirname, 'analysis_reports/' + exp + '_spoolfile.txt')
-                        ftps.sendcmd('TYPE I')
-                        lf2 = open(local_filename_spool, "wb")
-                        ftps.retrbinary('RETR /pub/vlbi/ivsdata/aux/' +str(year)+ '/' + exp + '/' + filename_spool[len(filename_report)-1].split()[8], lf2.write)
-                        lf2.close()
-                        print('Spoolfile downloaded for experiment ' + exp + ".")
-                        break
-                except Exception:
-                    pass
-            # Download old style analysis report if it exists.
-            try:
-                filename_report_old = []
-                ftps.retrlines('LIST /pub/vlbi/ivsdata/aux/'+str(year)+ '/' + exp + '/' + exp + '-analyst.txt', filename_report_old.append)
-                if len(filename_report_old) > 0:
-                    local_filename_report = os.path.join(dirname, 'analysis_reports/' + exp + '_report.txt')
-                    ftps.sendcmd('TYPE I')
-                    lf1 = open(local_filename_report, "wb")
-                    ftps.retrbinary('RETR /pub/vlbi/ivsdata/aux/'+str(year)+ '/' + exp + '/' + exp + "-analyst.txt", lf1.write)
-                    lf1.close()
-            except Exception:
-                    pass   
+            pending.append((exp.lower(), masterSchedule.recordFromDict(schedule_diff['sessions'][exp]).start))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda item: downloadExperiment(pool, item[0], year, cache, item[1]), pending))
+    else:
+        for exp, session_date in pending:
+            downloadExperiment(pool, exp, year, cache, session_date)
+    cache.save()
+    # nothing is ingested here, so everything on the work list is still pending for databaseCore
+    masterSchedule.saveScheduleDiff(schedule_diff, experiments_to_download)
 
 
 if __name__ == '__main__':
     # databaseReportDownloader.py executed as a script
     args = parseFunc()
-    main(args.master_schedule, args.sql_db_name)
+    main(args.master_schedule, args.sql_db_name, workers=args.workers, host_limit=args.host_limit, retire_after=args.retire_after)
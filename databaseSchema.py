@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+
+# Table definitions and the SQL shared by the ingest and report scripts. Two layouts are supported:
+#   per-station - the original layout, one table per station (named by its 2 character code) keyed on ExpID.
+#   unified     - a single long-format station_sessions fact table keyed on (station, ExpID) holding the per-station values,
+#                 and a sessions dimension table with the values shared by every station of an experiment (date, analyser,
+#                 session fit, vgosDB tag, network size, scheduled observations), stored once. station_sessions also keeps
+#                 Date_MJD for its (station, Date_MJD) index, so a station's date range is one index range scan. The
+#                 station_rows view joins the two back into complete station rows (station + STATION_COLUMNS + Session_Type).
+# The sessions table is kept in the per-station layout too, as the join point for cross-station queries; there the station
+# tables still carry their own copies of the shared columns.
+# migrateSchema.py copies an existing per-station database into the unified layout.
+# Both layouts carry a stored Session_Type column (V for VGOS sessions, L for legacy) derived from the ExpID, indexed together
+# with Date_MJD so the report range queries are index range scans returned in date order. explainReports.py checks this.
+# ingest_ledger records, per experiment and source file, what was downloaded and what the parser made of it. databaseCore
+# builds its work list from it: anything never tried, still missing its analysis report, or parsed by an older parser.
+# Statements are written for MariaDB, the few that SQLite cannot take as translated (see databaseAccess.translateSQL) have
+# an SQLite variant picked by the cursor's dialect.
+
+import databaseAccess
+
+STATION_COLUMNS = ['ExpID', 'Performance', 'Performance_UsedVsRecov', 'Date', 'Date_MJD', 'Pos_X', 'Pos_Y', 'Pos_Z', 'Pos_U', 'Pos_E', 'Pos_N',
+                   'W_RMS_del', 'session_fit', 'Analyser', 'vgosDB_tag', 'Manual_Pcal', 'Dropped_Chans', 'Total_Obs', 'Detect_Rate_X', 'Detect_Rate_S', 'Note_Bool', 'Notes']
+
+STATION_COLUMNS_DDL = """Performance decimal(4,3) NOT NULL, Performance_UsedVsRecov decimal(4,3), Date DATETIME , Date_MJD decimal(9,2), Pos_X decimal(14,2), Pos_Y decimal(14,2),
+            Pos_Z decimal(14,2), Pos_U decimal(14,2), Pos_E decimal(14,2), Pos_N decimal(14,2), W_RMS_del decimal(5,2), session_fit decimal(5,2), Total_Obs decimal(9,2),Detect_Rate_X decimal(5,3), Detect_Rate_S decimal(5,3), Manual_Pcal BIT(1),
+            Dropped_Chans VARCHAR(1500), Note_Bool BIT(1), Notes VARCHAR(500), Analyser VARCHAR(10) NOT NULL, vgosDB_tag VARCHAR(18)"""
+
+# Session-wide values, the ones also in STATION_COLUMNS are SHARED_COLUMNS. Network_Size and Scheduled_Obs come from the
+# correlator report (stations correlated, and observations scheduled over all baselines).
+SESSION_COLUMNS = ['ExpID', 'Date', 'Date_MJD', 'session_fit', 'Analyser', 'vgosDB_tag', 'Network_Size', 'Scheduled_Obs']
+SHARED_COLUMNS = [col for col in SESSION_COLUMNS[1:] if col in STATION_COLUMNS]
+UNIFIED_STATION_COLUMNS = [col for col in STATION_COLUMNS if col not in SHARED_COLUMNS or col == 'Date_MJD'] # Date_MJD for the (station, Date_MJD) index
+
+# column -> DDL, also used to add the columns to sessions tables created before they existed
+SESSION_COLUMNS_DDL = {'Date': "Date DATETIME", 'Date_MJD': "Date_MJD decimal(9,2)", 'session_fit': "session_fit decimal(5,2)", 'Analyser': "Analyser VARCHAR(10)",
+                       'vgosDB_tag': "vgosDB_tag VARCHAR(18)", 'Network_Size': "Network_Size INT", 'Scheduled_Obs': "Scheduled_Obs INT"}
+SESSIONS_TABLE = """CREATE TABLE IF NOT EXISTS sessions (ExpID VARCHAR(10) NOT NULL PRIMARY KEY, """ + ", ".join(SESSION_COLUMNS_DDL[col] for col in SESSION_COLUMNS[1:]) + """);"""
+
+UNIFIED_VIEW = 'station_rows'
+UNIFIED_TABLES = ["""CREATE TABLE IF NOT EXISTS station_sessions (station VARCHAR(8) NOT NULL, ExpID VARCHAR(10) NOT NULL, Performance decimal(4,3) NOT NULL,
+                        Performance_UsedVsRecov decimal(4,3), Date_MJD decimal(9,2), Pos_X decimal(14,2), Pos_Y decimal(14,2), Pos_Z decimal(14,2), Pos_U decimal(14,2), Pos_E decimal(14,2),
+                        Pos_N decimal(14,2), W_RMS_del decimal(5,2), Total_Obs decimal(9,2), Detect_Rate_X decimal(5,3), Detect_Rate_S decimal(5,3), Manual_Pcal BIT(1),
+                        Dropped_Chans VARCHAR(1500), Note_Bool BIT(1), Notes VARCHAR(500), PRIMARY KEY (station, ExpID));""",
+                  """CREATE VIEW IF NOT EXISTS """ + UNIFIED_VIEW + """ AS SELECT st.station, """ +
+                        ", ".join(("st." if col in UNIFIED_STATION_COLUMNS else "s.") + col for col in STATION_COLUMNS) + """, s.Session_Type
+                        FROM station_sessions st JOIN sessions s ON s.ExpID = st.ExpID;"""]
+
+# source - analysis, spoolfile, corr or skd; status - parsed, no_stations (parsed, none of our stations), failed or missing.
+LEDGER_COLUMNS = ['ExpID', 'source', 'downloaded', 'size', 'sha1', 'status', 'parser_version', 'rows_written']
+LEDGER_TABLE = """CREATE TABLE IF NOT EXISTS ingest_ledger (ExpID VARCHAR(10) NOT NULL, source VARCHAR(10) NOT NULL, downloaded DATETIME, size BIGINT,
+                        sha1 CHAR(40), status VARCHAR(12) NOT NULL, parser_version INT NOT NULL, rows_written INT, {updated},
+                        PRIMARY KEY (ExpID, source));"""
+LEDGER_UPDATED = {'mariadb': "updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP",
+                  'sqlite': "updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP"}
+LEDGER_DONE = ['parsed', 'no_stations', 'failed'] # only retried after a parser upgrade
+
+# VGOS session codes start with 'v', everything else is a legacy (S/X) session. SQLite can only add a virtual generated
+# column to an existing table, which it can still index.
+SESSION_TYPE_DDL = {'mariadb': "Session_Type CHAR(1) AS (IF(ExpID LIKE 'v%', 'V', 'L')) STORED",
+                    'sqlite': "Session_Type CHAR(1) AS (CASE WHEN ExpID LIKE 'v%' THEN 'V' ELSE 'L' END) VIRTUAL"}
+SESSION_TYPE_SEARCH = 'v%'
+
+# Indexes added to existing tables as well as new ones, (name, columns).
+STATION_INDEXES = [('type_date', 'Session_Type, Date_MJD'), ('station_date_mjd', 'Date_MJD')]
+SESSION_INDEXES = [('sessions_date', 'Date_MJD'), ('sessions_type_date', 'Session_Type, Date_MJD')]
+UNIFIED_INDEXES = [('station_sessions_exp', 'ExpID'), ('station_date', 'station, Date_MJD')]
+LEDGER_INDEXES = [('ledger_status', 'source, status, parser_version')]
+
+def createStationTables(cursor, stationNames, unified=False):
+    cursor.execute(SESSIONS_TABLE)
+    for col in SESSION_COLUMNS[1:]:
+        addColumn(cursor, 'sessions', col, SESSION_COLUMNS_DDL[col])
+    addColumn(cursor, 'sessions', 'Session_Type', SESSION_TYPE_DDL[databaseAccess.dialect(cursor)])
+    if unified:
+        for query in UNIFIED_TABLES:
+            cursor.execute(query)
+    else:
+        for ant in stationNames:
+            query = "CREATE TABLE IF NOT EXISTS " + ant + " (ExpID VARCHAR(10) NOT NULL PRIMARY KEY, " + STATION_COLUMNS_DDL + ");"
+            cursor.execute(query)
+    cursor.execute(LEDGER_TABLE.format(updated=LEDGER_UPDATED[databaseAccess.dialect(cursor)]))
+    ensureIndexes(cursor, stationNames, unified)
+
+def tableColumns(cursor, table):
+    # Column names of a table, an empty list if it doesn't exist.
+    if databaseAccess.dialect(cursor) == 'sqlite':
+        cursor.execute("PRAGMA table_xinfo(" + table + ");") # includes generated columns
+        return [row[1] for row in cursor.fetchall()]
+    cursor.execute("SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION;", [table])
+    return [row[0] for row in cursor.fetchall()]
+
+def addColumn(cursor, table, column, ddl):
+    if databaseAccess.dialect(cursor) == 'sqlite':
+        if column not in tableColumns(cursor, table):
+            cursor.execute("ALTER TABLE " + table + " ADD COLUMN " + ddl + ";")
+    else:
+        cursor.execute("ALTER TABLE " + table + " ADD COLUMN IF NOT EXISTS " + ddl + ";")
+
+def addIndex(cursor, table, name, columns):
+    if databaseAccess.dialect(cursor) == 'sqlite': # index names are per database in SQLite
+        cursor.execute("CREATE INDEX IF NOT EXISTS " + table + "_" + name + " ON " + table + " (" + columns + ");")
+    else:
+        cursor.execute("ALTER TABLE " + table + " ADD INDEX IF NOT EXISTS " + name + " (" + columns + ");")
+
+def ensureIndexes(cursor, stationNames, unified=False):
+    # Add the Session_Type column and report indexes to tables created before they existed, a no-op once present.
+    for name, columns in SESSION_INDEXES:
+        addIndex(cursor, 'sessions', name, columns)
+    if unified:
+        for name, columns in UNIFIED_INDEXES:
+            addIndex(cursor, 'station_sessions', name, columns)
+    else:
+        for ant in stationNames:
+            addColumn(cursor, str(ant), 'Session_Type', SESSION_TYPE_DDL[databaseAccess.dialect(cursor)])
+            for name, columns in STATION_INDEXES:
+                addIndex(cursor, str(ant), name, columns)
+    for name, columns in LEDGER_INDEXES:
+        addIndex(cursor, 'ingest_ledger', name, columns)
+
+def existingExperiments(cursor, stations, unified=False):
+    # Set of ExpIDs that already have a row for any of the given stations.
+    if unified:
+        cursor.execute("SELECT DISTINCT ExpID FROM station_sessions WHERE station IN (" + ", ".join(['%s']*len(stations)) + ");", [str(ant) for ant in stations])
+        return set(row[0] for row in cursor.fetchall())
+    existing_experiments = []
+    for ant in stations:
+        query = "SELECT ExpID FROM " + ant
+        cursor.execute(query)
+        existing_experiments.extend(row[0] for row in cursor.fetchall())
+    return set(existing_experiments)
+
+# How an upsert merges a new value into an existing row, by column:
+#   replace  - the new value always wins (analysis report fields, so corrected reports take effect)
+#   coalesce - the new value wins unless it is NULL, i.e. a report that lacks the field does not wipe it
+#   keep     - the existing value wins unless it is NULL
+MERGE_RULES = {'Performance': 'replace', 'Performance_UsedVsRecov': 'replace', 'Analyser': 'replace', 'Date': 'keep', 'Date_MJD': 'keep'}
+MERGE_DEFAULT = 'coalesce'
+MERGE_SQL = {'replace': "{0}=VALUES({0})", 'coalesce': "{0}=COALESCE(VALUES({0}), {0})", 'keep': "{0}=COALESCE({0}, VALUES({0}))"}
+# The correlator start time is the session date, it replaces the date from the analysis report (parseCorrSkd.py).
+CORR_MERGE_RULES = dict(MERGE_RULES, Date='replace', Date_MJD='replace')
+
+def mergeClause(columns, rules=None):
+    rules = rules or MERGE_RULES
+    return ", ".join(MERGE_SQL[rules.get(col, MERGE_DEFAULT)].format(col) for col in columns)
+
+# VARCHAR widths of the text columns. Strict mode MariaDB rejects longer values in an upsert (INSERT IGNORE used to truncate
+# them), so they are cut to fit before writing.
+COLUMN_WIDTHS = {'ExpID': 10, 'Analyser': 10, 'vgosDB_tag': 18, 'Dropped_Chans': 1500, 'Notes': 500}
+
+def fitRow(row, columns):
+    # row ordered as columns, with the text values cut to COLUMN_WIDTHS
+    return [value[:COLUMN_WIDTHS[col]] if col in COLUMN_WIDTHS and isinstance(value, str) else value for col, value in zip(columns, row)]
+
+def sessionRows(rows_by_station, session_values=None):
+    # One row per experiment ordered as SESSION_COLUMNS, the shared columns taken from its station rows and the session-only
+    # ones from session_values (ExpID -> {column: value}), NULL if not given.
+    session_rows = {}
+    for station, rows in rows_by_station.items():
+        for row in rows:
+            extra = (session_values or {}).get(row[0], {})
+            session_rows[row[0]] = [row[STATION_COLUMNS.index(col)] if col in STATION_COLUMNS else extra.get(col) for col in SESSION_COLUMNS]
+    return list(session_rows.values())
+
+def upsertSessions(cursor, session_rows, rules=None):
+    # session_rows are ordered as SESSION_COLUMNS, merged into existing rows by MERGE_RULES (or rules) like the station rows.
+    if len(session_rows) == 0:
+        return 0
+    cursor.executemany("INSERT INTO sessions (" + ", ".join(SESSION_COLUMNS) + ") VALUES (" + ", ".join(['%s']*len(SESSION_COLUMNS)) +
+                       ") ON DUPLICATE KEY UPDATE " + mergeClause(SESSION_COLUMNS[1:], rules) + ";", session_rows)
+    return cursor.rowcount
+
+def upsertStationRows(cursor, rows_by_station, unified=False, session_values=None, rules=None):
+    # rows_by_station maps station code -> list of complete rows ordered as STATION_COLUMNS. New rows are inserted and
+    # existing ones merged column by column (MERGE_RULES), one executemany per table. The session rows are upserted
+    # once per experiment, and in the unified layout only the per-station columns go into station_sessions.
+    # session_values - optional ExpID -> {column: value} of the session-only columns (Network_Size, Scheduled_Obs).
+    # rules - merge rules to use instead of MERGE_RULES, e.g. CORR_MERGE_RULES.
+    # Returns the affected station row count as reported by the server (1 per insert, 2 per changed row).
+    rows_by_station = {station: [fitRow(row, STATION_COLUMNS) for row in rows] for station, rows in rows_by_station.items()}
+    upsertSessions(cursor, sessionRows(rows_by_station, session_values), rules)
+    affected = 0
+    if unified:
+        indexes = [STATION_COLUMNS.index(col) for col in UNIFIED_STATION_COLUMNS]
+        station_rows = [[station] + [row[i] for i in indexes] for station, rows in rows_by_station.items() for row in rows]
+        if len(station_rows) == 0:
+            return 0
+        cursor.executemany("INSERT INTO station_sessions (station, " + ", ".join(UNIFIED_STATION_COLUMNS) + ") VALUES (%s, " + ", ".join(['%s']*len(UNIFIED_STATION_COLUMNS)) +
+                           ") ON DUPLICATE KEY UPDATE " + mergeClause(UNIFIED_STATION_COLUMNS[1:], rules) + ";", station_rows)
+        return cursor.rowcount
+    columns = ", ".join(STATION_COLUMNS)
+    values = ", ".join(['%s']*len(STATION_COLUMNS))
+    merge = " ON DUPLICATE KEY UPDATE " + mergeClause(STATION_COLUMNS[1:], rules) + ";"
+    for station, rows in rows_by_station.items():
+        cursor.executemany("INSERT INTO " + station + " (" + columns + ") VALUES (" + values + ")" + merge, rows)
+        affected += cursor.rowcount
+    return affected
+
+def fetchStationRows(cursor, exp_id, stations, unified=False):
+    # Existing rows of one experiment in a single query, station code -> row ordered as STATION_COLUMNS.
+    columns = ", ".join(STATION_COLUMNS)
+    stations = [str(ant) for ant in stations]
+    if len(stations) == 0:
+        return {}
+    if unified:
+        cursor.execute("SELECT station, " + columns + " FROM " + UNIFIED_VIEW + " WHERE ExpID = %s AND station IN (" + ", ".join(['%s']*len(stations)) + ");", [exp_id] + stations)
+    else:
+        query = " UNION ALL ".join("SELECT %s, " + columns + " FROM " + ant + " WHERE ExpID = %s" for ant in stations)
+        params = []
+        for ant in stations:
+            params.extend([ant, exp_id])
+        cursor.execute(query + ";", params)
+    return {row[0]: list(row[1:]) for row in cursor.fetchall()}
+
+def recordIngest(cursor, entries):
+    # entries are rows ordered as LEDGER_COLUMNS, an existing (ExpID, source) entry is overwritten.
+    if len(entries) == 0:
+        return
+    cursor.executemany("INSERT INTO ingest_ledger (" + ", ".join(LEDGER_COLUMNS) + ") VALUES (" + ", ".join(['%s']*len(LEDGER_COLUMNS)) +
+                       ") ON DUPLICATE KEY UPDATE " + ", ".join(col + "=VALUES(" + col + ")" for col in LEDGER_COLUMNS[2:]) + ";", entries)
+
+def ledgerState(cursor):
+    # ExpID -> parser version for every experiment whose analysis report has been through the parser (ledger_status index).
+    cursor.execute("SELECT ExpID, parser_version FROM ingest_ledger WHERE source = 'analysis' AND status IN (" + ", ".join(['%s']*len(LEDGER_DONE)) + ");", LEDGER_DONE)
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+def seedLedger(cursor, stations, parser_version, unified=False):
+    # Mark experiments already in the station tables as parsed by the current parser_version, so a database that predates
+    # the ledger is not re-ingested. Bump the version after seeding to re-parse them.
+    cursor.execute("SELECT COUNT(*) FROM ingest_ledger;")
+    if cursor.fetchone()[0] > 0:
+        return 0
+    tables = ['station_sessions'] if unified else [str(ant) for ant in stations]
+    seeded = 0
+    for table in tables:
+        cursor.execute("INSERT IGNORE INTO ingest_ledger (ExpID, source, status, parser_version) SELECT DISTINCT ExpID, 'analysis', 'parsed', %s FROM " + table + ";", [parser_version])
+        seeded += cursor.rowcount
+    return seeded
+
+def sessionTypeFilter(search, like):
+    # The VGOS/legacy split is a Session_Type lookup, any other search string falls back to a LIKE on ExpID.
+    if search == SESSION_TYPE_SEARCH:
+        return "Session_Type = %s", ['L' if like == "NOT LIKE" else 'V']
+    return "ExpID " + like + " %s", [search]
+
+def reportQuery(station_code, columns, search, like, mjd_start, mjd_stop, unified=False):
+    # Query and parameters used by summaryGenerator.extractStationColumns.
+    type_filter, type_params = sessionTypeFilter(search, like)
+    if unified:
+        query = ("SELECT " + ", ".join(columns) + " FROM " + UNIFIED_VIEW + " WHERE station = %s AND " + type_filter +
+                 " AND Date_MJD > %s AND Date_MJD < %s ORDER BY Date_MJD ASC;")
+        return query, [str(station_code)] + type_params + [mjd_start, mjd_stop]
+    query = "SELECT " + ", ".join(columns) + " FROM " + station_code + " WHERE " + type_filter + " AND Date_MJD > %s AND Date_MJD < %s ORDER BY Date_MJD ASC;"
+    return query, type_params + [mjd_start, mjd_stop]
+
+def explainReportQuery(cursor, station_code, columns, search, like, mjd_start, mjd_stop, unified=False):
+    # EXPLAIN the report query, returns (plan rows as dicts, list of problems). A full scan, a filesort or no index
+    # being chosen is reported as a problem.
+    query, params = reportQuery(station_code, columns, search, like, mjd_start, mjd_stop, unified)
+    if databaseAccess.dialect(cursor) == 'sqlite':
+        cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        plan = [{'detail': row[-1]} for row in cursor.fetchall()]
+        problems = []
+        for step in plan:
+            if step['detail'].startswith('SCAN'):
+                problems.append(step['detail'].lower().replace('scan', 'full table scan of', 1))
+            if 'TEMP B-TREE' in step['detail']:
+                problems.append('filesort (' + step['detail'].lower() + ')')
+            index = step['detail'].split(' INDEX ')[1].split()[0] if ' INDEX ' in step['detail'] else None
+            step['key'] = 'PRIMARY' if 'PRIMARY KEY' in step['detail'] else index
+        return plan, problems
+    cursor.execute("EXPLAIN " + query, params)
+    names = [description[0] for description in cursor.description]
+    plan = [dict(zip(names, row)) for row in cursor.fetchall()]
+    problems = []
+    for step in plan:
+        if step.get('type') == 'ALL':
+            problems.append('full table scan of ' + str(step.get('table')))
+        if step.get('key') == None:
+            problems.append('no index used on ' + str(step.get('table')))
+        if 'filesort' in str(step.get('Extra') or ''):
+            problems.append('filesort on ' + str(step.get('table')))
+    return plan, problems
+
+def copySessions(cursor, table):
+    # Add the experiments of a per-station table to sessions, existing session rows are left as they are.
+    columns = ", ".join(['ExpID'] + SHARED_COLUMNS)
+    cursor.execute("INSERT IGNORE INTO sessions (" + columns + ") SELECT " + columns + " FROM " + table + ";")
+    return cursor.rowcount
+
+def seedSessions(cursor, stations, unified=False):
+    # Fill an empty sessions table from the per-station tables of a database that predates it (the unified layout always
+    # had it).
+    if unified:
+        return 0
+    cursor.execute("SELECT COUNT(*) FROM sessions;")
+    if cursor.fetchone()[0] > 0:
+        return 0
+    return sum(copySessions(cursor, str(ant)) for ant in stations)
+
+def migrateToUnified(cursor, stations):
+    # Copy the per-station tables into station_sessions/sessions, existing unified rows are left as they are.
+    createStationTables(cursor, stations, unified=True)
+    columns = ", ".join(UNIFIED_STATION_COLUMNS)
+    copied = {}
+    for ant in stations:
+        copySessions(cursor, str(ant))
+        cursor.execute("INSERT IGNORE INTO station_sessions (station, " + columns + ") SELECT %s, " + columns + " FROM " + ant + ";", [str(ant)])
+        copied[str(ant)] = cursor.rowcount
+    return copied
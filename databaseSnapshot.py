@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import argparse
+from datetime import datetime
+from decimal import Decimal
+import numpy as np
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as ds
+except ImportError: # snapshots are skipped without pyarrow
+    pa = None
+
+# Columnar snapshot of the station data as Parquet files, partitioned by station and year (hive layout, e.g.
+# snapshot/station=Hb/year=2024/part-0.parquet). databaseCore refreshes the partitions it wrote to after each ingest,
+# and the summary reports read from the snapshot instead of querying the database. readSnapshot only loads the requested
+# columns, and the station/year partitions and Date_MJD/Session_Type statistics let it skip files outside the range.
+
+# Source other modules
+import databaseAccess
+import databaseSchema
+import atomicFile
+
+dirname = os.path.dirname(__file__)
+
+DEFAULT_SNAPSHOT_DIR = dirname + '/snapshot'
+SNAPSHOT_COLUMNS = databaseSchema.STATION_COLUMNS + ['Session_Type']
+STRING_COLUMNS = ['ExpID', 'Analyser', 'vgosDB_tag', 'Dropped_Chans', 'Notes', 'Session_Type']
+BOOL_COLUMNS = ['Manual_Pcal', 'Note_Bool']
+MJD_EPOCH = datetime(1858, 11, 17)
+
+def available():
+    return pa != None
+
+def requirePyarrow():
+    if pa == None:
+        raise ImportError('pyarrow is required for database snapshots (pip install pyarrow)')
+
+def yearMJD(year):
+    # MJD of 00:00 on the 1st of January
+    return (datetime(year, 1, 1) - MJD_EPOCH).days
+
+def mjdYear(mjd):
+    return (datetime.fromordinal(MJD_EPOCH.toordinal() + int(mjd))).year
+
+def touchedPartitions(rows_by_station):
+    # (station, year) partitions of rows ordered as databaseSchema.STATION_COLUMNS
+    date_index = databaseSchema.STATION_COLUMNS.index('Date_MJD')
+    return set((str(station), mjdYear(row[date_index])) for station, rows in rows_by_station.items() for row in rows if row[date_index] != None)
+
+def arrowSchema():
+    fields = []
+    for col in SNAPSHOT_COLUMNS:
+        if col in STRING_COLUMNS:
+            fields.append(pa.field(col, pa.string()))
+        elif col in BOOL_COLUMNS:
+            fields.append(pa.field(col, pa.bool_()))
+        elif col == 'Date':
+            fields.append(pa.field(col, pa.timestamp('s')))
+        else:
+            fields.append(pa.field(col, pa.float64()))
+    return pa.schema(fields)
+
+def columnValue(col, value):
+    # Driver values to plain Python ones (BIT columns come back from MariaDB as bytes, decimals as Decimal).
+    if value == None:
+        return None
+    if col in BOOL_COLUMNS:
+        return bool(value[0]) if isinstance(value, bytes) else bool(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if col == 'Date' and isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+def rowsToTable(rows):
+    schema = arrowSchema()
+    columns = list(zip(*rows)) if len(rows) > 0 else [[] for col in SNAPSHOT_COLUMNS]
+    arrays = [pa.array([columnValue(col, value) for value in values], type=schema.field(col).type) for col, values in zip(SNAPSHOT_COLUMNS, columns)]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def partitionPath(snapshot_dir, station, year):
+    return os.path.join(snapshot_dir, 'station=' + str(station), 'year=' + str(year))
+
+def writePartition(snapshot_dir, station, year, rows):
+    # Replace one station/year partition atomically, an empty partition is removed.
+    path = partitionPath(snapshot_dir, station, year)
+    if len(rows) == 0:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        return
+    os.makedirs(path, exist_ok=True)
+    table = rowsToTable(rows)
+    atomicFile.writeAtomic(os.path.join(path, 'part-0.parquet'), lambda file: pq.write_table(table, file))
+
+def stationRows(cursor, station, unified=False, mjd_start=None, mjd_stop=None):
+    columns = ", ".join(SNAPSHOT_COLUMNS)
+    conditions = []
+    params = []
+    if unified:
+        conditions.append("station = %s")
+        params.append(str(station))
+    if mjd_start != None:
+        conditions.append("Date_MJD >= %s AND Date_MJD < %s")
+        params.extend([mjd_start, mjd_stop])
+    table = databaseSchema.UNIFIED_VIEW if unified else str(station)
+    where = " WHERE " + " AND ".join(conditions) if len(conditions) > 0 else ""
+    cursor.execute("SELECT " + columns + " FROM " + table + where + " ORDER BY Date_MJD ASC;", params)
+    return cursor.fetchall()
+
+def exportSnapshot(db_name, stations, unified=False, snapshot_dir=DEFAULT_SNAPSHOT_DIR, touched=None):
+    # touched - optional set of (station, year) partitions to refresh, everything is exported when None or when there is
+    # no snapshot yet. Returns the number of partitions written.
+    requirePyarrow()
+    if not os.path.isdir(snapshot_dir):
+        touched = None
+    written = 0
+    with databaseAccess.connection(db_name) as conn:
+        cursor = conn.cursor()
+        for station in stations:
+            station = str(station)
+            if touched == None:
+                by_year = {}
+                for row in stationRows(cursor, station, unified):
+                    if row[4] != None:
+                        by_year.setdefault(mjdYear(row[4]), []).append(row)
+                for year, rows in by_year.items():
+                    writePartition(snapshot_dir, station, year, rows)
+                    written += 1
+            else:
+                for year in sorted(year for ant, year in touched if ant == station):
+                    writePartition(snapshot_dir, station, year, stationRows(cursor, station, unified, yearMJD(year), yearMJD(year + 1)))
+                    written += 1
+        cursor.close()
+    return written
+
+def refreshSnapshot(db_name, stations, unified=False, snapshot_dir=DEFAULT_SNAPSHOT_DIR, touched=None, create=True):
+    # Re-export the touched partitions after a write. create - export the whole snapshot if there isn't one yet, otherwise
+    # a missing snapshot is left missing (the reports then read the database).
+    if snapshot_dir == None or (not create and not os.path.isdir(snapshot_dir)):
+        return
+    if not available():
+        print("pyarrow not installed, skipping the Parquet snapshot.")
+        return
+    if touched != None and len(touched) == 0 and os.path.isdir(snapshot_dir):
+        return
+    written = exportSnapshot(db_name, stations, unified, snapshot_dir, touched)
+    print("Refreshed " + str(written) + " snapshot partitions in " + snapshot_dir + ".")
+
+def readSnapshot(station, columns=None, mjd_start=None, mjd_stop=None, session_type=None, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    # Arrow table of one station's rows, restricted to the given columns, Date_MJD range (exclusive, as in the report
+    # query) and Session_Type ('V' or 'L'), sorted by Date_MJD. Only the matching partitions and row groups are read.
+    requirePyarrow()
+    dataset = ds.dataset(os.path.join(snapshot_dir, 'station=' + str(station)), format='parquet',
+                         partitioning=ds.partitioning(pa.schema([('year', pa.int32())]), flavor='hive'))
+    condition = None
+    def add(expr):
+        return expr if condition is None else condition & expr
+    if mjd_start != None:
+        condition = add((ds.field('year') >= mjdYear(mjd_start)) & (ds.field('Date_MJD') > mjd_start))
+    if mjd_stop != None:
+        condition = add((ds.field('year') <= mjdYear(mjd_stop)) & (ds.field('Date_MJD') < mjd_stop))
+    if session_type != None:
+        condition = add(ds.field('Session_Type') == session_type)
+    table = dataset.to_table(columns=list(columns) if columns != None else SNAPSHOT_COLUMNS, filter=condition)
+    return table.sort_by('Date_MJD') if 'Date_MJD' in table.column_names else table
+
+def tableColumns(table):
+    # Arrow table -> dict of numpy arrays, numeric columns without nulls are not copied. Dates are returned as datetime
+    # objects and missing values as None, matching what the database cursor returns.
+    columns = {}
+    for name in table.column_names:
+        column = table.column(name)
+        if column.null_count > 0 or pa.types.is_timestamp(column.type):
+            values = np.empty(len(column), dtype=object)
+            values[:] = column.to_pylist()
+            columns[name] = values
+        else:
+            columns[name] = column.to_numpy()
+    return columns
+
+def parseFunc():
+    # Argument parsing
+    parser = argparse.ArgumentParser(description="""Export the station tables to a Parquet snapshot partitioned by station and year, for the summary reports and
+                                        offline analysis. databaseCore.py, parseAnalysisSpool.py and parseCorrSkd.py refresh the partitions they change, this rebuilds the whole snapshot.""")
+    parser.add_argument('sql_db_name',
+                        help="""The name of the SQL database to export.""")
+    parser.add_argument('--snapshot-dir', dest='snapshot_dir', default=DEFAULT_SNAPSHOT_DIR,
+                        help="""Directory to write the snapshot to (default: snapshot/ in this directory).""")
+    parser.add_argument('--unified-schema', dest='unified', action='store_true', default=False,
+                        help="""Export from the unified station_sessions table instead of the per-station tables.""")
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    import databaseCore
+    args = parseFunc()
+    stationNames, stationNamesLong = databaseCore.stationParse(dirname + '/stations.config')
+    print("Wrote " + str(exportSnapshot(args.sql_db_name, stationNames, args.unified, args.snapshot_dir)) + " snapshot partitions.")
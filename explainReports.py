@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import argparse
+from datetime import datetime
+from astropy.time import Time
+
+# Source other modules
+import databaseAccess
+import databaseCore
+import databaseSchema
+
+dirname = os.path.dirname(__file__)
+
+REPORT_COLUMNS = ["ExpID", "Date", "Date_MJD", "Performance", "Performance_UsedVsRecov", "session_fit", "W_RMS_del", "Detect_Rate_X", "Detect_Rate_S", "Total_Obs", "Notes", "Pos_X", "Pos_Y", "Pos_Z", "Pos_E", "Pos_N", "Pos_U"]
+
+def parseFunc():
+    # Argument parsing
+    parser = argparse.ArgumentParser(description="""Run EXPLAIN on the VGOS and legacy report queries for every station and check they are served by the
+                                        Session_Type/Date_MJD indexes rather than a full table scan and filesort. Exits non-zero if any query is not.""")
+    parser.add_argument('sql_db_name',
+                        help="""The name of the SQL database to check.""")
+    parser.add_argument('--days', dest='days', type=int, default=180,
+                        help="""Length of the report window to explain, ending today (default 180, as used by updateReports.py).""")
+    parser.add_argument('--unified-schema', dest='unified', action='store_true', default=False,
+                        help="""Check the unified station_sessions table instead of the per-station tables.""")
+    args = parser.parse_args()
+    return args
+
+def main(db_name, days=180, unified=False):
+    stationNames, stationNamesLong = databaseCore.stationParse(dirname + '/stations.config')
+    mjd_stop = Time(datetime.now()).mjd
+    mjd_start = mjd_stop - days
+    with databaseAccess.connection(db_name) as conn:
+        cursor = conn.cursor()
+        failures = 0
+        for station in stationNames:
+            for like, label in [("LIKE", 'VGOS'), ("NOT LIKE", 'legacy')]:
+                plan, problems = databaseSchema.explainReportQuery(cursor, str(station), REPORT_COLUMNS, 'v%', like, mjd_start, mjd_stop, unified)
+                keys = ', '.join(str(step.get('key')) for step in plan)
+                if len(problems) > 0:
+                    failures += 1
+                    print(str(station) + ' ' + label + ': ' + '; '.join(problems) + ' (key: ' + keys + ')')
+                else:
+                    print(str(station) + ' ' + label + ': ok (key: ' + keys + ')')
+        cursor.close()
+    return failures
+
+if __name__ == '__main__':
+    args = parseFunc()
+    sys.exit(1 if main(args.sql_db_name, args.days, args.unified) > 0 else 0)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+from ftplib import FTP_TLS
+import ftplib
+import socket
+import ssl
+import threading
+import atexit
+import time
+from contextlib import contextmanager
+
+# Source other modules
+import resourcePool
+
+# Shared pool of authenticated FTP_TLS sessions. Opening a CDDIS session costs a TCP connect, a TLS handshake, a login and a
+# prot_p() handshake, so sessions are kept alive between files/experiments and handed out to whichever module needs one.
+
+CDDIS_HOST = 'gdc.cddis.eosdis.nasa.gov'
+CDDIS_USER = 'anonymous'
+CDDIS_PASSWD = 'tiegem@utas.edu.au'
+
+# Errors that mean the control connection is gone (server timeout, dropped socket, TLS failure) rather than a missing file.
+# Not OSError as a whole, so a local file error (e.g. a full disk while writing a download) is not retried on a new session.
+CONNECTION_ERRORS = (ConnectionError, socket.timeout, ssl.SSLError, EOFError)
+
+class ftpSessionPool(resourcePool.resourcePool):
+    def __init__(self, host=CDDIS_HOST, user=CDDIS_USER, passwd=CDDIS_PASSWD, max_sessions=2, keepalive=60, timeout=60):
+        # max_sessions also acts as the per-host concurrency limit, idle sessions are NOOP'd after keepalive seconds
+        super().__init__(max_sessions, keepalive)
+        self.host = host
+        self.user = user
+        self.passwd = passwd
+        self.timeout = timeout
+        self._keepalive_thread = None
+
+    def _connect(self):
+        ftps = FTP_TLS(host=self.host, timeout=self.timeout)
+        ftps.login(user=self.user, passwd=self.passwd)
+        ftps.prot_p()
+        ftps.sendcmd('TYPE I')
+        return ftps
+
+    def _alive(self, ftps):
+        try:
+            ftps.voidcmd('NOOP')
+            return True
+        except ftplib.all_errors:
+            return False
+
+    def _close(self, ftps):
+        try:
+            ftps.quit()
+        except ftplib.all_errors:
+            self._discard(ftps)
+
+    def acquire(self):
+        ftps = super().acquire()
+        self._startKeepalive()
+        return ftps
+
+    @contextmanager
+    def session(self):
+        ftps = self.acquire()
+        try:
+            yield ftps
+        except CONNECTION_ERRORS:
+            self.release(ftps, broken=True)
+            raise
+        except BaseException:
+            self.release(ftps)
+            raise
+        else:
+            self.release(ftps)
+
+    def call(self, func, retries=1):
+        # Run func(ftps) on a pooled session, reconnecting and retrying if the connection dropped underneath it.
+        for attempt in range(0, retries + 1):
+            try:
+                with self.session() as ftps:
+                    return func(ftps)
+            except CONNECTION_ERRORS:
+                if attempt == retries:
+                    raise
+
+    def _startKeepalive(self):
+        if self.keepalive and self._keepalive_thread is None:
+            self._keepalive_thread = threading.Thread(target=self._keepaliveLoop, daemon=True)
+            self._keepalive_thread.start()
+
+    def _keepaliveLoop(self):
+        # NOOP idle sessions so the server does not drop them between experiments.
+        while not self._closed:
+            time.sleep(self.keepalive / 2)
+            with self._cond:
+                stale = [entry for entry in self._idle if time.time() - entry[1] > self.keepalive / 2]
+                for entry in stale:
+                    self._idle.remove(entry)
+            for entry in stale:
+                if self._alive(entry[0]):
+                    self.release(entry[0])
+                else:
+                    self.release(entry[0], broken=True)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def getPool(host=CDDIS_HOST, max_sessions=2):
+    # Process-wide pool per host, shared by databaseReportDownloader and databaseCore.
+    with _pools_lock:
+        if host not in _pools:
+            _pools[host] = ftpSessionPool(host=host, max_sessions=max_sessions)
+        _pools[host].resize(max_sessions)
+        return _pools[host]
+
+def closePools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeAll()
+        _pools.clear()
+
+atexit.register(closePools)
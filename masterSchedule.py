@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+import os
+import re
+import json
+import hashlib
+from datetime import datetime
+from typing import NamedTuple
+import numpy as np
+
+# Parsing and incremental handling of the IVS master schedules. parseMasterSchedule turns a schedule into typed session
+# records in a single pass. For the pipeline every session line is also fingerprinted and stored along with the fields
+# parsed from it, so a run only has to look at sessions that are new or whose line changed (e.g. a station was added or
+# removed), plus any sessions still waiting on files from a previous run.
+
+# Source other modules
+import atomicFile
+
+dirname = os.path.dirname(__file__)
+
+SCHEDULE_SESSIONS_FILE = dirname + '/schedule_sessions.json'
+
+def fileHash(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def lineHash(line):
+    return hashlib.sha1(line.rstrip('\n').encode()).hexdigest()[:16]
+
+def loadSessionTables():
+    if os.path.isfile(SCHEDULE_SESSIONS_FILE):
+        with open(SCHEDULE_SESSIONS_FILE) as file:
+            return json.load(file)
+    return {}
+
+def saveSessionTables(tables):
+    atomicFile.writeAtomic(SCHEDULE_SESSIONS_FILE, lambda file: file.write(json.dumps(tables, indent=1, sort_keys=True).encode()))
+
+# Field positions (after splitting on '|') for each master schedule format version.
+#   v1: |NAME|CODE|MONDD|DOY|HH:MM|DUR(h)|STATIONS|SKED|CORR|STATUS|PF|DBC|SUBM|DEL|MK4|
+#   v2: |TYPE|NAME|CODE|YYYYMMDD|HH:MM|HH:MM|STATIONS|SKED|CORR|STATUS|DBC|SUBM|DEL|
+FIELDS = {1: {'name': 1, 'code': 2, 'doy': 4, 'time': 5, 'duration': 6, 'stations': 7, 'correlator': 9, 'dbc': 12},
+          2: {'name': 2, 'code': 3, 'date': 4, 'time': 5, 'duration': 6, 'stations': 7, 'correlator': 9, 'dbc': 11}}
+
+class sessionRecord(NamedTuple):
+    code: str
+    name: str
+    start: datetime
+    duration: float # hours
+    stations: tuple # 2 character codes of the participating stations (removed stations excluded)
+    correlator: str
+    dbc: str
+    version: int
+
+def scheduleVersion(first_line):
+    if ' 2.0 ' in first_line:
+        return 2
+    elif ' 1.0 ' in first_line:
+        return 1
+    return None
+
+def scheduleYear(master_schedule):
+    # masterYY.txt (v1) or masterYYYY.txt (v2), also with a suffix such as master2024-int.txt
+    schedule = os.path.basename(str(master_schedule))
+    digits = re.match(r'master(\d{4}|\d{2})', schedule).group(1)
+    if len(digits) == 2:
+        return (1900 if int(digits) > 78 else 2000) + int(digits)
+    return int(digits)
+
+def parseHours(text):
+    text = text.strip()
+    if ':' in text:
+        hours, minutes = text.split(':')[0:2]
+        return int(hours) + int(minutes)/60
+    return float(text)
+
+def parseStations(text):
+    # 'HbKeYg -AgWz' -> ('Hb', 'Ke', 'Yg'), everything after the '-' was removed from the session
+    active = text.split('-')[0].replace(' ', '')
+    return tuple(active[i:i+2] for i in range(0, len(active) - 1, 2))
+
+def parseSessionLine(line, version, year):
+    # Returns a sessionRecord for a released session line, or None for anything else (headers, unreleased sessions).
+    fields = line.split('|')
+    if len(fields) < 14:
+        return None
+    if version == 2:
+        if len(fields[10].strip()) != 8:
+            return None
+    elif version == 1:
+        if '1.0' not in fields[11]:
+            return None
+    else:
+        return None
+    index = FIELDS[version]
+    try:
+        time_field = fields[index['time']].strip().replace(':', '')
+        if version == 2:
+            start = datetime.strptime(fields[index['date']].strip() + time_field, '%Y%m%d%H%M')
+        else:
+            start = datetime.strptime(str(year) + fields[index['doy']].strip().zfill(3) + time_field, '%Y%j%H%M')
+        duration = parseHours(fields[index['duration']])
+    except ValueError:
+        start = None
+        duration = None
+    return sessionRecord(fields[index['code']].strip(), fields[index['name']].strip(), start, duration,
+                         parseStations(fields[index['stations']]), fields[index['correlator']].strip(),
+                         fields[index['dbc']].strip(), version)
+
+def parseMasterSchedule(master_schedule):
+    # Single pass over a master schedule, the format version is detected once from the header line.
+    year = scheduleYear(master_schedule)
+    records = []
+    with open(master_schedule) as file:
+        version = scheduleVersion(file.readline())
+        for line in file:
+            record = parseSessionLine(line, version, year)
+            if record != None:
+                records.append(record)
+    return records
+
+def stationMatcher(station_names):
+    # station code -> column of the participation matrix, built once per run
+    return {str(name): i for i, name in enumerate(station_names)}
+
+def participates(record_stations, matcher):
+    return any(station in matcher for station in record_stations)
+
+def participationMatrix(records, station_names):
+    # Boolean (sessions x stations) matrix, e.g. records[matrix[:, j]] are the sessions involving station_names[j].
+    matcher = stationMatcher(station_names)
+    matrix = np.zeros((len(records), len(matcher)), dtype=bool)
+    for i, record in enumerate(records):
+        for station in record.stations:
+            j = matcher.get(station)
+            if j != None:
+                matrix[i, j] = True
+    return matrix
+
+def sessionsWithStation(records, matrix, station_names, station):
+    j = list(map(str, station_names)).index(str(station))
+    return [records[i] for i in np.flatnonzero(matrix[:, j])]
+
+def recordToDict(record):
+    entry = record._asdict()
+    entry['start'] = record.start.strftime('%Y-%m-%dT%H:%M') if record.start != None else None
+    entry['stations'] = list(record.stations)
+    return entry
+
+def recordFromDict(entry):
+    start = datetime.strptime(entry['start'], '%Y-%m-%dT%H:%M') if entry['start'] != None else None
+    return sessionRecord(entry['code'], entry['name'], start, entry['duration'], tuple(entry['stations']),
+                         entry['correlator'], entry['dbc'], entry['version'])
+
+def diffMasterSchedule(master_schedule, station_names):
+    # Compare a master schedule against its stored fingerprint table. Returns a dict with
+    #   valid    - codes of sessions involving a configured station, in schedule order
+    #   changed  - valid codes that are new, or whose line changed, since the table was last saved
+    #   pending  - valid codes left unprocessed by a previous run
+    #   sessions - code -> stored session fields (see recordToDict)
+    # The table itself is only written by saveScheduleDiff, once the caller has processed the sessions.
+    schedule = os.path.basename(str(master_schedule))
+    station_names = [str(name) for name in station_names]
+    tables = loadSessionTables()
+    table = tables.get(schedule, {'sha1': None, 'stations': [], 'sessions': {}, 'order': [], 'ignored': [], 'pending': []})
+    sha1 = fileHash(master_schedule)
+    matcher = stationMatcher(station_names)
+    restation = table['stations'] != station_names
+    ignored = set(table.get('ignored', []))
+    if sha1 == table['sha1']:
+        sessions = table['sessions']
+        order = table['order']
+        changed = set()
+    else:
+        known = {entry['hash']: code for code, entry in table['sessions'].items()}
+        year = scheduleYear(master_schedule)
+        with open(master_schedule) as file:
+            first_line = file.readline()
+            version = scheduleVersion(first_line)
+            sessions = {}
+            order = []
+            changed = set()
+            ignored_now = set()
+            for line in [first_line] + list(file):
+                digest = lineHash(line)
+                if digest in ignored:
+                    ignored_now.add(digest)
+                    continue
+                if digest in known: # unchanged line, nothing to parse
+                    code = known[digest]
+                    entry = table['sessions'][code]
+                else:
+                    record = parseSessionLine(line, version, year)
+                    if record == None:
+                        ignored_now.add(digest)
+                        continue
+                    code = record.code
+                    entry = recordToDict(record)
+                    entry['hash'] = digest
+                    entry['valid'] = participates(record.stations, matcher)
+                    previous = table['sessions'].get(code)
+                    if entry['valid'] and (previous == None or previous['hash'] != digest or not previous['valid']):
+                        changed.add(code)
+                if code not in sessions:
+                    order.append(code)
+                sessions[code] = entry
+        ignored = ignored_now
+    if restation: # station list edited - participation is re-derived from the stored station lists, no re-parse needed
+        for code in order:
+            valid = participates(sessions[code]['stations'], matcher)
+            if valid and not sessions[code]['valid']:
+                changed.add(code)
+            sessions[code]['valid'] = valid
+    valid = [code for code in order if sessions[code]['valid']]
+    valid_set = set(valid)
+    pending = set(code for code in table['pending'] if code in valid_set)
+    return {'schedule': schedule, 'sha1': sha1, 'stations': station_names, 'sessions': sessions, 'order': order,
+            'ignored': sorted(ignored), 'valid': valid, 'changed': changed, 'pending': pending}
+
+def saveScheduleDiff(diff, pending):
+    # Store the fingerprint table for this schedule along with the sessions that still need processing next run.
+    tables = loadSessionTables()
+    tables[diff['schedule']] = {'sha1': diff['sha1'], 'stations': diff['stations'], 'sessions': diff['sessions'],
+                                'order': diff['order'], 'ignored': diff['ignored'], 'pending': sorted(set(pending))}
+    saveSessionTables(tables)
+
+def workList(diff, existing_experiments):
+    # Sessions worth processing this run: new/changed or still pending, and not already in the database.
+    return [code for code in diff['valid'] if (code in diff['changed'] or code in diff['pending']) and code.lower() not in existing_experiments]
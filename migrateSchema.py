@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+
+# Source other modules
+import databaseAccess
+import databaseCore
+import databaseSchema
+
+dirname = os.path.dirname(__file__)
+
+def parseFunc():
+    # Argument parsing
+    parser = argparse.ArgumentParser(description="""Copy the per-station tables of an existing database into the unified station_sessions/sessions tables. The
+                                        per-station tables are left in place, so the script can be re-run and the old layout is still available until dropped by hand.""")
+    parser.add_argument('sql_db_name',
+                        help="""The name of the SQL database to migrate.""")
+    args = parser.parse_args()
+    return args
+
+def main(db_name):
+    stationNames, stationNamesLong = databaseCore.stationParse(dirname + '/stations.config')
+    with databaseAccess.connection(db_name) as conn:
+        cursor = conn.cursor()
+        try:
+            copied = databaseSchema.migrateToUnified(cursor, stationNames)
+            conn.commit()
+        except databaseAccess.DatabaseError as e:
+            conn.rollback()
+            print('Error migrating ' + str(db_name) + ': ' + str(e))
+            return
+        cursor.close()
+    for station, rows in copied.items():
+        print('Copied ' + str(rows) + ' rows from ' + station + '.')
+
+if __name__ == '__main__':
+    args = parseFunc()
+    main(args.sql_db_name)
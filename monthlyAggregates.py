@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+import os
+import argparse
+from datetime import datetime
+import numpy as np
+
+# Per station, month and session type summary statistics (count, min, percentiles, max) of the headline metrics, kept
+# in the monthly_aggregates table. Percentiles can't be updated from a delta, so whenever rows are written the
+# (station, month) groups they fall in are recomputed from the station rows of that month only - a few dozen rows -
+# in the same transaction. Reports and network comparisons can then read a few hundred pre-aggregated rows instead
+# of every station table.
+
+# Source other modules
+import databaseAccess
+import databaseSchema
+
+dirname = os.path.dirname(__file__)
+
+MJD_EPOCH = datetime(1858, 11, 17)
+
+# Metrics aggregated, with the placeholder value the summary report also filters out (as well as NULLs).
+AGGREGATE_METRICS = {'W_RMS_del': -999, 'Performance': 0, 'Detect_Rate_X': 0, 'Detect_Rate_S': 0}
+PERCENTILES = [10, 25, 50, 75, 90]
+AGGREGATE_COLUMNS = ['station', 'month', 'Session_Type', 'metric', 'n', 'min', 'p10', 'p25', 'median', 'p75', 'p90', 'max']
+AGGREGATE_TABLE = """CREATE TABLE IF NOT EXISTS monthly_aggregates (station VARCHAR(8) NOT NULL, month CHAR(7) NOT NULL, Session_Type CHAR(1) NOT NULL,
+                        metric VARCHAR(24) NOT NULL, n INT NOT NULL, min DOUBLE, p10 DOUBLE, p25 DOUBLE, median DOUBLE, p75 DOUBLE, p90 DOUBLE, max DOUBLE,
+                        PRIMARY KEY (station, month, Session_Type, metric));"""
+AGGREGATE_INDEXES = [('aggregates_metric', 'metric, month')]
+
+def mjdMonth(mjd):
+    # 'YYYY-MM' of a MJD
+    return datetime.fromordinal(MJD_EPOCH.toordinal() + int(mjd)).strftime('%Y-%m')
+
+def monthRange(month):
+    # [start, stop) MJD of a 'YYYY-MM' month
+    year, number = [int(x) for x in month.split('-')]
+    start = datetime(year, number, 1)
+    stop = datetime(year + number // 12, number % 12 + 1, 1)
+    return (start - MJD_EPOCH).days, (stop - MJD_EPOCH).days
+
+def createAggregatesTable(cursor):
+    cursor.execute(AGGREGATE_TABLE)
+    for name, columns in AGGREGATE_INDEXES:
+        databaseSchema.addIndex(cursor, 'monthly_aggregates', name, columns)
+
+def touchedMonths(rows_by_station):
+    # (station, month) groups of rows ordered as databaseSchema.STATION_COLUMNS
+    date_index = databaseSchema.STATION_COLUMNS.index('Date_MJD')
+    return set((str(station), mjdMonth(row[date_index])) for station, rows in rows_by_station.items() for row in rows if row[date_index] != None)
+
+def summarise(values, placeholder):
+    values = np.array([np.nan if value is None else float(value) for value in values], dtype=float)
+    values = values[~np.isnan(values) & (values != placeholder)]
+    if len(values) == 0:
+        return None
+    percentiles = np.percentile(values, PERCENTILES)
+    return [len(values), float(values.min())] + [float(value) for value in percentiles] + [float(values.max())]
+
+def monthRows(cursor, station, month, unified=False):
+    start, stop = monthRange(month)
+    columns = "Session_Type, " + ", ".join(AGGREGATE_METRICS)
+    if unified:
+        cursor.execute("SELECT " + columns + " FROM " + databaseSchema.UNIFIED_VIEW + " WHERE station = %s AND Date_MJD >= %s AND Date_MJD < %s;", [station, start, stop])
+    else:
+        cursor.execute("SELECT " + columns + " FROM " + station + " WHERE Date_MJD >= %s AND Date_MJD < %s;", [start, stop])
+    return cursor.fetchall()
+
+def refreshAggregates(cursor, touched, unified=False):
+    # Recompute the aggregates of the given (station, month) groups from the station rows. Returns the number of
+    # aggregate rows written.
+    entries = []
+    stale = []
+    for station, month in sorted(touched):
+        by_type = {}
+        for row in monthRows(cursor, station, month, unified):
+            by_type.setdefault(row[0], []).append(row[1:])
+        stale.append([station, month])
+        for session_type, rows in by_type.items():
+            for i, (metric, placeholder) in enumerate(AGGREGATE_METRICS.items()):
+                stats = summarise([row[i] for row in rows], placeholder)
+                if stats != None:
+                    entries.append([station, month, session_type, metric] + stats)
+    if len(stale) > 0:
+        cursor.executemany("DELETE FROM monthly_aggregates WHERE station = %s AND month = %s;", stale)
+    if len(entries) > 0:
+        cursor.executemany("INSERT INTO monthly_aggregates (" + ", ".join(AGGREGATE_COLUMNS) + ") VALUES (" + ", ".join(['%s']*len(AGGREGATE_COLUMNS)) + ");", entries)
+    return len(entries)
+
+def rebuildAggregates(cursor, stations, unified=False):
+    # Recompute every month that has station rows, e.g. for a database that predates the aggregates table.
+    touched = set()
+    for station in stations:
+        station = str(station)
+        if unified:
+            cursor.execute("SELECT DISTINCT FLOOR(Date_MJD) FROM " + databaseSchema.UNIFIED_VIEW + " WHERE station = %s AND Date_MJD IS NOT NULL;", [station])
+        else:
+            cursor.execute("SELECT DISTINCT FLOOR(Date_MJD) FROM " + station + " WHERE Date_MJD IS NOT NULL;")
+        touched.update((station, mjdMonth(row[0])) for row in cursor.fetchall())
+    return refreshAggregates(cursor, touched, unified)
+
+def seedAggregates(cursor, stations, unified=False):
+    # Build the aggregates once if the table is empty.
+    cursor.execute("SELECT COUNT(*) FROM monthly_aggregates;")
+    if cursor.fetchone()[0] > 0:
+        return 0
+    return rebuildAggregates(cursor, stations, unified)
+
+def readAggregates(cursor, metric, month_start, month_stop, stations=None, session_type=None):
+    # Aggregate rows of one metric for months in [month_start, month_stop] ('YYYY-MM'), as dicts keyed by AGGREGATE_COLUMNS.
+    conditions = ["metric = %s", "month >= %s", "month <= %s"]
+    params = [metric, month_start, month_stop]
+    if stations != None:
+        conditions.append("station IN (" + ", ".join(['%s']*len(stations)) + ")")
+        params.extend(str(ant) for ant in stations)
+    if session_type != None:
+        conditions.append("Session_Type = %s")
+        params.append(session_type)
+    cursor.execute("SELECT " + ", ".join(AGGREGATE_COLUMNS) + " FROM monthly_aggregates WHERE " + " AND ".join(conditions) + " ORDER BY station, month;", params)
+    return [dict(zip(AGGREGATE_COLUMNS, row)) for row in cursor.fetchall()]
+
+def parseFunc():
+    # Argument parsing
+    parser = argparse.ArgumentParser(description="""Print a station by month table of the monthly median of a metric from the pre-computed aggregates, e.g. to
+                                        compare the network over the last year.""")
+    parser.add_argument('sql_db_name',
+                        help="""The name of the SQL database to read.""")
+    parser.add_argument('--metric', dest='metric', default='W_RMS_del', choices=list(AGGREGATE_METRICS),
+                        help="""Metric to tabulate (default W_RMS_del).""")
+    parser.add_argument('--start', dest='start', default=None,
+                        help="""First month (YYYY-MM), defaults to 11 months before the current month.""")
+    parser.add_argument('--stop', dest='stop', default=datetime.now().strftime('%Y-%m'),
+                        help="""Last month (YYYY-MM), defaults to the current month.""")
+    parser.add_argument('--session-type', dest='session_type', default=None, choices=['V', 'L'],
+                        help="""Only VGOS (V) or legacy (L) sessions, default both.""")
+    parser.add_argument('--rebuild', dest='rebuild', action='store_true', default=False,
+                        help="""Recompute all aggregates from the station tables first.""")
+    parser.add_argument('--unified-schema', dest='unified', action='store_true', default=False,
+                        help="""Read from the unified station_sessions table when rebuilding.""")
+    args = parser.parse_args()
+    return args
+
+def main(db_name, metric='W_RMS_del', start=None, stop=None, session_type=None, rebuild=False, unified=False):
+    import databaseCore
+    stationNames, stationNamesLong = databaseCore.stationParse(dirname + '/stations.config')
+    stop = stop or datetime.now().strftime('%Y-%m')
+    if start == None:
+        year, month = [int(x) for x in stop.split('-')]
+        start = datetime(year - (1 if month < 12 else 0), (month % 12) + 1, 1).strftime('%Y-%m')
+    with databaseAccess.connection(db_name) as conn:
+        cursor = conn.cursor()
+        if rebuild:
+            print("Rebuilt " + str(rebuildAggregates(cursor, stationNames, unified)) + " aggregate rows.")
+            conn.commit()
+        rows = readAggregates(cursor, metric, start, stop, stationNames, session_type)
+        cursor.close()
+    months = sorted(set(row['month'] for row in rows))
+    print('Monthly median ' + metric + (' (' + session_type + ')' if session_type else '') + ', number of sessions in brackets')
+    print('station ' + ' '.join(month.rjust(14) for month in months))
+    for station in stationNames:
+        cells = []
+        for month in months:
+            # both session types are shown as separate values when not filtered
+            values = [row for row in rows if row['station'] == str(station) and row['month'] == month]
+            cells.append(', '.join('%.3g (%d)' % (row['median'], row['n']) for row in values).rjust(14))
+        print(str(station).ljust(7) + ' ' + ' '.join(cells))
+
+if __name__ == '__main__':
+    args = parseFunc()
+    main(args.sql_db_name, args.metric, args.start, args.stop, args.session_type, args.rebuild, args.unified)
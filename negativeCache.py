@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+
+# Persistent record of files that were looked for on CDDIS and not found. Analysis reports, spoolfiles and vgosDB
+# tarballs usually appear days to weeks after a session, so rather than re-probing every missing file on every cron run
+# each (experiment, file kind) is re-checked on an exponential backoff, and given up on entirely once the session is
+# older than the retirement horizon.
+
+# Source other modules
+import atomicFile
+
+dirname = os.path.dirname(__file__)
+
+DEFAULT_CACHE_FILE = dirname + '/negative_cache.json'
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+class negativeCache(object):
+    def __init__(self, path=DEFAULT_CACHE_FILE, base_interval=timedelta(days=1), max_interval=timedelta(days=32), horizon=timedelta(days=365)):
+        self.path = path
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.horizon = horizon # sessions (or first misses, if the session date is unknown) older than this are retired
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.isfile(path):
+            with open(path) as file:
+                self._entries = json.load(file)
+
+    def _key(self, exp, kind):
+        return exp.lower() + ':' + kind
+
+    def due(self, exp, kind, now=None):
+        # True if the file has never been missed, or its backoff has expired and the session has not been retired.
+        now = now or datetime.utcnow()
+        with self._lock:
+            entry = self._entries.get(self._key(exp, kind))
+        if entry == None:
+            return True
+        if entry['retired']:
+            return False
+        return now >= datetime.strptime(entry['next_check'], TIME_FORMAT)
+
+    def recordMissing(self, exp, kind, session_date=None, now=None):
+        now = now or datetime.utcnow()
+        key = self._key(exp, kind)
+        with self._lock:
+            entry = self._entries.get(key, {'first_missing': now.strftime(TIME_FORMAT), 'attempts': 0})
+            entry['attempts'] += 1
+            interval = min(self.base_interval * 2**(entry['attempts'] - 1), self.max_interval)
+            entry['last_checked'] = now.strftime(TIME_FORMAT)
+            entry['next_check'] = (now + interval).strftime(TIME_FORMAT)
+            if session_date != None:
+                entry['session_date'] = session_date.strftime(TIME_FORMAT)
+            anchor = datetime.strptime(entry.get('session_date', entry['first_missing']), TIME_FORMAT)
+            entry['retired'] = now - anchor > self.horizon
+            self._entries[key] = entry
+
+    def recordFound(self, exp, kind):
+        with self._lock:
+            self._entries.pop(self._key(exp, kind), None)
+
+    def save(self):
+        with self._lock:
+            contents = json.dumps(self._entries, indent=1, sort_keys=True)
+        atomicFile.writeAtomic(self.path, lambda file: file.write(contents.encode()))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def getCache(horizon_days=None):
+    # Process-wide cache shared by the analysis report and corr report downloads.
+    global _cache
+    with _cache_lock:
+        if _cache == None:
+            _cache = negativeCache()
+        if horizon_days != None:
+            _cache.horizon = timedelta(days=horizon_days)
+        return _cache
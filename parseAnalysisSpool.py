@@ -3,13 +3,18 @@
 import re
 from datetime import datetime
 from astropy.time import Time
-import MySQLdb as mariadb
+import databaseAccess
 import sys
 import os
 import csv
 import argparse
 from astropy.table import vstack, Table
 from astropy.io import ascii
+import analysisReport
+import spoolFile
+import databaseCore
+import databaseSchema
+import databaseSnapshot
 
 dirname = os.path.dirname(__file__)
 
@@ -21,108 +26,53 @@ def parseFunc():
     parser.add_argument("--sql-db-name", dest='db_name', default=False, 
                         help="""If a database name is given, attempt to create entries in the SQL station tables with information extracted from this report. This requires the station tables to exist on the
                         SQL database (they are generated during the 'daily' script if they do not already exist)""")
+    parser.add_argument("--unified-schema", dest='unified', action="store_true", default=False,
+                        help="Write to the unified station_sessions/sessions tables instead of the per-station tables.")
+    parser.add_argument("--snapshot-dir", dest='snapshot_dir', default=databaseSnapshot.DEFAULT_SNAPSHOT_DIR,
+                        help="Parquet snapshot whose station/year partitions are refreshed after writing to the database, if it exists.")
+    parser.add_argument("--no-snapshot", dest='snapshot_dir', action='store_const', const=None,
+                        help="Don't refresh the Parquet snapshot.")
     args = parser.parse_args()
     return args
 
-def problemFinder(text_section, stations): # searches first section of text for a problem, creates two lists one with a boolean value, the other with at least 1 line of the string where a problem is mentioned
+def problemFinder(report, stations): # problem lines of the first section of the report mentioning each station, two lists one with a boolean value, the other with at least 1 line of the string where a problem is mentioned
     problem_bool = []
     problem_string = []
     for ant in stations:
-        regex = ant + '.*\n[\s]{11}.*|' + ant + '.*$'
-        problem = re.findall(regex,text_section,re.MULTILINE)
-        if len(problem) > 0:
-            problem_bool.append(True)
-            problem_string.append(problem[0].replace('\n', ""))
-        else:
-            problem_bool.append(False)
-            problem_string.append('')
+        problems = report['stations'].get(ant, {}).get('problems', [])
+        problem_bool.append(len(problems) > 0)
+        problem_string.append(problems[0] if len(problems) > 0 else '')
     return problem_bool, problem_string
-    
-def percent2decimal(percent_string):
-    return float(percent_string.strip('%'))/100
 
-def stationPerformance(text_section, stations): # Extracts the percentage of useable scans for each station.
-    station_performance = []
-    for ant in stations:
-        regex = ant + ".*"
-        performance = re.findall(regex,text_section,re.MULTILINE)
-        if len(performance) > 0:
-            percentage = [s for s in performance[0].split() if '%' in s]
-            if percentage[0] == 'nan%':
-                station_performance.append(None)
-            else:
-                performance = percent2decimal(percentage[0])
-                station_performance.append(performance)
-        else:
-            station_performance.append(None)
-    return station_performance
+def stationPerformance(report, stations): # Extracts the percentage of useable scans for each station.
+    return [report['stations'].get(ant, {}).get('performance') for ant in stations]
 
-def stationPerformanceUsedVsRecovered(text_section, station_names):
+def stationPerformanceUsedVsRecovered(report, station_names):
     usedVsRecoveredPerformance = []
     for ant in station_names:
-        regex = ant + ".*"
-        performance = re.findall(regex,text_section,re.MULTILINE)
-        if len(performance) > 0:
-            performance = [x for y in performance[0].split('  ') if (x := y.strip())]
-            try:
-                used_vs_recoverable = float(performance[3])/float(performance[2])
-                usedVsRecoveredPerformance.append(used_vs_recoverable)
-            except:
-                usedVsRecoveredPerformance.append(None)
-        else:
+        entry = report['stations'].get(ant, {})
+        try:
+            usedVsRecoveredPerformance.append(entry['used']/entry['recovered'])
+        except (KeyError, TypeError, ZeroDivisionError):
             usedVsRecoveredPerformance.append(None)
     return usedVsRecoveredPerformance
 
-def metaData(text_section, exp_code):
-    vgosDBtag = re.findall("(?<=\().{15}",text_section,re.MULTILINE)
-    if exp_code in vgosDBtag[0]:
-        date = re.findall("(?<=\().{8}",text_section,re.MULTILINE)
-        date = datetime.strptime(date[0], '%Y%m%d').strftime('%Y-%m-%d')
-    else:
-        vgosDBtag = re.findall("(?<=\$).{9}",text_section,re.MULTILINE)
-        date = re.findall("(?<=\$).{7}",text_section,re.MULTILINE)
-        date = datetime.strptime(date[0], '%y%b%d').strftime('%Y-%m-%d')
-    date_mjd = Time(date).mjd
-    exp_code = re.findall("(?<=Analysis Report for\s)(.*?(?=\s))",text_section,re.MULTILINE)
-    analyser = re.findall("\S.*(?=\sAnalysis Report for\s)",text_section,re.MULTILINE)
-    if len(analyser) == 0:
-        analyser = "-"
-    return exp_code[0], analyser[0], date, date_mjd, vgosDBtag[0]
+def metaData(report):
+    meta = report['meta']
+    return meta['exp_code'], meta['analyser'], meta['date'], meta['date_mjd'], meta['vgosdb']
 
-def sessionFit(text_section):
-    for line in text_section.split('\n'):
-        if 'Session fit:' in line:
-            session_fit = line.split()[2]
-    return session_fit
+def sessionFit(report):
+    return report['session_fit']
 
     
-def stationPositions(text_section, stations): # extracts station positons from the spoolfile
-    station_positions = []
-    for ant in stations:
-        regex_xyz = ant + ".*[XYZ]\sComp.*"
-        regex_uen = ant + ".*[UEN]\sComp.*"
-        positions_xyz = re.findall(regex_xyz,text_section,re.MULTILINE)
-        positions_xyz = [i.split()[5] for i in positions_xyz]
-        positions_uen = re.findall(regex_uen,text_section,re.MULTILINE)
-        positions_uen = [i.split()[4] for i in positions_uen]
-        positions = positions_xyz + positions_uen
-        station_positions.append(positions)
-    for i in range(0, len(station_positions)):
-        if station_positions[i] == []:
-            station_positions[i] = ['NULL','NULL','NULL','NULL','NULL','NULL'] # this is a gross hacky way to deal with when a station exists in an analyis report but not the spool file.
-    return station_positions
+def stationPositions(spool, stations): # station positons read from the spoolfile (see spoolFile.py), X/Y/Z/U/E/N per station
+    return [spool['positions'].get(str(ant), [None, None, None, None, None, None]) for ant in stations] # None when a station exists in an analyis report but not the spool file.
     
-def delayRMS(text_section, stations): # This function pulls the w.rms delay from the spool file
+def delayRMS(spool, stations): # the w.rms delay read from the spool file
     station_delays = []
     for ant in stations:
-        regex = "(?<=\n\s{5})" + ant + ".*"
-        delay = re.findall(regex,text_section,re.MULTILINE)
-        delay = [i.split()[3] for i in delay]
-        station_delays.append(delay)
-    for i in range(0, len(station_delays)):
-        if station_delays[i] == [] or station_delays[i][0] == '0.0':
-            station_delays[i] = '-999'
-    #print(station_delays)
+        delay = spool['delays'].get(str(ant))
+        station_delays.append('-999' if delay == None or delay == '0.0' else delay)
     return station_delays 
 
 def stationParse(stations_config='stations.config'):
@@ -137,53 +87,53 @@ def stationParse(stations_config='stations.config'):
         stationNamesLong = stationTable['full'][:]
     return stationNames, stationNamesLong
 
-def main(exp_code, sql_db_name=False):
+def main(exp_code, sql_db_name=False, unified=False, snapshot_dir=databaseSnapshot.DEFAULT_SNAPSHOT_DIR):
     stationNames, stationNamesLong = stationParse()
     print("Beginning analysis report and spoolfile ingest for experiment " + exp_code + ".")
     file_report = dirname + '/analysis_reports/' + str(exp_code) + '_report.txt'
     file_spool = dirname + '/analysis_reports/' + str(exp_code) + '_spoolfile.txt'
     sql_command = []
-    with open(file_report) as file:
-        contents_report = file.read()
-        sections = contents_report.split('-----------------------------------------')   
-    meta = metaData(sections[0], exp_code)
-    session_fit = sessionFit(sections[1])
-    performance = stationPerformance(sections[2], stationNamesLong)
-    performanceUsedVsRecovered = stationPerformanceUsedVsRecovered(sections[2], stationNamesLong)
-    #problems = problemFinder(sections[0], stationNamesLong)
+    report = analysisReport.readReport(file_report, exp_code)
+    meta = metaData(report)
+    session_fit = sessionFit(report)
+    performance = stationPerformance(report, stationNamesLong)
+    performanceUsedVsRecovered = stationPerformanceUsedVsRecovered(report, stationNamesLong)
+    #problems = problemFinder(report, stationNamesLong)
     # check if a spoolfile exists and extract data if so.
     if os.path.isfile(file_spool): 
-        with open(file_spool) as file:
-            contents_spool = file.read()
-        position = stationPositions(contents_spool, stationNamesLong)
-        delays = delayRMS(contents_spool, stationNamesLong)
+        spool = spoolFile.readSpoolfile(file_spool, [stationNamesLong[i] for i in range(0, len(stationNamesLong)) if performance[i] != None])
+        position = stationPositions(spool, stationNamesLong)
+        delays = delayRMS(spool, stationNamesLong)
     else: # fill with dummy data needed for CSV file - not sure if this is also necessary for SQL command
-        position = [['', '', '', '', '', ''],
-                    ['', '', '', '', '', ''],
-                    ['', '', '', '', '', ''],
-                    ['', '', '', '', '', '']]
-        delays = ['', '', '', '']
+        position = [['', '', '', '', '', ''] for ant in stationNamesLong]
+        delays = ['' for ant in stationNamesLong]
     # Output a data table
     data_table = Table(names=('station', 'Performance', 'Performance_UsedVsRecov', 'Date', 'Date_MJD', 'Pos_X', 'Pos_Y', 'Pos_Z', 'Pos_U', 'Pos_E', 'Pos_N', 'W_RMS_del', 'session_fit', 'Analyser', 'vgosDB_tag'), dtype=('str','float', 'float','str', 'float','str', 'str', 'str', 'str', 'str', 'str', 'str', 'str', 'str', 'str'))
     for i in range(0,len(stationNames)):
         if performance[i] != None:
             data_table.add_row([stationNames[i], performance[i], performanceUsedVsRecovered[i], meta[2], meta[3], position[i][0], position[i][1], position[i][2], position[i][3], position[i][4], position[i][5], delays[i], session_fit,  meta[1], meta[4]])        
     data_table.pprint_all()
-    # Now time to push extracted data to database  
+    # Now time to push extracted data to database, through the same upsert, monthly aggregates and ledger update as databaseCore.py.
+    # The corr report columns are left as they are, parseCorrSkd.py fills them in.
     if sql_db_name != False:
+        exp_id = meta[0].lower()
+        rows_by_station = {}
         for i in range(0, len(performance)):
             if performance[i] != None:
-                sql_station = "INSERT IGNORE INTO {} (ExpID, Performance, Performance_UsedVsRecov, Date, Date_MJD, Pos_X, Pos_Y, Pos_Z, Pos_U, Pos_E, Pos_N, W_RMS_del, session_fit, Analyser, vgosDB_tag) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);".format(stationNames[i])
-                data = [meta[0].lower(), performance[i], performanceUsedVsRecovered[i],meta[2], meta[3], position[i][0], position[i][1], position[i][2], position[i][3], position[i][4], position[i][5], delays[i], session_fit, meta[1], meta[4]]
-                conn = mariadb.connect(user='auscope', passwd='password', db=str(sql_db_name))
-                cursor = conn.cursor()
-                cursor.execute(sql_station, data)
-                conn.commit()
-                conn.close()
+                values = {'ExpID': exp_id, 'Performance': performance[i], 'Performance_UsedVsRecov': performanceUsedVsRecovered[i], 'Date': meta[2], 'Date_MJD': meta[3],
+                          'Pos_X': position[i][0], 'Pos_Y': position[i][1], 'Pos_Z': position[i][2], 'Pos_U': position[i][3], 'Pos_E': position[i][4], 'Pos_N': position[i][5],
+                          'W_RMS_del': delays[i], 'session_fit': session_fit, 'Analyser': meta[1], 'vgosDB_tag': meta[4]}
+                rows_by_station[str(stationNames[i])] = [[None if values.get(col) == '' else values.get(col) for col in databaseSchema.STATION_COLUMNS]]
+        ledger = [entry for entry in databaseCore.ledgerEntries(exp_id, 'parsed' if len(rows_by_station) > 0 else 'no_stations', len(rows_by_station)) if entry[1] in ['analysis', 'spoolfile']]
+        pending = {'rows': rows_by_station, 'sessions': {}, 'baselines': {}, 'ledger': ledger}
+        counts = {'affected': 0, 'rows': 0, 'touched': set()}
+        with databaseAccess.connection(sql_db_name) as conn:
+            databaseCore.flushStationRows(conn, pending, counts, unified)
+        databaseSnapshot.refreshSnapshot(sql_db_name, list(rows_by_station), unified, snapshot_dir, counts['touched'], create=False)
     return data_table
 
 if __name__ == '__main__':
     # parseAnalysisSpool.py executed as a script
     args = parseFunc()
-    main(args.session_name, sql_db_name=args.db_name)
+    main(args.session_name, sql_db_name=args.db_name, unified=args.unified, snapshot_dir=args.snapshot_dir)
 9
@@ -2,15 +2,17 @@
 
 import re
 import os
-import MySQLdb as mariadb
+import databaseAccess
 from astropy.io import ascii
 import numpy as np
-import estimateSEFD
-import scipy.optimize
-from astropy.table import vstack, Table
+import databaseSchema
+import databaseSnapshot
+import corrReport
+import monthlyAggregates
+import baselineQcodes
+from astropy.table import Table
 from astropy.time import Time
 import sys
-import csv
 import argparse
 from datetime import datetime
 
@@ -31,25 +33,17 @@ def parseFunc():
     parser.add_argument("--sql-db-name", dest='db_name', default=False, 
                         help="""If a database name is given, attempt to update the station tables with information extracted from this report. 
                         Note, this script only updates existing entries for a particular session, and therefore requires the analysis report ingest script to have been run prior.""")
+    parser.add_argument("--unified-schema", dest='unified', action="store_true", default=False,
+                        help="Update the unified station_sessions/sessions tables instead of the per-station tables.")
+    parser.add_argument("--snapshot-dir", dest='snapshot_dir', default=databaseSnapshot.DEFAULT_SNAPSHOT_DIR,
+                        help="Parquet snapshot whose station/year partitions are refreshed after writing to the database, if it exists.")
+    parser.add_argument("--no-snapshot", dest='snapshot_dir', action='store_const', const=None,
+                        help="Don't refresh the Parquet snapshot.")
     args = parser.parse_args()
     return args
 
 
 
-def extractRelevantSections(all_corr_sections, version):
-    if version == 3:
-        relevant_tags = ['STATION', 'DROP', 'MANUAL', 'SNR','NOTE', 'QCODES']
-    else:
-        relevant_tags = ['STATION', 'DROP', 'MANUAL', 'SNR']
-    relevant_sections = []
-    for tag in relevant_tags:
-        for section in all_corr_sections:
-            if tag in section[0:15]:
-                relevant_sections.append(section)
-    return relevant_sections
-    # This pulls the relevant sections out of the split corr report, it is required as sometimes corr reports have different 
-    # number of sections and can cause the script to fail. This allows you to know exactly which section is which.
-
 def noteFinder(text_section, stations): 
     note_bool = []
     note_string_list = []
@@ -236,29 +230,9 @@ def stationParse(stations_config='stations.config'):
         stationNamesLong = stationTable['full'][:]
     return stationNames, stationNamesLong
 
-def createStationQTables(section, corr_ref, band):
-    qcode_split = section.split('\n')
-    qcode_trimmed = []
-    for line in qcode_split:
-        if ':' in line.split(' ')[0]:
-            qcode_trimmed.append(line)
-    qcode_table_full = ascii.read(qcode_trimmed, header_start=0)
-    # Now time to sum all baseline pairs for each station
-    summed_qcode_table = []
-    for antenna in corr_ref:
-        mk4_id = antenna[1]
-        valid_baseline = []
-        for j in range(0,len(qcode_table_full['bl:band'])):
-            if mk4_id in qcode_table_full['bl:band'][j].split(':')[0]:
-                if band in qcode_table_full['bl:band'][j].split(':')[1]:
-                    valid_baseline.append(j)
-        baseline_sum_qcode = qcode_table_full[valid_baseline].groups.aggregate(np.sum)
-        try: 
-            baseline_sum_qcode.add_column(mk4_id, index=0, name='station')
-            summed_qcode_table = vstack([summed_qcode_table, baseline_sum_qcode])
-        except:
-            summed_qcode_table = summed_qcode_table
-    return summed_qcode_table
+def createStationQTables(section, corr_ref, band, qcode_table=None):
+    # qcodes summed over the baselines of each station in one band, see corrReport.stationQcodeSums
+    return corrReport.stationQcodeSums(section, corr_ref, band, qcode_table)
 
 def extractQcodeInfo(qcode_table):
     #not_corr = qcode_table['N'] + qcode_table['-']
@@ -277,7 +251,7 @@ def extractQcodeInfo(qcode_table):
         pass
     return qcode_table['station'], good/(good+bad), good/total, good+bad
     # this function returns the ammont of useable scans as a fraction against all correlated scans with no-issues, and against all scheduled scans
-    
+
 def corrMeta(contents):
     for line in contents.split('\n')[0:24]:
         if 'START' in line:
@@ -287,7 +261,7 @@ def corrMeta(contents):
             vgosdb_tag = line.split()[1]
     return Time(start_time), vgosdb_tag
 
-def main(exp_id, sql_db_name = False, sefd_est = False):
+def main(exp_id, sql_db_name = False, sefd_est = False, unified = False, snapshot_dir = databaseSnapshot.DEFAULT_SNAPSHOT_DIR):
     stationNames, stationNamesLong = stationParse()
     # Check if corr report is available.
     if os.path.isfile("corr_files/"+ exp_id + '.corr'):
@@ -297,33 +271,27 @@ def main(exp_id, sql_db_name = False, sefd_est = False):
         return
     with open('corr_files/'+ str(exp_id) + '.corr') as file:
         contents = file.read()
-        corr_section = contents.split('\n+')
-        if len(corr_section) < 3: # another ad-hoc addition for if corr-reports have a space before ever line in them (e.g. aov032)
-            corr_section = contents.split('\n +')
     start_date, vgos_tag_corr = corrMeta(contents)
-    # Check report version
-    if '%CORRELATOR_REPORT_FORMAT 3' in corr_section[0]:
-        report_version = 3
-    else:
-        report_version = 2
-    # Isolate the report sections relevant for this processing
-    relevant_section = extractRelevantSections(corr_section, report_version)
-    if len(relevant_section) < 4:
+    corr_report = corrReport.readCorrReport(contents)
+    report_version = corr_report['version']
+    if len(corrReport.missingSections(corr_report)) > 0:
         print("Incompatible correlator report format.")
+    stations_section = corrReport.section(corr_report, 'STATION', '')
+    qcode_section = corrReport.section(corr_report, 'QCODES', '')
     # Define the station IDs you care about extracting
     valid_stations = []
     # Report version specific loop to determine which of our 'valid' stations are in the report
     for j in range(0, len(stationNames)):
         if report_version == 3:
-            if "\n" + stationNames[j] in relevant_section[0]:
+            if "\n" + stationNames[j] in stations_section:
                 valid_stations.append(stationNames[j])
         else:
-            if stationNames[j] + "/" in relevant_section[0]:
+            if stationNames[j] + "/" in stations_section:
                 valid_stations.append(stationNames[j])
     # Extract strings for dropped channels and manual Pcal, along with a station/mk4 id reference list
-    dropped_channels = droppedChannels(relevant_section[1],stationNames)
-    manual_pcal = manualPcal(relevant_section[2],stationNames)
-    antennas_corr_reference = antennaReference_CORR(relevant_section[0],report_version)
+    dropped_channels = droppedChannels(corrReport.section(corr_report, 'DROP', ''),stationNames)
+    manual_pcal = manualPcal(corrReport.section(corr_report, 'MANUAL', ''),stationNames)
+    antennas_corr_reference = antennaReference_CORR(stations_section,report_version)
     if len(antennas_corr_reference) == 0:
         print("No stations defined in correlator report!")    
 #    # SEFD re-estimation - not well tested yet
@@ -334,9 +302,9 @@ def main(exp_id, sql_db_name = False, sefd_est = False):
 #                    skd_contents = file.read()
 #                antenna_reference = antennaReference_SKD(skd_contents)
 #                if report_version == 3:
-#                    snr_data, corrtab_X, corrtab_S = sefdTableExtractV3(relevant_section[3], antennas_corr_reference, antenna_reference)
+#                    snr_data, corrtab_X, corrtab_S = sefdTableExtractV3(corrReport.section(corr_report, 'SNR', ''), antennas_corr_reference, antenna_reference)
 #                else:
-#                    snr_data, corrtab_X, corrtab_S = sefdTableExtract(relevant_section[3], antennas_corr_reference, antenna_reference)
+#                    snr_data, corrtab_X, corrtab_S = sefdTableExtract(corrReport.section(corr_report, 'SNR', ''), antennas_corr_reference, antenna_reference)
 #                if len(snr_data) == 0: # this is if corr file exists, but no SNR table exists.
 #                    print("No SNR table exists!, skipping SEFD re-estimation.")
 #                else:
@@ -361,13 +329,14 @@ def main(exp_id, sql_db_name = False, sefd_est = False):
 #        S = [None, None, None, None]             
 #    stations_to_add = list(set(SEFD_tags).intersection(valid_stations))
     stations_to_add = np.array(valid_stations)
-    # Qcode table stats
-    if ':X' in relevant_section[5]:
-        summed_qcode_table = createStationQTables(relevant_section[5], antennas_corr_reference, 'X')
+    # Qcode table stats, the table is parsed once for both bands
+    qcode_table = corrReport.qcodeTable(qcode_section)
+    if ':X' in qcode_section:
+        summed_qcode_table = createStationQTables(qcode_section, antennas_corr_reference, 'X', qcode_table)
         stat_list_ref_X, good_vs_bad_X, good_vs_total_X, total_obs_X = extractQcodeInfo(summed_qcode_table)
         #stat_index = list(stat_list_ref).index[stat_mk4id]
-    if ':S' in relevant_section[5]:
-        summed_qcode_table = createStationQTables(relevant_section[5], antennas_corr_reference, 'S')
+    if ':S' in qcode_section:
+        summed_qcode_table = createStationQTables(qcode_section, antennas_corr_reference, 'S', qcode_table)
         stat_list_ref_S, good_vs_bad_S, good_vs_total_S, total_obs_S = extractQcodeInfo(summed_qcode_table)  
     q_code_data_X = []
     q_code_data_S = []
@@ -384,7 +353,7 @@ def main(exp_id, sql_db_name = False, sefd_est = False):
             q_code_data_S.append([round(good_vs_bad_S[stat_index],3), round(good_vs_total_S[stat_index],3), round(total_obs_S[stat_index],3)])
         except:
             q_code_data_S.append([None, None, None])
-    notes_bool, notes = noteFinder(corr_section[4], stationNames)
+    notes_bool, notes = noteFinder(corrReport.section(corr_report, 'NOTE', ' '), stationNames)
     # Return a data table
     data_table = Table(names=('station', 'Manual_Pcal', 'Dropped_channels', 'Total_Obs', 'Detect_Rate_X', 'Detect_Rate_S', 'Note?', 'Notes'), dtype=('str','bool','str', 'float64', 'float64', 'float64', 'bool', 'str'))
     for i in range(0,len(stations_to_add)):
@@ -393,17 +362,40 @@ def main(exp_id, sql_db_name = False, sefd_est = False):
     # add to database
     if sql_db_name != False:
         print('Adding relevant report contents to SQL database')
-        for i in range(0,len(stations_to_add)):
-            sql_station = """UPDATE {} SET Date=%s, Date_MJD=%s, vgosDB_tag=%s, Manual_Pcal=%s, Dropped_Chans=%s, Total_Obs=%s, Detect_Rate_X=%s, Detect_Rate_S=%s, Note_Bool=%s, Notes=%s WHERE ExpID=%s""".format(stations_to_add[i])
-            data = [start_date, start_date.mjd, vgos_tag_corr, manual_pcal[i], dropped_channels[i][:1499], q_code_data_X[i][2], q_code_data_X[i][0], q_code_data_S[i][0], notes_bool[i], notes[i], str(exp_id)]
-            conn = mariadb.connect(user='auscope', passwd='password', db=str(sql_db_name))
+        # Fetch the existing rows in one query, fill in the corr report fields and upsert the complete rows in one batch.
+        # Stations without an analysis report row are skipped, as before.
+        with databaseAccess.connection(sql_db_name) as conn:
             cursor = conn.cursor()
-            cursor.execute(sql_station, data)
+            existing = databaseSchema.fetchStationRows(cursor, str(exp_id), stations_to_add, unified)
+            rows_by_station = {}
+            for i in range(0,len(stations_to_add)):
+                station = str(stations_to_add[i])
+                if station not in existing:
+                    continue
+                corr_fields = {'Date': start_date.datetime, 'Date_MJD': start_date.mjd, 'vgosDB_tag': vgos_tag_corr, 'Manual_Pcal': manual_pcal[i],
+                               'Dropped_Chans': dropped_channels[i][:1499], 'Total_Obs': q_code_data_X[i][2], 'Detect_Rate_X': q_code_data_X[i][0],
+                               'Detect_Rate_S': q_code_data_S[i][0], 'Note_Bool': notes_bool[i], 'Notes': notes[i]}
+                row = list(existing[station])
+                for col, value in corr_fields.items():
+                    row[databaseSchema.STATION_COLUMNS.index(col)] = value
+                rows_by_station[station] = [row]
+            session_values = {str(exp_id): {'Network_Size': len(antennas_corr_reference),
+                                            'Scheduled_Obs': corrReport.scheduledObservations(qcode_section, 'X' if ':X' in qcode_section else 'S', qcode_table) if qcode_section != '' else None}}
+            # the correlator start time replaces the analysis report date
+            databaseSchema.upsertStationRows(cursor, rows_by_station, unified, session_values, databaseSchema.CORR_MERGE_RULES)
+            # the months of the rows before and after the update, in case the corr report moved the session date
+            months = monthlyAggregates.touchedMonths(rows_by_station) | monthlyAggregates.touchedMonths({station: [existing[station]] for station in rows_by_station})
+            monthlyAggregates.refreshAggregates(cursor, months, unified)
+            baselines = corrReport.baselineRows(qcode_table, corrReport.snrTable(corrReport.section(corr_report, 'SNR', ''), report_version), antennas_corr_reference, stationNames)
+            baselineQcodes.writeBaselines(cursor, {str(exp_id): (start_date.mjd, baselines)})
             conn.commit()
-            conn.close()
+            cursor.close()
+        # the partitions of the old and new dates, like the months above
+        touched = databaseSnapshot.touchedPartitions(rows_by_station) | databaseSnapshot.touchedPartitions({station: [existing[station]] for station in rows_by_station})
+        databaseSnapshot.refreshSnapshot(sql_db_name, list(rows_by_station), unified, snapshot_dir, touched, create=False)
     return data_table           
 
 if __name__ == '__main__':
     # parseCorrSkd.py executed as a script
     args = parseFunc()
-    main(args.session_name, sql_db_name=args.db_name, sefd_est=args.sefd)
+    main(args.session_name, sql_db_name=args.db_name, sefd_est=args.sefd, unified=args.unified, snapshot_dir=args.snapshot_dir)
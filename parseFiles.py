@@ -6,8 +6,10 @@ from astropy.time import Time
 import sys
 import os
 import argparse
-from astropy.table import vstack, Table
 from astropy.io import ascii
+import analysisReport
+import corrReport
+import spoolFile
 import numpy as np
 
 import warnings
@@ -16,6 +18,10 @@ if not sys.warnoptions:
 
 dirname = os.path.dirname(__file__)
 
+# Bump whenever a change to the parsing alters the values written to the database, databaseCore then re-ingests the
+# sessions parsed by an older version (see ingest_ledger in databaseSchema.py).
+PARSER_VERSION = 4 # 2 - network size and scheduled observations, 3 - correlator report notes, 4 - baseline qcodes
+
 def parseFunc():
     parser = argparse.ArgumentParser(description="""Extract useful information from the analysis report and spoolfile if available. \nThis version of the script is written in the context of wider database 
                                         program and is intended to process analysis reports and spoolfiles that have been downloaded into specific sub-directories.""")
@@ -24,105 +30,44 @@ def parseFunc():
     args = parser.parse_args()
     return args
 
-def problemFinder(text_section, stations): # searches first section of text for a problem, creates two lists one with a boolean value, the other with at least 1 line of the string where a problem is mentioned
+def problemFinder(report, stations): # problem lines of the first section of the report mentioning each station, two lists one with a boolean value, the other with at least 1 line of the string where a problem is mentioned
     problem_bool = []
     problem_string = []
     for ant in stations:
-        regex = ant + '.*\n[\s]{11}.*|' + ant + '.*$'
-        problem = re.findall(regex,text_section,re.MULTILINE)
-        if len(problem) > 0:
-            problem_bool.append(True)
-            problem_string.append(problem[0].replace('\n', ""))
-        else:
-            problem_bool.append(False)
-            problem_string.append('')
+        problems = report['stations'].get(ant, {}).get('problems', [])
+        problem_bool.append(len(problems) > 0)
+        problem_string.append(problems[0] if len(problems) > 0 else '')
     return problem_bool, problem_string
-    
-def percent2decimal(percent_string):
-    return float(percent_string.strip('%'))/100
 
-def stationPerformance(text_section, stations): # Extracts the percentage of useable scans for each station.
-    station_performance = []
-    for ant in stations:
-        regex = ant + ".*"
-        performance = re.findall(regex,text_section,re.MULTILINE)
-        if len(performance) > 0:
-            percentage = [s for s in performance[0].split() if '%' in s]
-            if percentage[0] == 'nan%':
-                station_performance.append(None)
-            else:
-                performance = percent2decimal(percentage[0])
-                station_performance.append(performance)
-        else:
-            station_performance.append(None)
-    return station_performance
+def stationPerformance(report, stations): # Extracts the percentage of useable scans for each station.
+    return [report['stations'].get(ant, {}).get('performance') for ant in stations]
 
-def stationPerformanceUsedVsRecovered(text_section, station_names):
+def stationPerformanceUsedVsRecovered(report, station_names):
     usedVsRecoveredPerformance = []
     for ant in station_names:
-        regex = ant + ".*"
-        performance = re.findall(regex,text_section,re.MULTILINE)
-        if len(performance) > 0:
-            performance = [x for y in performance[0].split('  ') if (x := y.strip())]
-            try:
-                used_vs_recoverable = float(performance[3])/float(performance[2])
-                usedVsRecoveredPerformance.append(used_vs_recoverable)
-            except:
-                usedVsRecoveredPerformance.append(None)
-        else:
+        entry = report['stations'].get(ant, {})
+        try:
+            usedVsRecoveredPerformance.append(entry['used']/entry['recovered'])
+        except (KeyError, TypeError, ZeroDivisionError):
             usedVsRecoveredPerformance.append(None)
     return usedVsRecoveredPerformance
 
-def metaData(text_section, exp_code):
-    vgosDBtag = re.findall("(?<=\().{15}",text_section,re.MULTILINE)
-    if exp_code in vgosDBtag[0]:
-        date = re.findall("(?<=\().{8}",text_section,re.MULTILINE)
-        date = datetime.strptime(date[0], '%Y%m%d').strftime('%Y-%m-%d')
-    else:
-        vgosDBtag = re.findall("(?<=\$).{9}",text_section,re.MULTILINE)
-        date = re.findall("(?<=\$).{7}",text_section,re.MULTILINE)
-        date = datetime.strptime(date[0], '%y%b%d').strftime('%Y-%m-%d')
-    date_mjd = Time(date).mjd
-    exp_code = re.findall("(?<=Analysis Report for\s)(.*?(?=\s))",text_section,re.MULTILINE)
-    analyser = re.findall("\S.*(?=\sAnalysis Report for\s)",text_section,re.MULTILINE)
-    if len(analyser) == 0:
-        analyser = "-"
-    return exp_code[0], analyser[0], date, date_mjd, vgosDBtag[0].strip(')')
+def metaData(report):
+    meta = report['meta']
+    return meta['exp_code'], meta['analyser'], meta['date'], meta['date_mjd'], meta['vgosdb'].strip(')')
 
-def sessionFit(text_section):
-    for line in text_section.split('\n'):
-        if 'Session fit:' in line:
-            session_fit = line.split()[2]
-    return session_fit
+def sessionFit(report):
+    return report['session_fit']
 
     
-def stationPositions(text_section, stations): # extracts station positons from the spoolfile
-    station_positions = []
-    for ant in stations:
-        regex_xyz = ant + ".*[XYZ]\sComp.*"
-        regex_uen = ant + ".*[UEN]\sComp.*"
-        positions_xyz = re.findall(regex_xyz,text_section,re.MULTILINE)
-        positions_xyz = [i.split()[5] for i in positions_xyz]
-        positions_uen = re.findall(regex_uen,text_section,re.MULTILINE)
-        positions_uen = [i.split()[4] for i in positions_uen]
-        positions = positions_xyz + positions_uen
-        station_positions.append(positions)
-    for i in range(0, len(station_positions)):
-        if station_positions[i] == []:
-            station_positions[i] = ['NULL','NULL','NULL','NULL','NULL','NULL'] # this is a gross hacky way to deal with when a station exists in an analyis report but not the spool file.
-    return station_positions
+def stationPositions(spool, stations): # station positons read from the spoolfile (see spoolFile.py), X/Y/Z/U/E/N per station
+    return [spool['positions'].get(str(ant), [None, None, None, None, None, None]) for ant in stations] # None when a station exists in an analyis report but not the spool file.
     
-def delayRMS(text_section, stations): # This function pulls the w.rms delay from the spool file
+def delayRMS(spool, stations): # the w.rms delay read from the spool file
     station_delays = []
     for ant in stations:
-        regex = "(?<=\n\s{5})" + ant + ".*"
-        delay = re.findall(regex,text_section,re.MULTILINE)
-        delay = [i.split()[3] for i in delay]
-        station_delays.append(delay)
-    for i in range(0, len(station_delays)):
-        if station_delays[i] == [] or station_delays[i][0] == '0.0':
-            station_delays[i] = '-999'
-    #print(station_delays)
+        delay = spool['delays'].get(str(ant))
+        station_delays.append('-999' if delay == None or delay == '0.0' else delay)
     return station_delays 
 
 def stationParse(stations_config=dirname + '/stations.config'):
@@ -137,20 +82,6 @@ def stationParse(stations_config=dirname + '/stations.config'):
         stationNamesLong = stationTable['full'][:]
     return stationNames, stationNamesLong
 
-def extractRelevantSections(all_corr_sections, version):
-    if version == 3:
-        relevant_tags = ['STATION', 'DROP', 'MANUAL', 'SNR','NOTE', 'QCODES']
-    else:
-        relevant_tags = ['STATION', 'DROP', 'MANUAL', 'SNR']
-    relevant_sections = []
-    for tag in relevant_tags:
-        for section in all_corr_sections:
-            if tag in section[0:15]:
-                relevant_sections.append(section)
-    return relevant_sections
-    # This pulls the relevant sections out of the split corr report, it is required as sometimes corr reports have different 
-    # number of sections and can cause the script to fail. This allows you to know exactly which section is which.
-
 def noteFinder(text_section, stations): 
     note_bool = []
     note_string_list = []
@@ -254,29 +185,9 @@ def stationParse(stations_config=dirname + '/stations.config'):
         stationNamesLong = stationTable['full'][:]
     return stationNames, stationNamesLong
 
-def createStationQTables(section, corr_ref, band):
-    qcode_split = section.split('\n')
-    qcode_trimmed = []
-    for line in qcode_split:
-        if ':' in line.split(' ')[0]:
-            qcode_trimmed.append(line)
-    qcode_table_full = ascii.read(qcode_trimmed, header_start=0)
-    # Now time to sum all baseline pairs for each station
-    summed_qcode_table = []
-    for antenna in corr_ref:
-        mk4_id = antenna[1]
-        valid_baseline = []
-        for j in range(0,len(qcode_table_full['bl:band'])):
-            if mk4_id in qcode_table_full['bl:band'][j].split(':')[0]:
-                if band in qcode_table_full['bl:band'][j].split(':')[1]:
-                    valid_baseline.append(j)
-        baseline_sum_qcode = qcode_table_full[valid_baseline].groups.aggregate(np.sum)
-        try: 
-            baseline_sum_qcode.add_column(mk4_id, index=0, name='station')
-            summed_qcode_table = vstack([summed_qcode_table, baseline_sum_qcode])
-        except:
-            summed_qcode_table = summed_qcode_table
-    return summed_qcode_table
+def createStationQTables(section, corr_ref, band, qcode_table=None):
+    # qcodes summed over the baselines of each station in one band, see corrReport.stationQcodeSums
+    return corrReport.stationQcodeSums(section, corr_ref, band, qcode_table)
 
 def extractQcodeInfo(qcode_table):
     #not_corr = qcode_table['N'] + qcode_table['-']
@@ -295,7 +206,7 @@ def extractQcodeInfo(qcode_table):
         pass
     return qcode_table['station'], good/(good+bad), good/total, good+bad
     # this function returns the ammont of useable scans as a fraction against all correlated scans with no-issues, and against all scheduled scans
-    
+
 def corrMeta(contents):
     for line in contents.split('\n')[0:24]:
         if 'START' in line:
@@ -325,6 +236,10 @@ class stationData(object):
         self.wrms_del = []
         self.sess_fit = []
         self.analyser = []
+        # extracted from corr/skd, the same for every station of the session
+        self.network_size = []
+        self.scheduled_obs = []
+        self.baselines = [] # corrReport.baselineRows of the baselines with a configured station
         # extracted from corr/skd
         self.man_pcal = []
         self.dropped_chans = []
@@ -344,70 +259,55 @@ def main(exp_code):
 
     # Read in analysis report
     if os.path.isfile(file_spool): 
-        with open(file_analysis) as file:
-            contents_report = file.read()
-            sections = contents_report.split('-----------------------------------------')   
-        meta = metaData(sections[0], exp_code)
-        session_fit = sessionFit(sections[1])
-        performance = stationPerformance(sections[2], stationNamesLong)
-        performanceUsedVsRecovered = stationPerformanceUsedVsRecovered(sections[2], stationNamesLong)
+        report = analysisReport.readReport(file_analysis, exp_code)
+        meta = metaData(report)
+        session_fit = sessionFit(report)
+        performance = stationPerformance(report, stationNamesLong)
+        performanceUsedVsRecovered = stationPerformanceUsedVsRecovered(report, stationNamesLong)
     else:
         print("No analysis file available.")
         return
     
     # Read in spool file
     if os.path.isfile(file_spool): 
-        with open(file_spool) as file:
-            contents_spool = file.read()
-        position = stationPositions(contents_spool, stationNamesLong)
-        delays = delayRMS(contents_spool, stationNamesLong)
+        # only the stations in the analysis report are looked for, reading stops once they are all found
+        spool = spoolFile.readSpoolfile(file_spool, [stationNamesLong[i] for i in range(0, len(stationNamesLong)) if performance[i] != None])
+        position = stationPositions(spool, stationNamesLong)
+        delays = delayRMS(spool, stationNamesLong)
     else:
         print("No spool file available.") 
+        position = [[None, None, None, None, None, None] for ant in stationNamesLong]
+        delays = [None for ant in stationNamesLong]
 
     # Read in corr file
     start_date = None
     if os.path.isfile(file_corr):
         with open(file_corr) as file:
             contents = file.read()
-            corr_section = contents.split('\n+')
-        if len(corr_section) < 3: # another ad-hoc addition for if corr-reports have a space before ever line in them (e.g. aov032)
-            corr_section = contents.split('\n +')
         start_date, vgos_tag_corr = corrMeta(contents)
-        if '%CORRELATOR_REPORT_FORMAT 3' in corr_section[0]:
-            report_version = 3
-        else:
-            report_version = 2
-        # Isolate the report sections relevant for this processing
-        relevant_section = extractRelevantSections(corr_section, report_version)
-        if len(relevant_section) < 4:
+        corr_report = corrReport.readCorrReport(contents)
+        report_version = corr_report['version']
+        if len(corrReport.missingSections(corr_report)) > 0:
             print("Incompatible correlator report format.")
-        # Determine what section contains what info - sometimes variable...
-        for i in range(0, len(relevant_section)):
-            if 'QCODES' in relevant_section[i].split()[0]:
-                qcode_section = relevant_section[i]
-            if 'STATIONS' in relevant_section[i].split()[0]:
-                stations_section = relevant_section[i]
-            if 'DROP_CHANNELS' in relevant_section[i].split()[0]:
-                dropchans_section = relevant_section[i]
-            if 'MANUAL_PCAL' in relevant_section[i].split()[0]:
-                mpcal_section = relevant_section[i]
-            if 'NOTES' in relevant_section[i].split()[0]:
-                notes_section = relevant_section[i]            
-            else:
-                notes_section = ' '
+        qcode_section = corrReport.section(corr_report, 'QCODES', '')
+        stations_section = corrReport.section(corr_report, 'STATION', '')
+        dropchans_section = corrReport.section(corr_report, 'DROP', '')
+        mpcal_section = corrReport.section(corr_report, 'MANUAL', '')
+        notes_section = corrReport.section(corr_report, 'NOTE', ' ')
         dropped_channels = droppedChannels(dropchans_section,stationNames)
         manual_pcal = manualPcal(mpcal_section,stationNames)
         antennas_corr_reference = antennaReference_CORR(stations_section,report_version)
         if len(antennas_corr_reference) == 0:
             print("No stations defined in correlator report!")   
 
-        # Qcode table stats
+        # Qcode table stats, the table is parsed once for both bands
+        qcode_table = corrReport.qcodeTable(qcode_section)
         if ':X' in qcode_section:
-            summed_qcode_table = createStationQTables(qcode_section, antennas_corr_reference, 'X')
+            summed_qcode_table = createStationQTables(qcode_section, antennas_corr_reference, 'X', qcode_table)
             stat_list_ref_X, good_vs_bad_X, good_vs_total_X, total_obs_X = extractQcodeInfo(summed_qcode_table)
             #stat_index = list(stat_list_ref).index[stat_mk4id]
         if ':S' in qcode_section:
-            summed_qcode_table = createStationQTables(qcode_section, antennas_corr_reference, 'S')
+            summed_qcode_table = createStationQTables(qcode_section, antennas_corr_reference, 'S', qcode_table)
             stat_list_ref_S, good_vs_bad_S, good_vs_total_S, total_obs_S = extractQcodeInfo(summed_qcode_table)  
         q_code_data_X = []
         q_code_data_S = []
@@ -425,6 +325,10 @@ def main(exp_code):
             except:
                 q_code_data_S.append([None, None, None])
         notes_bool, notes = noteFinder(notes_section, stationNames)
+        network_size = len(antennas_corr_reference)
+        scheduled_obs = corrReport.scheduledObservations(qcode_section, 'X' if ':X' in qcode_section else 'S', qcode_table) if qcode_section != '' else None
+        # per baseline qcodes from the same table, with the SNR ratios where the report has them
+        baselines = corrReport.baselineRows(qcode_table, corrReport.snrTable(corrReport.section(corr_report, 'SNR', ''), report_version), antennas_corr_reference, stationNames)
     else:
         print("No correlator report available.") 
 
@@ -450,6 +354,9 @@ def main(exp_code):
                 station.wrms_del = delays[i]
                 station.sess_fit = session_fit
             if start_date != None:
+                station.network_size = network_size
+                station.scheduled_obs = scheduled_obs
+                station.baselines = baselines
                 station.man_pcal = manual_pcal[i]
                 station.dropped_chans = dropped_channels[i]
                 station.total_obs = q_code_data_X[i][2]
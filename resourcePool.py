@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import threading
+import time
+
+# Generic thread-safe pool of long-lived connections, shared by ftpSessionPool (CDDIS FTP sessions) and databaseAccess
+# (database connections). At most max_size are open at once, idle ones are handed out again and checked with _alive
+# before reuse once they have sat idle for longer than keepalive seconds. Subclasses provide _connect, _alive and _discard
+# (and _close for a graceful close in closeAll, _discard by default).
+
+class resourcePool(object):
+    def __init__(self, max_size, keepalive=60):
+        self.max_size = max_size
+        self.keepalive = keepalive
+        self._idle = [] # list of [resource, time_released]
+        self._open = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _alive(self, resource):
+        return True
+
+    def _discard(self, resource):
+        try:
+            resource.close()
+        except Exception:
+            pass
+
+    def _close(self, resource):
+        self._discard(resource)
+
+    def acquire(self):
+        # Hand out an idle resource if there is one, open a new one if under the limit, otherwise wait for a release.
+        with self._cond:
+            while True:
+                if self._idle:
+                    resource, released = self._idle.pop()
+                    break
+                if self._open < self.max_size:
+                    self._open += 1
+                    resource, released = None, None
+                    break
+                self._cond.wait()
+        if resource is not None and time.time() - released > self.keepalive and not self._alive(resource):
+            self._discard(resource)
+            resource = None
+        if resource is None:
+            try:
+                resource = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+        return resource
+
+    def release(self, resource, broken=False):
+        with self._cond:
+            if broken or self._closed:
+                self._discard(resource)
+                self._open -= 1
+            else:
+                self._idle.append([resource, time.time()])
+            self._cond.notify()
+
+    def resize(self, max_size):
+        # Raise the limit, waiting acquirers are woken up.
+        with self._cond:
+            if max_size > self.max_size:
+                self.max_size = max_size
+                self._cond.notify_all()
+
+    def closeAll(self):
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for resource, released in idle:
+            self._close(resource)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+# Line streaming reader for the Solve spoolfiles, the largest of the downloaded files. Only two kinds of lines are used:
+#   station positions - '<station> ... X Comp ...' with the X/Y/Z value 5 words after the station name, U/E/N 4 words after
+#   W.RMS delays      - lines indented by exactly 5 spaces starting with the station name, the delay 3 words after it
+# The file is read a line at a time (memory does not grow with the spoolfile) and reading stops as soon as every
+# requested station has all six position components and a delay. The first value found for each wins.
+
+COMPONENTS = ['X', 'Y', 'Z', 'U', 'E', 'N']
+VALUE_OFFSET = {'X': 5, 'Y': 5, 'Z': 5, 'U': 4, 'E': 4, 'N': 4} # words after the station name
+DELAY_INDENT = 5
+DELAY_OFFSET = 3
+
+def positionLine(words, wanted):
+    # (station, component, value) of a position line, None for any other line
+    if 'Comp' not in words:
+        return None
+    comp_index = words.index('Comp')
+    component = words[comp_index - 1] if comp_index > 0 else None
+    if component not in VALUE_OFFSET:
+        return None
+    for i, word in enumerate(words[:comp_index]):
+        if word in wanted:
+            value_index = i + VALUE_OFFSET[component]
+            return (word, component, words[value_index]) if value_index < len(words) else None
+    return None
+
+def delayLine(line, wanted):
+    # (station, delay) of a W.RMS line, None for any other line
+    if len(line) <= DELAY_INDENT or not line[:DELAY_INDENT].isspace() or line[DELAY_INDENT].isspace():
+        return None
+    words = line[DELAY_INDENT:].split()
+    if words[0] not in wanted or len(words) <= DELAY_OFFSET:
+        return None
+    return words[0], words[DELAY_OFFSET]
+
+def readSpoolfile(filename, stations):
+    # stations - long station names to extract. Returns {'positions': {station: [X, Y, Z, U, E, N]}, 'delays': {station: delay}}
+    # with the values as strings and None for components that were not found.
+    wanted = set(str(ant) for ant in stations)
+    positions = {}
+    delays = {}
+    remaining = len(wanted)*(len(COMPONENTS) + 1) # values still to find
+    with open(filename, errors='replace') as file:
+        for line in file:
+            if remaining == 0:
+                break
+            delay = delayLine(line, wanted)
+            if delay != None and delay[0] not in delays:
+                delays[delay[0]] = delay[1]
+                remaining -= 1
+            position = positionLine(line.split(), wanted)
+            if position != None:
+                station = positions.setdefault(position[0], {})
+                if position[1] not in station:
+                    station[position[1]] = position[2]
+                    remaining -= 1
+    return {'positions': {ant: [components.get(comp) for comp in COMPONENTS] for ant, components in positions.items()}, 'delays': delays}
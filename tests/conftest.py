@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+# The modules live in the repository root, not in a package.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import databaseAccess
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    # URL of an empty SQLite database, its pooled connections are closed afterwards.
+    yield 'sqlite:///' + str(tmp_path / 'testDB.sqlite')
+    databaseAccess.closePools()
+
+@pytest.fixture
+def cursor(sqlite_db):
+    with databaseAccess.connection(sqlite_db) as conn:
+        cursor = conn.cursor()
+        yield cursor
+        cursor.close()
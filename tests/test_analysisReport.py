@@ -0,0 +1,29 @@
+import analysisReport
+
+SEPARATOR = analysisReport.SECTION_SEPARATOR
+REPORT = """NASA Analysis Report for R41001 (20240102-r41001)
+
+Problems:
+ Station HOBART12: lost 3 scans to a warm receiver,
+           recovered after the second day.
+ KATH12M, WETTZELL had no pcal.
+""" + SEPARATOR + """
+ Session fit: 25.1 ps
+""" + SEPARATOR + """
+ Station    Performance  Recovered  Used
+ HOBART12   95.0%        120        110
+ KATH12M    88.0%        100        90
+"""
+
+def test_problem_lines_with_punctuation():
+    report = analysisReport.tokenizeReport(REPORT, 'r41001')
+    assert report['stations']['HOBART12']['problems'] == ['HOBART12: lost 3 scans to a warm receiver,           recovered after the second day.']
+    assert report['stations']['KATH12M']['problems'] == ['KATH12M, WETTZELL had no pcal.']
+    assert report['stations']['WETTZELL']['problems'] == ['WETTZELL had no pcal.']
+
+def test_performance_rows():
+    report = analysisReport.tokenizeReport(REPORT, 'r41001')
+    assert report['session_fit'] == '25.1'
+    assert report['stations']['HOBART12']['performance'] == 0.95
+    assert report['stations']['KATH12M']['used'] == 90.0
+    assert report['meta']['exp_code'] == 'R41001'
@@ -0,0 +1,36 @@
+import corrReport
+
+REPORT = """%CORRELATOR_REPORT_FORMAT 3
++STATIONS
+Hb HOBART12 L
+Ke KATH12M  K
+Wz WETTZELL W
++QCODES
+bl:band 0 1 2 3 4 5 6 7 8 9 A B C D E F G H N - total
+LK:X    0 0 0 0 1 0 0 0 2 40 0 0 0 0 0 0 0 0 0 3 46
+LK:S    0 0 0 0 0 0 0 0 1 30 0 0 0 0 0 0 0 2 0 0 33
+KW:X    0 0 0 0 0 0 0 0 0 12 0 0 0 0 0 0 0 0 0 0 12
++SNR_RATIOS_MEAN
+ bl   S      n_S    X     n_X
+KL   1.02   30     0.95   40
++DROP_CHANNELS
++MANUAL_PCAL
++END
+"""
+CORR_REF = [['Hb', 'L'], ['Ke', 'K'], ['Wz', 'W']]
+
+def test_baseline_rows():
+    report = corrReport.readCorrReport(REPORT)
+    table = corrReport.qcodeTable(corrReport.section(report, 'QCODES'))
+    snr = corrReport.snrTable(corrReport.section(report, 'SNR', ''), report['version'])
+    rows = corrReport.baselineRows(table, snr, CORR_REF, ['Hb'])
+    assert rows == [['Hb', 'Ke', 'X', 42, 1, 46, '0,0,0,0,1,0,0,0,2,40,0,0,0,0,0,0,0,0,0,3', 0.95, 40],
+                    ['Hb', 'Ke', 'S', 31, 2, 33, '0,0,0,0,0,0,0,0,1,30,0,0,0,0,0,0,0,2,0,0', 1.02, 30]]
+
+def test_empty_qcodes_section():
+    report = corrReport.readCorrReport(REPORT.replace(REPORT[REPORT.index('bl:band'):REPORT.index('+SNR')], ''))
+    section = corrReport.section(report, 'QCODES')
+    table = corrReport.qcodeTable(section)
+    assert corrReport.baselineRows(table, {}, CORR_REF, ['Hb']) == []
+    assert len(corrReport.stationQcodeSums(section, CORR_REF, 'X', table)['station']) == 0
+    assert corrReport.scheduledObservations(section, 'X', table) == None
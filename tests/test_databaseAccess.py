@@ -0,0 +1,40 @@
+import databaseAccess
+import databaseSchema
+
+STATIONS = ['Hb', 'Ke']
+
+def test_translate_placeholders():
+    assert databaseAccess.translateSQL("SELECT ExpID FROM Hb WHERE ExpID = %s AND Notes LIKE '%%x';") == "SELECT ExpID FROM Hb WHERE ExpID = ? AND Notes LIKE '%x';"
+
+def test_translate_insert_ignore():
+    assert databaseAccess.translateSQL("INSERT IGNORE INTO Hb (ExpID) VALUES (%s);") == "INSERT OR IGNORE INTO Hb (ExpID) VALUES (?);"
+
+def test_translate_upsert():
+    query = "INSERT INTO sessions (ExpID, Date) VALUES (%s, %s) ON DUPLICATE KEY UPDATE Date=COALESCE(VALUES(Date), Date);"
+    assert databaseAccess.translateSQL(query) == "INSERT INTO sessions (ExpID, Date) VALUES (?, ?) ON CONFLICT DO UPDATE SET Date=COALESCE(excluded.Date, Date);"
+
+def test_station_tables(cursor):
+    assert databaseAccess.dialect(cursor) == 'sqlite'
+    databaseSchema.createStationTables(cursor, STATIONS)
+    for ant in STATIONS:
+        assert sorted(databaseSchema.tableColumns(cursor, ant)) == sorted(databaseSchema.STATION_COLUMNS + ['Session_Type'])
+    assert databaseSchema.tableColumns(cursor, 'sessions') == databaseSchema.SESSION_COLUMNS + ['Session_Type']
+    assert databaseSchema.tableColumns(cursor, 'ingest_ledger') == databaseSchema.LEDGER_COLUMNS + ['updated']
+    # a second run against existing tables is a no-op
+    databaseSchema.createStationTables(cursor, STATIONS)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'Hb_type_date';")
+    assert cursor.fetchall() == [('Hb_type_date',)]
+
+def test_unified_tables(cursor):
+    databaseSchema.createStationTables(cursor, STATIONS, unified=True)
+    assert sorted(databaseSchema.tableColumns(cursor, 'station_sessions')) == sorted(['station'] + databaseSchema.UNIFIED_STATION_COLUMNS)
+    assert databaseSchema.tableColumns(cursor, databaseSchema.UNIFIED_VIEW) == ['station'] + databaseSchema.STATION_COLUMNS + ['Session_Type']
+
+def test_ledger(cursor):
+    databaseSchema.createStationTables(cursor, STATIONS)
+    entry = ['r41000', 'analysis', None, 1200, 'a'*40, 'parsed', 4, 2]
+    databaseSchema.recordIngest(cursor, [entry])
+    databaseSchema.recordIngest(cursor, [entry[:5] + ['failed', 4, 0]])
+    cursor.execute("SELECT " + ", ".join(databaseSchema.LEDGER_COLUMNS) + " FROM ingest_ledger;")
+    assert cursor.fetchall() == [('r41000', 'analysis', None, 1200, 'a'*40, 'failed', 4, 0)]
+    assert databaseSchema.ledgerState(cursor) == {'r41000': 4}
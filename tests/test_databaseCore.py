@@ -0,0 +1,64 @@
+import pytest
+
+import baselineQcodes
+import databaseAccess
+import databaseCore
+import databaseSchema
+import monthlyAggregates
+
+@pytest.fixture
+def conn(sqlite_db):
+    with databaseAccess.connection(sqlite_db) as conn:
+        cursor = conn.cursor()
+        databaseSchema.createStationTables(cursor, ['Hb', 'Ke'])
+        monthlyAggregates.createAggregatesTable(cursor)
+        baselineQcodes.createBaselineTable(cursor)
+        conn.commit()
+        cursor.close()
+        yield conn
+
+def stationRow(exp_id, performance, date_mjd):
+    values = {'Performance': performance, 'Date_MJD': date_mjd, 'Analyser': 'GSFC', 'W_RMS_del': 20.0}
+    return [exp_id] + [values.get(col) for col in databaseSchema.STATION_COLUMNS[1:]]
+
+def ledgerEntry(exp_id, status='parsed', rows_written=1):
+    return [exp_id, 'analysis', None, 100, 'a'*40, status, 4, rows_written]
+
+def newCounts():
+    return {'experiments': 0, 'rows': 0, 'affected': 0, 'reparsed': 0, 'touched': set()}
+
+def query(conn, sql):
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+def test_flush_batch(conn):
+    pending = {'rows': {'Hb': [stationRow('r41000', 0.9, 60311.7), stationRow('r41001', 0.8, 60315.7)], 'Ke': [stationRow('r41000', 0.7, 60311.7)]},
+               'sessions': {'r41000': {'Network_Size': 5}}, 'baselines': {}, 'ledger': [ledgerEntry('r41000', rows_written=2), ledgerEntry('r41001')]}
+    counts = newCounts()
+    databaseCore.flushStationRows(conn, pending, counts)
+    assert pending == {'rows': {}, 'sessions': {}, 'baselines': {}, 'ledger': []}
+    assert counts['rows'] == 3
+    assert counts['touched'] == {('Hb', 2024), ('Ke', 2024)}
+    assert query(conn, "SELECT ExpID FROM Hb ORDER BY ExpID;") == [('r41000',), ('r41001',)]
+    assert query(conn, "SELECT ExpID, Network_Size FROM sessions ORDER BY ExpID;") == [('r41000', 5), ('r41001', None)]
+    assert query(conn, "SELECT ExpID, status, rows_written FROM ingest_ledger ORDER BY ExpID;") == [('r41000', 'parsed', 2), ('r41001', 'parsed', 1)]
+    assert query(conn, "SELECT DISTINCT station, month FROM monthly_aggregates ORDER BY station;") == [('Hb', '2024-01'), ('Ke', '2024-01')]
+
+def test_flush_retries_per_experiment(conn):
+    # r41001 breaks the NOT NULL constraint on Performance, the batch is retried experiment by experiment
+    pending = {'rows': {'Hb': [stationRow('r41000', 0.9, 60311.7), stationRow('r41001', None, 60315.7)]},
+               'sessions': {}, 'baselines': {}, 'ledger': [ledgerEntry('r41000'), ledgerEntry('r41001')]}
+    counts = newCounts()
+    databaseCore.flushStationRows(conn, pending, counts)
+    assert query(conn, "SELECT ExpID FROM Hb;") == [('r41000',)]
+    assert query(conn, "SELECT ExpID, status, parser_version, rows_written FROM ingest_ledger ORDER BY ExpID;") == [('r41000', 'parsed', 4, 1), ('r41001', 'failed', 4, 0)]
+    assert counts['rows'] == 1
+    assert pending['ledger'] == []
+
+def test_flush_nothing_queued(conn):
+    counts = newCounts()
+    databaseCore.flushStationRows(conn, {'rows': {}, 'sessions': {}, 'baselines': {}, 'ledger': []}, counts)
+    assert counts == newCounts()
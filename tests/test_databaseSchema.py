@@ -0,0 +1,72 @@
+from datetime import datetime
+import pytest
+
+import databaseSchema
+
+def stationRow(exp_id, **values):
+    # row ordered as STATION_COLUMNS, NULL where not given
+    values = dict({'Performance': 0.9, 'Analyser': 'GSFC'}, **values)
+    return [exp_id] + [values.get(col) for col in databaseSchema.STATION_COLUMNS[1:]]
+
+def storedRow(cursor, station, exp_id, unified=False):
+    return dict(zip(databaseSchema.STATION_COLUMNS, databaseSchema.fetchStationRows(cursor, exp_id, [station], unified)[station]))
+
+@pytest.mark.parametrize('unified', [False, True])
+def test_merge_rules(cursor, unified):
+    databaseSchema.createStationTables(cursor, ['Hb'], unified)
+    first = datetime(2024, 1, 2, 17, 30)
+    databaseSchema.upsertStationRows(cursor, {'Hb': [stationRow('r41000', Date=first, Date_MJD=60311.73, W_RMS_del=21.5, Notes='first')]}, unified)
+    databaseSchema.upsertStationRows(cursor, {'Hb': [stationRow('r41000', Performance=0.5, Analyser='USNO', Date=datetime(2024, 1, 3), Date_MJD=60312.0,
+                                                                W_RMS_del=None, Notes='second')]}, unified)
+    row = storedRow(cursor, 'Hb', 'r41000', unified)
+    assert row['Performance'] == 0.5 # replace
+    assert row['Analyser'] == 'USNO' # replace
+    assert row['W_RMS_del'] == 21.5 # coalesce keeps the stored value over a NULL
+    assert row['Notes'] == 'second' # coalesce takes a new value
+    assert row['Date'] == first # keep
+    assert row['Date_MJD'] == 60311.73 # keep
+
+@pytest.mark.parametrize('unified', [False, True])
+def test_corr_merge_rules(cursor, unified):
+    databaseSchema.createStationTables(cursor, ['Hb'], unified)
+    databaseSchema.upsertStationRows(cursor, {'Hb': [stationRow('r41000', Date=datetime(2024, 1, 2), Date_MJD=60311.0)]}, unified)
+    corr_date = datetime(2024, 1, 2, 17, 30)
+    databaseSchema.upsertStationRows(cursor, {'Hb': [stationRow('r41000', Date=corr_date, Date_MJD=60311.73)]}, unified, rules=databaseSchema.CORR_MERGE_RULES)
+    row = storedRow(cursor, 'Hb', 'r41000', unified)
+    assert row['Date'] == corr_date
+    assert row['Date_MJD'] == 60311.73
+    cursor.execute("SELECT Date FROM sessions WHERE ExpID = %s;", ['r41000'])
+    assert cursor.fetchone()[0] == corr_date
+
+def test_text_truncated(cursor):
+    databaseSchema.createStationTables(cursor, ['Hb'])
+    databaseSchema.upsertStationRows(cursor, {'Hb': [stationRow('r41000', Analyser='A'*20, Notes='n'*600)]})
+    row = storedRow(cursor, 'Hb', 'r41000')
+    assert row['Analyser'] == 'A'*10
+    assert len(row['Notes']) == 500
+
+def test_ledger_state(cursor):
+    databaseSchema.createStationTables(cursor, ['Hb'])
+    databaseSchema.recordIngest(cursor, [['r41000', 'analysis', None, None, None, 'parsed', 4, 2],
+                                         ['r41001', 'analysis', None, None, None, 'no_stations', 3, 0],
+                                         ['r41002', 'analysis', None, None, None, 'failed', 4, 0],
+                                         ['r41003', 'analysis', None, None, None, 'missing', 4, 0],
+                                         ['r41004', 'corr', None, None, None, 'parsed', 4, 2]])
+    # missing reports and other sources are not through the parser yet
+    assert databaseSchema.ledgerState(cursor) == {'r41000': 4, 'r41001': 3, 'r41002': 4}
+
+def test_seed_ledger(cursor):
+    databaseSchema.createStationTables(cursor, ['Hb', 'Ke'])
+    databaseSchema.upsertStationRows(cursor, {'Hb': [stationRow('r41000'), stationRow('r41001')], 'Ke': [stationRow('r41001')]})
+    assert databaseSchema.seedLedger(cursor, ['Hb', 'Ke'], 4) == 2
+    assert databaseSchema.ledgerState(cursor) == {'r41000': 4, 'r41001': 4}
+    # only an empty ledger is seeded
+    databaseSchema.upsertStationRows(cursor, {'Hb': [stationRow('r41002')]})
+    assert databaseSchema.seedLedger(cursor, ['Hb', 'Ke'], 5) == 0
+    assert databaseSchema.ledgerState(cursor) == {'r41000': 4, 'r41001': 4}
+
+def test_seed_ledger_unified(cursor):
+    databaseSchema.createStationTables(cursor, ['Hb', 'Ke'], unified=True)
+    databaseSchema.upsertStationRows(cursor, {'Hb': [stationRow('r41000')], 'Ke': [stationRow('r41000')]}, unified=True)
+    assert databaseSchema.seedLedger(cursor, ['Hb', 'Ke'], 4, unified=True) == 1
+    assert databaseSchema.ledgerState(cursor) == {'r41000': 4}
@@ -0,0 +1,56 @@
+import os
+import pytest
+
+import databaseAccess
+import databaseSchema
+import databaseSnapshot
+
+pytest.importorskip('pyarrow')
+
+def stationRow(exp_id, date_mjd, w_rms_del):
+    values = {'Performance': 0.9, 'Date_MJD': date_mjd, 'Analyser': 'GSFC', 'W_RMS_del': w_rms_del}
+    return [exp_id] + [values.get(col) for col in databaseSchema.STATION_COLUMNS[1:]]
+
+def writeRows(db, rows_by_station, unified=False):
+    with databaseAccess.connection(db) as conn:
+        cursor = conn.cursor()
+        databaseSchema.createStationTables(cursor, ['Hb', 'Ke'], unified)
+        databaseSchema.upsertStationRows(cursor, rows_by_station, unified)
+        conn.commit()
+        cursor.close()
+
+def snapshotValues(snapshot_dir, station, column='W_RMS_del'):
+    table = databaseSnapshot.readSnapshot(station, ['ExpID', column], snapshot_dir=snapshot_dir)
+    return dict(zip(table.column('ExpID').to_pylist(), table.column(column).to_pylist()))
+
+@pytest.mark.parametrize('unified', [False, True])
+def test_export_and_refresh(sqlite_db, tmp_path, unified):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    writeRows(sqlite_db, {'Hb': [stationRow('r41000', 60310.5, 10.0), stationRow('r42000', 59950.5, 20.0), stationRow('v4001', 60312.5, 30.0)],
+                          'Ke': [stationRow('r41000', 60310.5, 15.0)]}, unified)
+    databaseSnapshot.refreshSnapshot(sqlite_db, ['Hb', 'Ke'], unified, snapshot_dir)
+    assert sorted(os.listdir(os.path.join(snapshot_dir, 'station=Hb'))) == ['year=2023', 'year=2024']
+    assert snapshotValues(snapshot_dir, 'Hb') == {'r42000': 20.0, 'r41000': 10.0, 'v4001': 30.0}
+    table = databaseSnapshot.readSnapshot('Hb', ['ExpID'], mjd_start=60000, session_type='V', snapshot_dir=snapshot_dir)
+    assert table.column('ExpID').to_pylist() == ['v4001']
+
+    # only the touched partitions are re-exported
+    rows = {'Hb': [stationRow('r41001', 60315.5, 40.0)]}
+    writeRows(sqlite_db, rows, unified)
+    with databaseAccess.connection(sqlite_db) as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE " + ("station_sessions SET W_RMS_del = 99 WHERE station = 'Ke'" if unified else "Ke SET W_RMS_del = 99") + ";")
+        conn.commit()
+        cursor.close()
+    databaseSnapshot.refreshSnapshot(sqlite_db, ['Hb', 'Ke'], unified, snapshot_dir, databaseSnapshot.touchedPartitions(rows))
+    assert snapshotValues(snapshot_dir, 'Hb') == {'r42000': 20.0, 'r41000': 10.0, 'r41001': 40.0, 'v4001': 30.0}
+    assert snapshotValues(snapshot_dir, 'Ke') == {'r41000': 15.0}
+
+def test_no_snapshot_created(sqlite_db, tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    writeRows(sqlite_db, {'Hb': [stationRow('r41000', 60310.5, 10.0)]})
+    databaseSnapshot.refreshSnapshot(sqlite_db, ['Hb', 'Ke'], snapshot_dir=snapshot_dir, touched={('Hb', 2024)}, create=False)
+    assert not os.path.exists(snapshot_dir)
+    # without a snapshot, touched partitions are ignored and everything is exported
+    databaseSnapshot.refreshSnapshot(sqlite_db, ['Hb', 'Ke'], snapshot_dir=snapshot_dir, touched=set())
+    assert snapshotValues(snapshot_dir, 'Hb') == {'r41000': 10.0}
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import masterSchedule
+
+def record(code, stations):
+    return masterSchedule.sessionRecord(code, code.upper(), datetime(2024, 1, 1), 24.0, stations, 'WASH', 'NASA', 2)
+
+def test_participation_matrix():
+    records = [record('r11000', ('Hb', 'Ke', 'Wz')), record('r41000', ('Ke', 'Yg')), record('aua001', ('Wz',))]
+    station_names = ['Hb', 'Ke', 'Yg']
+    matrix = masterSchedule.participationMatrix(records, station_names)
+    assert matrix.dtype == bool
+    assert matrix.tolist() == [[True, True, False], [False, True, True], [False, False, False]]
+    assert [r.code for r in masterSchedule.sessionsWithStation(records, matrix, station_names, 'Ke')] == ['r11000', 'r41000']
+    assert masterSchedule.sessionsWithStation(records, matrix, station_names, 'Hb') == [records[0]]
+
+HEADER = '## Master file format version 2.0 2023.09.01 CCT\n'
+LINES = ['|IVS-R1|R11000|r11000|20240101|17:00|24:00|HbKeWz -Yg|NASA|WASH|20240120|WASH|NASA|    |\n',
+         '|IVS-R4|R41000|r41000|20240104|18:30|24:00|KeWzYs|USNO|WASH|20240122|WASH|USNO|    |\n',
+         '|AUS-AST|AUA001|aua001|20240105|00:00|24:00|WzYs|UTAS|HOBA|20240125|HOBA|UTAS|    |\n']
+
+def writeSchedule(path, lines):
+    path.write_text(HEADER + ''.join(lines))
+    return str(path)
+
+def test_diff_and_work_list(tmp_path, monkeypatch):
+    monkeypatch.setattr(masterSchedule, 'SCHEDULE_SESSIONS_FILE', str(tmp_path / 'schedule_sessions.json'))
+    schedule = writeSchedule(tmp_path / 'master2024.txt', LINES)
+    diff = masterSchedule.diffMasterSchedule(schedule, ['Hb', 'Ke'])
+    assert diff['valid'] == ['r11000', 'r41000'] # aua001 has no configured station
+    assert diff['changed'] == {'r11000', 'r41000'}
+    assert masterSchedule.recordFromDict(diff['sessions']['r11000']).stations == ('Hb', 'Ke', 'Wz')
+    assert masterSchedule.workList(diff, {'r11000'}) == ['r41000']
+    masterSchedule.saveScheduleDiff(diff, ['r41000'])
+
+    # unchanged schedule - only the session left pending is worked on
+    diff = masterSchedule.diffMasterSchedule(schedule, ['Hb', 'Ke'])
+    assert diff['changed'] == set()
+    assert masterSchedule.workList(diff, {'r11000'}) == ['r41000']
+    masterSchedule.saveScheduleDiff(diff, [])
+    assert masterSchedule.workList(masterSchedule.diffMasterSchedule(schedule, ['Hb', 'Ke']), set()) == []
+
+    # a station removed from one session changes only that line
+    schedule = writeSchedule(tmp_path / 'master2024.txt', [LINES[0].replace('HbKeWz -Yg', 'KeWz -HbYg')] + LINES[1:])
+    diff = masterSchedule.diffMasterSchedule(schedule, ['Hb', 'Ke'])
+    assert diff['changed'] == {'r11000'}
+    assert diff['sessions']['r11000']['stations'] == ['Ke', 'Wz']
+    masterSchedule.saveScheduleDiff(diff, [])
+
+    # a station added to the configuration re-derives participation without a changed line
+    diff = masterSchedule.diffMasterSchedule(schedule, ['Hb', 'Ke', 'Ys'])
+    assert diff['valid'] == ['r11000', 'r41000', 'aua001']
+    assert diff['changed'] == {'aua001'}
@@ -0,0 +1,45 @@
+import pytest
+
+import databaseSchema
+import monthlyAggregates
+
+def stationRow(exp_id, date_mjd, w_rms_del, performance=0.9):
+    values = {'Performance': performance, 'Date_MJD': date_mjd, 'Analyser': 'GSFC', 'W_RMS_del': w_rms_del}
+    return [exp_id] + [values.get(col) for col in databaseSchema.STATION_COLUMNS[1:]]
+
+def aggregates(cursor, metric):
+    return {(row['station'], row['month'], row['Session_Type']): row for row in monthlyAggregates.readAggregates(cursor, metric, '2000-01', '2100-01')}
+
+def test_month_helpers():
+    assert monthlyAggregates.mjdMonth(60310.0) == '2024-01'
+    assert monthlyAggregates.monthRange('2024-12') == (60645, 60676)
+    assert monthlyAggregates.touchedMonths({'Hb': [stationRow('r41000', 60310.5, 20.0), stationRow('r41001', None, 20.0)]}) == {('Hb', '2024-01')}
+
+@pytest.mark.parametrize('unified', [False, True])
+def test_refresh_aggregates(cursor, unified):
+    databaseSchema.createStationTables(cursor, ['Hb'], unified)
+    monthlyAggregates.createAggregatesTable(cursor)
+    rows = {'Hb': [stationRow('r41000', 60310.5, 10.0), stationRow('r41001', 60315.5, 30.0), stationRow('r41002', 60320.5, -999),
+                   stationRow('v4001', 60312.5, 15.0), stationRow('r41010', 60345.5, 25.0)]}
+    databaseSchema.upsertStationRows(cursor, rows, unified)
+    assert monthlyAggregates.refreshAggregates(cursor, monthlyAggregates.touchedMonths(rows), unified) == 6
+    wrms = aggregates(cursor, 'W_RMS_del')
+    assert sorted(wrms) == [('Hb', '2024-01', 'L'), ('Hb', '2024-01', 'V'), ('Hb', '2024-02', 'L')]
+    # the -999 placeholder is left out
+    assert (wrms[('Hb', '2024-01', 'L')]['n'], wrms[('Hb', '2024-01', 'L')]['min'], wrms[('Hb', '2024-01', 'L')]['median']) == (2, 10.0, 20.0)
+
+    # a new row only recomputes its own month
+    cursor.execute("UPDATE monthly_aggregates SET n = 99 WHERE month = '2024-02';")
+    new = {'Hb': [stationRow('r41003', 60325.5, 50.0)]}
+    databaseSchema.upsertStationRows(cursor, new, unified)
+    monthlyAggregates.refreshAggregates(cursor, monthlyAggregates.touchedMonths(new), unified)
+    wrms = aggregates(cursor, 'W_RMS_del')
+    assert (wrms[('Hb', '2024-01', 'L')]['n'], wrms[('Hb', '2024-01', 'L')]['max']) == (3, 50.0)
+    assert wrms[('Hb', '2024-02', 'L')]['n'] == 99
+
+def test_seed_aggregates(cursor):
+    databaseSchema.createStationTables(cursor, ['Hb', 'Ke'])
+    monthlyAggregates.createAggregatesTable(cursor)
+    databaseSchema.upsertStationRows(cursor, {'Hb': [stationRow('r41000', 60310.5, 10.0)], 'Ke': [stationRow('r41000', 60310.5, 12.0)]})
+    assert monthlyAggregates.seedAggregates(cursor, ['Hb', 'Ke']) == 4
+    assert monthlyAggregates.seedAggregates(cursor, ['Hb', 'Ke']) == 0
@@ -3,12 +3,28 @@
 from astropy.time import Time
 from datetime import datetime, timedelta
 import sys
+import argparse
 from astropy.io import ascii
 from SummaryGenerator import summaryGenerator
+import databaseSnapshot
 import os
 
 dirname = os.path.dirname(__file__)
 
+def parseFunc():
+    # Argument parsing
+    parser = argparse.ArgumentParser(description="""Generate the legacy and VGOS performance reports covering the last 180 days for every station in stations-reports.config.""")
+    parser.add_argument('sql_db_name',
+                        help="""The name of the SQL database to report on.""")
+    parser.add_argument('--unified-schema', dest='unified', action='store_true', default=False,
+                        help="""Read from the unified station_sessions table instead of the per-station tables.""")
+    parser.add_argument('--snapshot-dir', dest='snapshot_dir', default=databaseSnapshot.DEFAULT_SNAPSHOT_DIR,
+                        help="""Parquet snapshot written by databaseCore.py to read the station data from, the database is only queried if it is missing.""")
+    parser.add_argument('--no-snapshot', dest='snapshot_dir', action='store_const', const=None,
+                        help="""Always read from the database.""")
+    args = parser.parse_args()
+    return args
+
 def stationParse(stations_config= dirname + '/stations-reports.config'):
     with open(stations_config) as file:
         station_contents = file.read()
@@ -21,7 +37,7 @@ def stationParse(stations_config= dirname + '/stations-reports.config'):
         stationNamesLong = stationTable['full'][:]
     return stationNames, stationNamesLong
 
-def main(database_name):
+def main(database_name, unified=False, snapshot_dir=databaseSnapshot.DEFAULT_SNAPSHOT_DIR):
     if not os.path.exists(dirname + '/reports'):
         os.makedirs(dirname + '/reports') 
     # sort out date range...
@@ -35,13 +51,14 @@ def main(database_name):
         output_name_legacy = dirname + '/reports/' + station + '_legacy_' + today_date.strftime("%Y%m%d") + '.pdf'
         output_name_vgos = dirname + '/reports/' + station + '_VGOS_' + today_date.strftime("%Y%m%d") + '.pdf'
         try:
-            summaryGenerator.main(station, database_name, start_date, end_date, output_name_legacy, "v%", 1)
+            summaryGenerator.main(station, database_name, start_date, end_date, output_name_legacy, "v%", 1, unified, snapshot_dir)
         except Exception as e:
             print(f"Unable to generate legacy performance report for {str(station)}.\nException: {e}\nCheck whether sufficient data is available.")
         try:
-            summaryGenerator.main(station, database_name, start_date, end_date, output_name_vgos, "v%", 0)
+            summaryGenerator.main(station, database_name, start_date, end_date, output_name_vgos, "v%", 0, unified, snapshot_dir)
         except Exception as e:
             print(f"Unable to generate VGOS performance report for {str(station)}.\nException: {e}\nCheck whether sufficient data is available.")
 
 if __name__ == '__main__':
-    main(sys.argv[1])
+    args = parseFunc()
+    main(args.sql_db_name, args.unified, args.snapshot_dir)